@@ -0,0 +1,96 @@
+"""
+Bookkeeping of the incremental re-sync of documents to anki, see
+Autocards.sync_anki.
+
+Each card gets a stable identifier derived from its source, the hash of the
+paragraph it was made from and its answer, so that consuming an unchanged
+paragraph again always gives the same identifiers. A manifest per source,
+stored as json, remembers the paragraphs already turned into cards and the
+anki note of each card: a re-sync only regenerates the paragraphs that are
+new or were edited, and only touches the notes of those paragraphs.
+"""
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+MANIFEST_DIR = ".autocards_sync"
+
+
+def _digest(text, size=16):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=size).hexdigest()
+
+
+def paragraph_hash(text):
+    "Hash of a paragraph, ignoring changes of spacing"
+    return _digest(" ".join(text.split()))
+
+
+def answer_key(card):
+    """
+    What a card asks for: its note type and its normalized answer, or the
+    clozed text of a cloze card
+    """
+    answer = card["answer"]
+    if card["note_type"] == "cloze":
+        clozed = re.search(r"{{c1::(.*?)}}", card["cloze"])
+        answer = clozed.group(1) if clozed else card["cloze"]
+    return f"{card['note_type']}:{' '.join(answer.lower().split())}"
+
+
+def card_ids(source, par_hash, cards):
+    """
+    Stable identifiers of the cards made from one paragraph. Cards of the
+    paragraph asking for the same answer are numbered in order.
+    """
+    ids = []
+    seen = {}
+    for card in cards:
+        key = answer_key(card)
+        seen[key] = seen.get(key, 0) + 1
+        ids.append(_digest(f"{source}\0{par_hash}\0{key}\0{seen[key]}"))
+    return ids
+
+
+class Manifest:
+    """
+    What was sent to anki for one source:
+        - paragraphs: hash of each paragraph -> identifiers of its cards
+        - cards: identifier -> {"note": anki note id, None if it could not
+          be added, "key": answer_key of the card}
+        - orphans: note ids of cards whose paragraph disappeared and that
+          were not deleted from anki
+    """
+
+    def __init__(self, source, manifest_dir=None):
+        self.source = source
+        manifest_dir = Path(manifest_dir or MANIFEST_DIR).expanduser()
+        self.path = manifest_dir / f"{_digest(source, 8)}.json"
+        self.paragraphs = {}
+        self.cards = {}
+        self.orphans = []
+        if self.path.exists():
+            with open(self.path) as f:
+                content = json.load(f)
+            self.paragraphs = content["paragraphs"]
+            self.cards = content["cards"]
+            self.orphans = content["orphans"]
+
+    def is_complete(self, par_hash):
+        "Whether all the cards of that paragraph are in anki"
+        ids = self.paragraphs.get(par_hash)
+        return ids is not None and all(self.cards[i]["note"] is not None
+                                       for i in ids)
+
+    def save(self):
+        "Write the manifest, atomically"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"source": self.source,
+                       "paragraphs": self.paragraphs,
+                       "cards": self.cards,
+                       "orphans": self.orphans}, f, indent=1)
+        os.replace(tmp, self.path)
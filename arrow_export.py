@@ -0,0 +1,135 @@
+"""
+Columnar exports of cards with pyarrow: Arrow tables, Parquet and Feather
+(Arrow IPC) files. Tables are built straight from the card dictionnaries, a
+batch of rows at a time, so a large deck never has to be held in memory as
+a DataFrame. note_type, source_title and date are dictionary encoded and
+the source texts compressed.
+"""
+
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.ipc as ipc
+
+DICTIONARY_COLUMNS = ["note_type", "source_title", "date"]
+COMPRESSED_COLUMNS = ["source_text", "source_text_orig"]
+
+
+def card_schema(cards):
+    """
+    Arrow schema with one column per card field, in order of first
+    appearance. Fields found in some cards only are nullable columns.
+    """
+    types = {}
+    for card in cards:
+        for key, value in card.items():
+            if types.get(key) is None:
+                types[key] = _arrow_type(key, value)
+    return pa.schema([(key, typ or pa.string()) for key, typ in types.items()])
+
+
+def _arrow_type(key, value):
+    if key in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if value is None:
+        return None  # decided by a later card
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64()
+    if isinstance(value, float):
+        return pa.float64()
+    return pa.string()
+
+
+class _DictionaryEncoder:
+    """
+    Dictionary encoding that grows across batches: the dictionary of each
+    batch extends the one of the previous batch, which the IPC file format
+    can store as dictionary deltas.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def encode(self, values):
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            value = str(value)
+            if value not in self.index:
+                self.index[value] = len(self.values)
+                self.values.append(value)
+            indices.append(self.index[value])
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, type=pa.int32()),
+            pa.array(self.values, type=pa.string()))
+
+
+def iter_batches(cards, schema, batch_size=10000):
+    "Yield the cards as RecordBatches of batch_size rows"
+    encoders = {field.name: _DictionaryEncoder() for field in schema
+                if pa.types.is_dictionary(field.type)}
+    for start in range(0, len(cards), batch_size):
+        chunk = cards[start:start + batch_size]
+        arrays = []
+        for field in schema:
+            values = [card.get(field.name) for card in chunk]
+            if field.name in encoders:
+                arrays.append(encoders[field.name].encode(values))
+            elif pa.types.is_string(field.type):
+                arrays.append(pa.array(
+                    [None if v is None else str(v) for v in values],
+                    type=field.type))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def to_table(cards, batch_size=10000):
+    "Arrow table of the cards"
+    schema = card_schema(cards)
+    return pa.Table.from_batches(list(iter_batches(cards, schema, batch_size)),
+                                 schema=schema)
+
+
+def write_parquet(cards, filename, row_group_size=10000):
+    """
+    Write the cards to a Parquet file, one row group of row_group_size cards
+    at a time. Source texts are compressed with zstd, other columns with
+    snappy.
+    """
+    schema = card_schema(cards)
+    compression = {field.name: "zstd" if field.name in COMPRESSED_COLUMNS
+                   else "snappy" for field in schema}
+    with pq.ParquetWriter(str(filename), schema,
+                          compression=compression) as writer:
+        for batch in iter_batches(cards, schema, row_group_size):
+            writer.write_table(pa.Table.from_batches([batch], schema=schema))
+    return Path(filename)
+
+
+def write_feather(cards, filename, batch_size=10000, compression="zstd"):
+    """
+    Write the cards to a Feather (Arrow IPC) file, one record batch of
+    batch_size cards at a time. Use compression=None for files that are
+    read back memory-mapped without any copy.
+    """
+    schema = card_schema(cards)
+    options = ipc.IpcWriteOptions(compression=compression,
+                                  emit_dictionary_deltas=True)
+    with ipc.new_file(str(filename), schema, options=options) as writer:
+        for batch in iter_batches(cards, schema, batch_size):
+            writer.write_batch(batch)
+    return Path(filename)
+
+
+def read_cards(filename):
+    "Read back a Parquet or Feather export as an Arrow table, memory-mapped"
+    if str(filename).endswith(".parquet"):
+        return pq.read_table(str(filename), memory_map=True)
+    return ipc.open_file(pa.memory_map(str(filename))).read_all()
@@ -0,0 +1,214 @@
+import asyncio
+import queue
+import threading
+from functools import partial
+from pathlib import Path
+
+from autocards import Autocards
+
+
+class _Request:
+    "Text units of one consume_* call going through the shared pipeline"
+
+    def __init__(self, loop, n_units):
+        self.future = loop.create_future()
+        self.remaining = n_units
+        self.in_flight = 0  # units given to the pipeline and not done
+        self.failed = False
+        self.cards = []
+
+
+class AsyncAutocards:
+    """
+    asyncio facade over Autocards, to be used from async services. Each
+    consume_* method is a coroutine that returns the qa pairs created by that
+    call (they are also appended to the shared qa_dic_list as usual).
+
+    All model inference runs in a single long lived stage pipeline of the
+    Autocards instance (see stages.py) fed by every call, so that the text
+    units of concurrent calls, from different documents, are batched
+    together without blocking the event loop. A batch that is not full is
+    processed max_wait seconds after its first unit arrived. max_in_flight
+    bounds the number of text units given to the pipeline and not done yet:
+    callers above the limit wait before submitting more. File reading,
+    parsing and filtering run in the loop's default executor.
+
+    Either pass an existing Autocards instance with autocards=..., or the
+    arguments used to create one as keyword arguments.
+    """
+
+    def __init__(self, autocards=None, max_in_flight=32, fetch_timeout=15,
+                 max_wait=0.05, **kwargs):
+        if autocards is None:
+            autocards = Autocards(**kwargs)
+        self.autocards = autocards
+        self.max_in_flight = max_in_flight
+        self.fetch_timeout = fetch_timeout
+        self.max_wait = max_wait
+        self._feed = queue.Queue()
+        self._thread = None
+        self._in_flight = None
+        self._pending = set()
+
+    @property
+    def qa_dic_list(self):
+        return self.autocards.qa_dic_list
+
+    async def _run_blocking(self, func, *args):
+        "Run func in the default executor, for I/O and parsing"
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args))
+
+    def _start(self):
+        "Start the inference thread, in the running event loop"
+        self._loop = asyncio.get_running_loop()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._thread = threading.Thread(target=self._run_pipeline,
+                                        name="autocards-inference",
+                                        daemon=True)
+        self._thread.start()
+
+    def _run_pipeline(self):
+        """
+        Run the units put in self._feed through the stage pipeline until
+        close(). The pipeline is started again after an error, which fails
+        the calls waiting for their cards.
+        """
+        while True:
+            try:
+                pipeline = self.autocards.pipeline()
+                pipeline.max_wait = self.max_wait
+                # the text units are already cut and filtered, so that each
+                # one comes out of the pipeline
+                for name in ["ingest", "clean", "segment", "filter"]:
+                    pipeline.remove(name)
+                for unit in pipeline.stream(self._feed):
+                    self._loop.call_soon_threadsafe(
+                        self._unit_done, unit.meta["request"], unit.cards)
+                return
+            except Exception as e:
+                self._loop.call_soon_threadsafe(self._fail_pending, e)
+
+    def _unit_done(self, request, cards):
+        if request.failed:
+            return  # its slots were given back
+        self._in_flight.release()
+        request.in_flight -= 1
+        request.cards.extend(cards or [])
+        request.remaining -= 1
+        if request.remaining == 0:
+            self._pending.discard(request)
+            if not request.future.done():
+                request.future.set_result(request.cards)
+
+    def _fail_pending(self, error):
+        for request in self._pending:
+            request.failed = True
+            for _ in range(request.in_flight):
+                self._in_flight.release()
+            if not request.future.done():
+                request.future.set_exception(error)
+        self._pending.clear()
+
+    async def _consume_units(self, units, title):
+        "qa pairs of text units made by the shared pipeline, see stages.py"
+        from stages import Unit
+
+        units = await self._run_blocking(self.autocards._filter_units, units)
+        if not units:
+            return []
+        if self._thread is None:
+            self._start()
+        request = _Request(self._loop, len(units))
+        self._pending.add(request)
+        try:
+            for text in units:
+                await self._in_flight.acquire()
+                if request.failed:
+                    self._in_flight.release()
+                    break
+                request.in_flight += 1
+                self._feed.put(Unit(text=text, title=title,
+                                    meta={"request": request}))
+            return await request.future
+        except asyncio.CancelledError:
+            # the units already given are still run, their cards dropped
+            request.remaining = request.in_flight
+            if request.remaining == 0:
+                self._pending.discard(request)
+            raise
+
+    async def consume_var(self, text, title="untitled variable",
+                          per_paragraph=False, packed=False):
+        "Take text as input and return the created qa pairs"
+        units = await self._run_blocking(self.autocards._split_var,
+                                         text, per_paragraph, packed)
+        return await self._consume_units(units, title)
+
+    async def consume_textfile(self, filepath, per_paragraph=False,
+                               packed=False):
+        """
+        Take text file as input and return the created qa pairs. Unlike
+        Autocards.consume_textfile this never asks for confirmation.
+        """
+        if not Path(filepath).exists():
+            print(f"File not found at {filepath}")
+            return []
+        text = await self._run_blocking(Path(filepath).read_text)
+        text = self.autocards._sanitize_text(text)
+        filename = str(filepath).split("/")[-1]
+        return await self.consume_var(text, filename, per_paragraph, packed)
+
+    async def consume_pdf(self, pdf_path, per_paragraph=True, packed=False):
+        "Take pdf file as input and return the created qa pairs"
+        if not Path(pdf_path).exists():
+            print(f"PDF file not found at {pdf_path}!")
+            return []
+        title, text = await self._run_blocking(self.autocards._read_pdf,
+                                               pdf_path)
+        return await self.consume_var(text, title, per_paragraph, packed)
+
+    async def consume_epub(self, filepath, title="untitled epub file",
+                           packed=False):
+        "Take an epub file as input and return the created qa pairs"
+        text = await self._run_blocking(self.autocards._read_epub, filepath)
+        return await self.consume_var(text, title, True, packed)
+
+    async def fetch(self, url):
+        """
+        Download a page without blocking the event loop. Uses aiohttp if it
+        is installed, otherwise requests in the default executor.
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            import requests
+            res = await self._run_blocking(
+                partial(requests.get, url, timeout=self.fetch_timeout))
+            return res.content
+        timeout = aiohttp.ClientTimeout(total=self.fetch_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url) as res:
+                return await res.read()
+
+    async def consume_web(self, source, mode="url", element="p"):
+        "Take html file (local or via url) and return the created qa pairs"
+        if mode not in ["local", "url"]:
+            print("Invalid mode, must be either 'local' or 'url'")
+            return []
+        if mode == "local":
+            html = await self._run_blocking(Path(source).read_text)
+        else:
+            html = await self.fetch(source)
+
+        title, sections = await self._run_blocking(self.autocards._parse_web,
+                                                   html, source, element)
+        sections = [self.autocards._sanitize_text(s) for s in sections]
+        return await self._consume_units(sections, title)
+
+    def close(self):
+        "Stop the inference thread once pending work is done"
+        if self._thread is not None:
+            self._feed.put(None)
+            self._thread.join()
+            self._thread = None
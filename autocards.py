@@ -1,22 +1,38 @@
-from pipelines import qg_pipeline
-
 from tqdm import tqdm
 from pathlib import Path
-import pandas as pd
+import threading
 import time
+import weakref
 import re
 import os
 from contextlib import suppress
+from collections import defaultdict
+from functools import wraps
 
 import json
 import urllib.request
-import requests
-from tika import parser
-from bs4 import BeautifulSoup
 from pprint import pprint
-from epub_conversion.utils import open_book, convert_epub_to_lines
 
-os.environ["TOKENIZERS_PARALLELISM"] = "true"
+# Heavy or format specific dependencies (torch and transformers through
+# pipelines, pandas, nltk, tika, BeautifulSoup, epub_conversion, requests)
+# are imported by the methods that need them to keep `import autocards` fast,
+# see benchmarks/import_time.py
+
+# can be changed by the profile written by autotune.py
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+
+def _with_model_lock(method):
+    """
+    Run method holding the model lock of the instance: the models and
+    tokenizers, shared with other instances by the model registry, are not
+    safe to call from several threads at once
+    """
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._model_lock:
+            return method(self, *args, **kwargs)
+    return locked
 
 
 class Autocards:
@@ -24,10 +40,15 @@ class Autocards:
     Main class used to create flashcards from text. The variable
     'store_content' defines whether the original paragraph is stored in the
     output. This allows to store context alongside the question and answer pair
-    but dramatically increase size. The variable notetype refers to the type
-    of flashcard that must be created: either cloze, basic or both. The
-    variable wtm allow to specify wether you want to remove the mention of
-    Autocards in your cards.
+    but dramatically increase size. The variable note_type refers to the type
+    of flashcard that must be created: either "cloze", "basic" or "both".
+    The other options (engine, verify, cascade, text_filter, profile...) are
+    described in the README. Models are loaded the first time they are
+    needed, call warmup() to load them beforehand.
+
+    An instance keeps the qa pairs and the title of what it consumes, so it
+    must not be used from several threads at once, give each thread its own
+    session() instead.
     """
 
     def __init__(self,
@@ -36,76 +57,510 @@ class Autocards:
                  out_lang="en",
                  cloze_type="anki",
                  model = "valhalla/distilt5-qa-qg-hl-12-6",
-                 ans_model = "valhalla/distilt5-qa-qg-hl-12-6"):
-        print("Loading backend, this can take some time...")
+                 ans_model = "valhalla/distilt5-qa-qg-hl-12-6",
+                 token_budget=None,
+                 model_dir=None,
+                 text_filter=True,
+                 verify=False,
+                 verify_threshold=0.5,
+                 engine="qg",
+                 e2e_model="valhalla/t5-small-e2e-qg",
+                 html_parser=None,
+                 batch_size=None,
+                 profile=True,
+                 constrained_answers=True,
+                 note_type="both",
+                 cascade=None,
+                 cascade_threshold=0.6):
         self.store_content = store_content
         self.model = model
         self.ans_model = ans_model
-
-        if len(out_lang) != 2 or len(in_lang) not in [2, 3]:
+        self.model_dir = model_dir
+        self.e2e_model = e2e_model
+        self.html_parser = html_parser
+        self.profile = None
+        if profile:
+            import autotune
+            loaded = autotune.load_profile(None if profile is True else profile)
+            if loaded is not None and (loaded["model"], loaded["ans_model"]) \
+                    == (model, ans_model):
+                self.profile = loaded
+                os.environ["TOKENIZERS_PARALLELISM"] = loaded["tokenizers_parallelism"]
+            elif loaded is not None:
+                print("Not using the autotune profile, it was made for \
+other models.")
+        if batch_size is None:
+            batch_size = self.profile["batch_size"] if self.profile else 1
+        self.batch_size = batch_size
+        self.constrained_answers = constrained_answers
+
+        if len(out_lang) != 2 or (len(in_lang) not in [2, 3] and in_lang != "auto"):
             print("Output and input language has to be a two letter code like 'en' or 'fr'")
             raise SystemExit()
         if in_lang == "any":  # otherwise the user might thought that the
             in_lang = "en"    # input has to be in english
-        if in_lang != "en":
-            print("The document will automatically be translated before \
-creating flashcards. Expect lower quality cards than usual.")
-            try:
-                print("Loading input translation model...")
-                from transformers import pipeline
-                self.in_trans = pipeline(f"translation_{in_lang}_to_en",
-                                      model = f"Helsinki-NLP/opus-mt-{in_lang}-en")
-            except Exception as e:
-                print(f"Was not able to load translation pipeline: {e}")
-                print("Resetting input language to english.")
-                in_lang = "en"
-        if out_lang != "en":
-            print("The flashcards will be automatically translated after being \
-created. This can result in lower quality cards. Expect lowest quality cards \
-than usual.")
-            try:
-                print("Loading output translation model...")
-                from transformers import pipeline
-                self.out_trans = pipeline(f"translation_en_to_{out_lang}",
-                                      model = f"Helsinki-NLP/opus-mt-en-{out_lang}")
-            except Exception as e:
-                print(f"Was not able to load translation pipeline: {e}")
-                print("Resetting output language to english.")
-                out_lang = "en"
         self.in_lang = in_lang
         self.out_lang = out_lang
+        self.translation_batch_size = 16
+        self._auto_trans = {}
 
         self.cloze_type = cloze_type
-        self.qg = qg_pipeline('question-generation',
-                              model=model,
-                              ans_model=ans_model)
+        if note_type not in ["cloze", "basic", "both"]:
+            print("Invalid note type, must be either 'cloze', 'basic' or \
+'both'")
+            raise SystemExit()
+        self.note_type = note_type
+        self._qg = None
+        self._counting = None
+        from model_registry import ModelLock
+
+        self._load_lock = threading.Lock()
+        self._registry_keys = []
+        # held while calling the models, shared with the sessions and, for
+        # each model, with the other instances using it
+        self._model_lock = ModelLock(self._registry_keys)
         self.qa_dic_list = []
+        self._index = None
+        self._estimate_report = None
+        self._calibration = None
+        self._token_budget = token_budget
+        if text_filter is True:
+            from text_filter import TextFilter
+            text_filter = TextFilter()
+        self.text_filter = text_filter or None
+        self.verify = verify
+        self.verify_threshold = verify_threshold
+        self._qa = None
+
+        if engine not in ["qg", "e2e"]:
+            print("Invalid engine, must be either 'qg' or 'e2e'")
+            raise SystemExit()
+        self.engine = engine
+        if engine == "e2e" and verify:
+            print("The answers of the e2e engine already come from question \
+answering, not verifying them.")
+            self.verify = False
+        self.cascade = cascade
+        self.cascade_threshold = cascade_threshold
+        if engine == "e2e" and cascade is not None:
+            print("The cascade is only available with the qg engine, not \
+using it.")
+            self.cascade = None
+        if note_type == "cloze" and self.verify:
+            print("Only cloze cards are made, there are no questions to \
+verify.")
+            self.verify = False
 
         if self.cloze_type not in ["anki", "SM"]:
             print("Invalid cloze type, must be either 'anki' or \
 'SM'")
             raise SystemExit()
+        if self.cloze_type == "SM":
+            print("SM cloze not yet implemented, luckily SuperMemo supports \
+importing from anki format. Hence the anki format will be used for your \
+input.")
+            self.cloze_type = "anki"
+
+    def warmup(self):
+        """
+        Load the question generation and translation models if that was not
+        done already. Otherwise they are loaded on first use.
+        """
+        if self._qg is not None:
+            return
+        with self._load_lock:
+            if self._qg is not None:
+                return
+            print("Loading backend, this can take some time...")
+            if self.in_lang == "auto":
+                try:
+                    import langid
+                    print("The language of each text will be detected and \
+texts that are not in english translated before creating flashcards. Expect \
+lower quality cards than usual for those.")
+                except ImportError:
+                    print("Language detection needs the langid package: \
+pip install langid")
+                    print("Resetting input language to english.")
+                    self.in_lang = "en"
+            elif self.in_lang != "en":
+                print("The document will automatically be translated before \
+creating flashcards. Expect lower quality cards than usual.")
+                try:
+                    print("Loading input translation model...")
+                    self.in_trans = self._translation_pipeline(self.in_lang, "en")
+                except Exception as e:
+                    print(f"Was not able to load translation pipeline: {e}")
+                    print("Resetting input language to english.")
+                    self.in_lang = "en"
+            if self.out_lang != "en":
+                print("The flashcards will be automatically translated after being \
+created. This can result in lower quality cards. Expect lowest quality cards \
+than usual.")
+                try:
+                    print("Loading output translation model...")
+                    self.out_trans = self._translation_pipeline("en", self.out_lang)
+                except Exception as e:
+                    print(f"Was not able to load translation pipeline: {e}")
+                    print("Resetting output language to english.")
+                    self.out_lang = "en"
+
+            from pipelines import qg_pipeline, E2ECardPipeline
+            if self.engine == "e2e":
+                qg = E2ECardPipeline(
+                    qg_pipeline('e2e-qg',
+                                model=self.e2e_model,
+                                model_dir=self.model_dir),
+                    qg_pipeline('multitask-qa-qg',
+                                model=self.ans_model,
+                                model_dir=self.model_dir))
+            else:
+                qg = qg_pipeline('question-generation',
+                                 model=self.model,
+                                 ans_model=self.ans_model,
+                                 model_dir=self.model_dir)
+            self._track(qg.registry_keys)
+            qg.note_type = self.note_type
+            if self.engine == "qg":
+                qg.constrained_answers = self.constrained_answers
+                if self.cascade is not None:
+                    qg.cascade = self._cascade_model(qg)
+                    qg.cascade_threshold = self.cascade_threshold
+            if self.profile is not None:
+                import torch
+                torch.set_num_threads(self.profile["threads"])
+                if self.engine == "qg":
+                    qg.num_beams = self.profile["num_beams"]
+            if self.verify:
+                # same model as the qg pipeline, shared through the registry
+                self._qa = qg_pipeline('multitask-qa-qg',
+                                       model=self.model,
+                                       model_dir=self.model_dir)
+                self._track(self._qa.registry_keys)
+            self._qg = qg
+            # release the models when this instance is garbage collected
+            self._finalizer = weakref.finalize(self, self._release_models,
+                                               self._registry_keys)
+
+    def _cascade_model(self, qg):
+        """
+        Model decoding the questions first for qg, self.cascade being
+        "greedy" or the name of a smaller model sharing the tokenizer of qg
+        """
+        if self.cascade == "greedy":
+            return qg.model
+        from pipelines import _load_model
+
+        loaded = []
+        model = _load_model(self.cascade, self.model_dir, loaded)
+        self._track(loaded)
+        if (model.config.model_type, model.config.vocab_size) \
+                != (qg.model.config.model_type, qg.model.config.vocab_size):
+            print(f"{self.cascade} does not share the tokenizer of \
+{self.model}, decoding greedily with {self.model} instead.")
+            self.cascade = "greedy"
+            return qg.model
+        return model.to(qg.device)
+
+    def _translation_pipeline(self, src, tgt):
+        """
+        Get the Helsinki-NLP translation pipeline from src to tgt language
+        from the model registry, loading it if needed
+        """
+        from model_registry import registry
+
+        name = f"Helsinki-NLP/opus-mt-{src}-{tgt}"
+
+        def load():
+            from transformers import pipeline
+            from pipelines import _read_model, _read_tokenizer
+            return pipeline(f"translation_{src}_to_{tgt}",
+                            model=_read_model(name, self.model_dir),
+                            tokenizer=_read_tokenizer(name, self.model_dir))
+
+        trans = registry.acquire("translation", name, load)
+        self._track([("translation", name)])
+        return trans
+
+    def _track(self, keys):
+        "Add registry keys to the ones of this instance, see _model_lock"
+        self._registry_keys.extend(keys)
+        self._model_lock.refresh()
+
+    @staticmethod
+    def _release_models(keys):
+        from model_registry import registry
+        registry.release_all(keys)
+        keys.clear()
+
+    def close(self):
+        """
+        Give the models back to the model registry, which can then evict them
+        if no other instance uses them. Models are loaded again if needed.
+        """
+        with self._load_lock:
+            self._release_models(self._registry_keys)
+            self._qg = None
+            self._counting = None
+            self._qa = None
+            with suppress(AttributeError):
+                del self.in_trans
+            with suppress(AttributeError):
+                del self.out_trans
+            self._auto_trans = {}
+
+    def session(self):
+        """
+        New AutocardsSession sharing the settings and the loaded models of
+        this instance, with its own qa pairs. Use one session per thread to
+        consume documents concurrently on a single copy of the models.
+        """
+        return AutocardsSession(self)
 
-    def _call_qg(self, text, title):
+    @property
+    def qg(self):
+        "Question generation pipeline, loaded on first use"
+        if self._qg is None:
+            self.warmup()
+        return self._qg
+
+    def _counter(self):
+        """
+        Pipeline counting the tokens of the model inputs: self.qg if it is
+        loaded, otherwise one with the tokenizers only, so that estimate()
+        and packing do not load the models
+        """
+        if self._qg is not None:
+            return self._qg
+        with self._load_lock:
+            if self._counting is None:
+                from pipelines import qg_pipeline, E2ECardPipeline
+                if self.engine == "e2e":
+                    counting = E2ECardPipeline(
+                        qg_pipeline('e2e-qg', model=self.e2e_model,
+                                    model_dir=self.model_dir,
+                                    tokenizer_only=True),
+                        qg_pipeline('multitask-qa-qg', model=self.ans_model,
+                                    model_dir=self.model_dir,
+                                    tokenizer_only=True))
+                else:
+                    counting = qg_pipeline('question-generation',
+                                           model=self.model,
+                                           ans_model=self.ans_model,
+                                           model_dir=self.model_dir,
+                                           tokenizer_only=True)
+                self._track(counting.registry_keys)
+                self._finalizer = weakref.finalize(self, self._release_models,
+                                                   self._registry_keys)
+                self._counting = counting
+            return self._counting
+
+    @property
+    def token_budget(self):
+        if self._token_budget is None:
+            self._token_budget = self._counter().content_token_budget()
+        return self._token_budget
+
+    def _call_qg(self, text, title, text_orig=None):
         """
         Call question generation module, then turn the answer into a
         dictionnary containing metadata (clozed formating, creation time,
-        title, source text)
+        title, source text). The new qa pairs are appended to
+        self.qa_dic_list and returned. text_orig is given when text was
+        already translated by _translate_in_batch.
         """
-        to_add = []
+        if text_orig is None:
+            text, text_orig = self._translate_in(text)
+        to_add = self._qg_batch([text])[0]
+        return self._format_qa(to_add, text, text_orig, title,
+                               self.qa_dic_list)
+
+    @_with_model_lock
+    def _qg_batch(self, texts):
+        """
+        Output of the question generation module for each text, given in a
+        single batch, None for the texts no card could be made from.
+        Outputs are verified if self.verify is set.
+        """
+        try:
+            outputs = self.qg(texts)
+        except IndexError:
+            # one of the texts gives no answer to ask about
+            if len(texts) == 1:
+                return [None]
+            return [self._qg_batch([text])[0] for text in texts]
+        if self.verify:
+            outputs = [self._verify_qa(to_add, text) if to_add else to_add
+                       for text, to_add in zip(texts, outputs)]
+        return outputs
+
+    def _filter_units(self, units):
+        "Text units worth a model call, according to self.text_filter"
+        if self.text_filter is not None:
+            before = dict(self.text_filter.dropped)
+            kept = self.text_filter.filter(units)
+            if len(kept) != len(units):
+                dropped = {reason: n - before.get(reason, 0) for reason, n
+                           in self.text_filter.dropped.items()
+                           if n != before.get(reason, 0)}
+                tqdm.write(f"Skipping {len(units) - len(kept)} text units \
+not worth creating cards from: " + ", ".join(f"{n} {reason}" for reason, n
+                                             in dropped.items()))
+            units = kept
+        return units
+
+    @staticmethod
+    def _answer_tokens(answer):
+        "SQuAD style normalization of an answer, as a list of tokens"
+        answer = answer.lower()
+        answer = re.sub(r"[^\w\s]", " ", answer)
+        answer = re.sub(r"\b(a|an|the)\b", " ", answer)
+        return answer.split()
+
+    def _answers_match(self, expected, answer):
+        "Whether the token F1 of the two answers reaches verify_threshold"
+        expected = self._answer_tokens(expected)
+        answer = self._answer_tokens(answer)
+        if not expected or not answer:
+            return expected == answer
+        common = sum(min(expected.count(t), answer.count(t))
+                     for t in set(expected))
+        if common == 0:
+            return False
+        precision = common / len(answer)
+        recall = common / len(expected)
+        return 2 * precision * recall / (precision + recall) >= self.verify_threshold
+
+    @_with_model_lock
+    def _verify_qa(self, to_add, text):
+        """
+        Answer the question of each basic card against text, in batches, and
+        drop the cards whose answer doesn't match
+        """
+        self.warmup()
+        basic = [qa for qa in to_add if qa["note_type"] == "basic"]
+        if not basic:
+            return to_add
+        answers = self._qa.answer_questions([(qa["question"], text)
+                                             for qa in basic])
+        rejected = {id(qa) for qa, answer in zip(basic, answers)
+                    if not self._answers_match(qa["answer"], answer)}
+        if rejected:
+            tqdm.write(f"Dropped {len(rejected)} of {len(basic)} cards whose \
+question is not answered by their answer.")
+        return [qa for qa in to_add if id(qa) not in rejected]
+
+    def _translate_in(self, text):
+        "Return the text to create qa pairs from and the original text"
+        return self._translate_in_batch([text])[0]
+
+    @_with_model_lock
+    def _translate_in_batch(self, texts):
+        """
+        Return the text to create qa pairs from and the original text (empty
+        if no translation was needed) of each text. Texts are grouped by
+        language and each group is translated in batches of
+        self.translation_batch_size.
+        """
+        self.warmup()  # can reset in_lang
+        translated = [(text, "") for text in texts]
+        if self.in_lang == "en":
+            return translated
+
+        groups = defaultdict(list)
+        for i, text in enumerate(texts):
+            lang = self._detect_language(text) if self.in_lang == "auto" \
+                else self.in_lang
+            if lang != "en" and text.strip():
+                groups[lang].append(i)
+
+        for lang, indices in groups.items():
+            trans = self._in_trans_for(lang)
+            if trans is None:
+                continue
+            bs = self.translation_batch_size
+            for start in range(0, len(indices), bs):
+                batch = indices[start:start + bs]
+                res = trans([texts[i] for i in batch])
+                for i, r in zip(batch, res):
+                    translated[i] = (r["translation_text"], str(texts[i]))
+        return translated
+
+    def _detect_language(self, text):
+        "Two letter code of the language of a text"
+        import langid
+        return langid.classify(text)[0]
+
+    def _in_trans_for(self, lang):
+        """
+        Translation pipeline from lang to english, None if it can't be
+        loaded. With in_lang="auto" pipelines are loaded on first use.
+        """
+        if self.in_lang != "auto":
+            return self.in_trans
+        if lang not in self._auto_trans:
+            try:
+                print(f"Loading input translation model for '{lang}'...")
+                self._auto_trans[lang] = self._translation_pipeline(lang, "en")
+            except Exception as e:
+                print(f"Was not able to load translation pipeline: {e}")
+                print(f"Texts detected as '{lang}' will not be translated.")
+                self._auto_trans[lang] = None
+        return self._auto_trans[lang]
+
+    @_with_model_lock
+    def _translate_qa(self, to_add):
+        """
+        Translate the output of the question generation module for one text
+        to self.out_lang, keeping the english version in the *_orig fields
+        """
+        self.warmup()  # can reset out_lang
+        if self.out_lang == "en":
+            return to_add
+        for qa in to_add:
+            if qa["note_type"] == "basic":
+                qa["question_orig"] = qa["question"]
+                qa["answer_orig"] = qa["answer"]
+                qa["question"] = self.out_trans(qa["question"])[0]["translation_text"]
+                qa["answer"] = self.out_trans(qa["answer"])[0]["translation_text"]
+            elif qa["note_type"] == "cloze":
+                cl_str_ut = qa["cloze"]
+                cl_str_ut = cl_str_ut.replace("generate question: ", "")
+                cl_str_ut = cl_str_ut.replace("<hl> ", "{{c1::", 1)
+                cl_str_ut = cl_str_ut.replace(" <hl>", "}}", 1)
+                cl_str_ut = cl_str_ut.replace(" </s>", "")
+                qa["cloze_orig"] = cl_str_ut.strip()
+
+                # the answer is quoted to find it back after translation
+                cl_str = qa["cloze"]
+                cl_str = cl_str.replace("generate question: ", "")
+                cl_str = cl_str.replace("\"", "'")
+                cl_str = cl_str.replace("<hl> ", "\"").replace(" <hl>", "\"")
+                cl_str = cl_str.replace(" </s>", "")
+                cl_str = cl_str.strip()
+                cl_str = self.out_trans(cl_str)[0]["translation_text"]
+                cl_str = cl_str.replace("\"", "{{c1::", 1)
+                cl_str = cl_str.replace("\"", "}}", 1)
+                qa["cloze"] = cl_str
+        return to_add
+
+    def _format_qa(self, to_add, text, text_orig, title, qa_list,
+                   translate=True):
+        """
+        Turn the output of the question generation module for one text into
+        qa pairs with metadata, append them to qa_list and return them. A
+        to_add of None means that no cards could be made from that text.
+        translate=False when to_add was already given to _translate_qa.
+        """
+        self.warmup()  # can reset out_lang
+        if to_add is not None and translate:
+            self._translate_qa(to_add)
         to_add_cloze = []
         to_add_basic = []
-        if self.in_lang != "en":
-            text_orig = str(text)
-            text = self.in_trans(text)[0]["translation_text"]
-        else:
-            text_orig = ""
-
-        try:
-            to_add = self.qg(text)
+        if to_add is not None:
             to_add_cloze = [qa for qa in to_add if qa["note_type"] == "cloze"]
             to_add_basic = [qa for qa in to_add if qa["note_type"] == "basic"]
-        except IndexError:
+        else:
             tqdm.write(f"\nSkipping section because no cards \
 could be made from that text: '{text}'")
             to_add_basic.append({"question": "skipped",
@@ -124,68 +579,28 @@ could be made from that text: '{text}'")
             stored_text_orig = text_orig
 
         # loop over all newly added qa to format the text:
-        if to_add_basic != []:
-            for i in range(0, len(to_add_basic)):
-                if to_add_basic[i]["note_type"] == "basic":
-                    if self.out_lang != "en":
-                        to_add_basic[i]["question_orig"] = to_add_basic[i]["question"]
-                        to_add_basic[i]["answer_orig"] = to_add_basic[i]["answer"]
-                        to_add_basic[i]["question"] = self.out_trans(to_add_basic[i]["question"])[0]["translation_text"]
-                        to_add_basic[i]["answer"] = self.out_trans(to_add_basic[i]["answer"])[0]["translation_text"]
-                    else:
-                        to_add_basic[i]["answer_orig"] = ""
-                        to_add_basic[i]["question_orig"] = ""
-
-                    clozed_fmt = to_add_basic[i]['question'] + "<br>{{c1::"\
-                        + to_add_basic[i]['answer'] + "}}"
-                    to_add_basic[i]["basic_in_clozed_format"] = clozed_fmt
-
-        if to_add_cloze != []:
-            for i in range(0, len(to_add_cloze)):
-                if to_add_cloze[i]["note_type"] == "cloze":  # cloze formating
-                    if self.out_lang != "en":
-                        to_add_cloze[i]["cloze_orig"] = to_add_cloze[i]["cloze"]
-                        cl_str_ut = to_add_cloze[i]["cloze_orig"]
-                        cl_str_ut = cl_str_ut.replace("generate question: ", "")
-                        cl_str_ut = cl_str_ut.replace("<hl> ", "{{c1::", 1)
-                        cl_str_ut = cl_str_ut.replace(" <hl>", "}}", 1)
-                        cl_str_ut = cl_str_ut.replace(" </s>", "")
-                        cl_str_ut = cl_str_ut.strip()
-                        to_add_cloze[i]["cloze_orig"] = cl_str_ut
-
-                        cl_str = to_add_cloze[i]["cloze"]
-                        cl_str = cl_str.replace("generate question: ", "")
-                        cl_str = cl_str.replace("\"", "'")
-                        cl_str = cl_str.replace("<hl> ", "\"").replace(" <hl>", "\"")
-                        cl_str = cl_str.replace(" </s>", "")
-                        cl_str = cl_str.strip()
-                        cl_str = self.out_trans(cl_str)[0]["translation_text"]
-                        cl_str = cl_str.replace("\"", "{{c1::", 1)
-                        cl_str = cl_str.replace("\"", "}}", 1)
-                        to_add_cloze[i]["cloze"] = cl_str
-                    else:
-                        to_add_cloze[i]["cloze_orig"] = ""
-
-                        cl_str = to_add_cloze[i]["cloze"]
-                        cl_str = cl_str.replace("generate question: ", "")
-                        cl_str = cl_str.replace("<hl> ", "{{c1::", 1)
-                        cl_str = cl_str.replace(" <hl>", "}}", 1)
-                        cl_str = cl_str.replace(" </s>", "")
-                        cl_str = cl_str.strip()
-                        to_add_cloze[i]["cloze"] = cl_str
-
-                    to_add_cloze[i]["basic_in_clozed_format"] = ""
+        for qa in to_add_basic:
+            if "question_orig" not in qa:  # not translated
+                qa["answer_orig"] = ""
+                qa["question_orig"] = ""
+            qa["basic_in_clozed_format"] = qa['question'] + "<br>{{c1::"\
+                + qa['answer'] + "}}"
+
+        for qa in to_add_cloze:
+            if "cloze_orig" not in qa:  # not translated
+                qa["cloze_orig"] = ""
+                cl_str = qa["cloze"]
+                cl_str = cl_str.replace("generate question: ", "")
+                cl_str = cl_str.replace("<hl> ", "{{c1::", 1)
+                cl_str = cl_str.replace(" <hl>", "}}", 1)
+                cl_str = cl_str.replace(" </s>", "")
+                qa["cloze"] = cl_str.strip()
+            qa["basic_in_clozed_format"] = ""
 
         # merging cloze of the same text as a single qa with several cloze:
         if to_add_cloze != []:
             for i in range(0, len(to_add_cloze)-1):
-                if self.cloze_type == "SM":
-                    tqdm.write("SM cloze not yet implemented, luckily \
-SuperMemo supports importing from anki format. Hence the anki format will \
-be used for your input.")
-                    self.cloze_type = "anki"
-
-                if self.cloze_type == "anki" and len(self.qa_dic_list) != i:
+                if self.cloze_type == "anki" and len(qa_list) != i:
                     cl1 = re.sub(r"{{c\d+::|}}|\s", "",
                                  to_add_cloze[i]["cloze"])
                     cl2 = re.sub(r"{{c\d+::|}}|\s", "",
@@ -211,47 +626,204 @@ be used for your input.")
                         to_add_cloze[i+1]['cloze'] = clean_cloze
 
         to_add_full = to_add_cloze + to_add_basic
+        added = []
         for qa in to_add_full:
             qa["date"] = cur_time
             qa["source_title"] = title
             qa["source_text"] = stored_text
             qa["source_text_orig"] = stored_text_orig
             if qa["note_type"] == "basic":
-                self.qa_dic_list.append(qa)
+                added.append(qa)
             elif not qa["cloze"].endswith("___TO_REMOVE___"):
-                self.qa_dic_list.append(qa)
+                added.append(qa)
+        qa_list.extend(added)
 
-        tqdm.write(f"Number of question generated so far: {len(self.qa_dic_list)}")
+        tqdm.write(f"Number of question generated so far: {len(qa_list)}")
+        return added
 
     def _sanitize_text(self, text):
-        "correct common errors in text"
-        text = text.strip()
-        # occurs sometimes in epubs apparently:
-        text = text.replace("\xa0", " ")
-        # wikipedia style citation:
-        text = re.sub(r"\[\d*\]", "", text)
-        return text
+        "correct common errors in text, see stages.sanitize_text"
+        from stages import sanitize_text
+        return sanitize_text(text)
 
-    def consume_var(self, text, title="untitled variable",
-                    per_paragraph=False):
-        "Take text as input and create qa pairs"
+    @_with_model_lock
+    def _pack_paragraphs(self, paragraphs):
+        """
+        Merge short paragraphs and split long ones at sentence boundaries so
+        that each returned text unit fits in self.token_budget tokens. Also
+        returns the number of tokens that consuming the paragraphs one by one
+        would have lost to truncation, and the number still lost because a
+        single sentence is longer than the budget.
+        """
+        from nltk import sent_tokenize
+
+        budget = self.token_budget
+        units = []
+        cur, cur_len = [], 0
+        lost_unpacked, lost_packed = 0, 0
+
+        def flush():
+            nonlocal cur, cur_len
+            if cur:
+                units.append(" ".join(cur))
+            cur, cur_len = [], 0
+
+        for paragraph in paragraphs:
+            sents = sent_tokenize(paragraph)
+            sents_len = self._counter().count_tokens(sents)
+            par_len = sum(sents_len)
+            lost_unpacked += max(0, par_len - budget)
+
+            if par_len <= budget:
+                if cur_len + par_len > budget:
+                    flush()
+                cur.append(paragraph)
+                cur_len += par_len
+                continue
+
+            # too long: split it at sentence boundaries
+            flush()
+            for sent, sent_len in zip(sents, sents_len):
+                if cur_len + sent_len > budget:
+                    flush()
+                cur.append(sent)
+                cur_len += sent_len
+                lost_packed += max(0, sent_len - budget)
+            flush()
+        flush()
+        return units, lost_unpacked, lost_packed
+
+    def _split_var(self, text, per_paragraph=False, packed=False):
+        "Cut text into the units that will each be given to _call_qg"
         text = text.replace('\xad ', '')
         text = text.strip()
-        self.title = title
 
-        if per_paragraph:
+        if packed:
+            paragraphs = [self._sanitize_text(p.replace("\n", " "))
+                          for p in text.split('\n\n')]
+            paragraphs = [p for p in paragraphs if p]
+            units, lost_unpacked, lost_packed = self._pack_paragraphs(paragraphs)
+            print(f"Packed {len(paragraphs)} paragraphs into {len(units)} \
+units of at most {self.token_budget} tokens. Consuming by paragraph would \
+have truncated {lost_unpacked} tokens, {lost_packed} will still be \
+truncated.")
+            return units
+        elif per_paragraph:
             print("Consuming text by paragraph:")
-            for paragraph in tqdm(text.split('\n\n'),
-                                  desc="Processing by paragraph",
-                                  unit="paragraph"):
-                paragraph = paragraph.replace("\n", " ")
-                self._call_qg(paragraph, title)
+            return [paragraph.replace("\n", " ")
+                    for paragraph in text.split('\n\n')]
         else:
             print("Consuming text:")
             text = re.sub(r"\n\n*", ". ", text)
             text = re.sub(r"\.\.*", ".", text)
             text = self._sanitize_text(text)
-            self._call_qg(text, title)
+            return [text]
+
+    def pipeline(self, kind="text", per_paragraph=False, packed=False,
+                 mode="url", element="p", qa_list=None, progress=None,
+                 batch_size=None):
+        """
+        Stage pipeline used by the consume_* methods, to run on Units or to
+        customize first, see stages.py. kind is the kind of document the
+        units are read from, see IngestStage, per_paragraph and packed are
+        as in consume_var, mode and element as in consume_web. Cards are
+        appended to qa_list, self.qa_dic_list by default. progress is a
+        tqdm bar updated with the number of text units processed.
+        batch_size defaults to self.batch_size.
+
+        The stages calling models share a lock, so they run one at a time
+        while the other stages overlap with them. During estimate() the
+        stages after filter are replaced by an EstimateStage.
+        """
+        from stages import (Pipeline, IngestStage, CleanStage, SegmentStage,
+                            FilterStage, TranslateInStage, ExtractStage,
+                            GenerateStage, TranslateStage, FormatStage)
+
+        stages = [
+            IngestStage(kind, mode, element, self.html_parser),
+            CleanStage(),
+            SegmentStage(self, per_paragraph, packed),
+            FilterStage(self),
+            ]
+        if self._estimate_report is not None:
+            from cost_estimate import EstimateStage
+            stages.append(EstimateStage(self, self._estimate_report,
+                                        batch_size, progress))
+        else:
+            stages += [
+                TranslateInStage(self, self.translation_batch_size),
+                ExtractStage(self, batch_size),
+                GenerateStage(self, batch_size, progress),
+                TranslateStage(self),
+                FormatStage(self, qa_list),
+                ]
+        return Pipeline(stages)
+
+    def estimate(self, consume, *args, **kwargs):
+        """
+        Dry run of a consume_* method, given by name with its arguments,
+        e.g. a.estimate("consume_pdf", "book.pdf"): the documents are read,
+        cleaned, segmented and tokenized but no card is made. Returns a
+        report of the paragraphs, sentences, generate() calls, real and
+        padded tokens, tokens lost to truncation and the projected seconds,
+        from self.calibration(). Only the tokenizers are loaded, unless the
+        calibration has to be measured. See cost_estimate.py.
+        """
+        import cost_estimate
+
+        if not consume.startswith("consume_") or consume == "consume_user_input":
+            raise ValueError(f"Can't estimate {consume}, give the name of a \
+consume_* method reading documents")
+        report = cost_estimate.new_report()
+        self._estimate_report = report
+        # a dry run does not change what the next runs drop as boilerplate
+        seen = self.text_filter._seen.copy() if self.text_filter else None
+        try:
+            getattr(self, consume)(*args, **kwargs)
+        finally:
+            self._estimate_report = None
+            if seen is not None:
+                self.text_filter._seen = seen
+        cost_estimate.project(report, self.calibration(), self.note_type)
+        print(cost_estimate.summary(report))
+        return report
+
+    def calibration(self):
+        """
+        Speed of the models on this machine used by estimate(): from the
+        profile written by autotune.py, otherwise measured once on sample
+        text, see cost_estimate.calibrate
+        """
+        if self._calibration is None:
+            saved = (self.profile or {}).get("calibration")
+            if saved is not None and saved["engine"] == self.engine:
+                self._calibration = saved
+            else:
+                import cost_estimate
+                print("Measuring the speed of the models...")
+                with self._model_lock:
+                    self._calibration = cost_estimate.calibrate(
+                        self.qg, self.engine, batch_size=self.batch_size)
+        return self._calibration
+
+    def _consume(self, units, desc="Processing by paragraph",
+                 unit="paragraph", **kwargs):
+        "Run units through self.pipeline(**kwargs) with a progress bar"
+        with tqdm(desc=desc, unit=unit) as progress:
+            self.pipeline(progress=progress, **kwargs).run(units, collect=False)
+
+    def consume_var(self, text, title="untitled variable",
+                    per_paragraph=False, packed=False):
+        """
+        Take text as input and create qa pairs. With packed=True, paragraphs
+        are merged or split to make the most of each model call, see
+        self.token_budget.
+        """
+        from stages import Unit
+
+        self.title = title
+        self._consume([Unit(text=text, title=title)],
+                      per_paragraph=per_paragraph, packed=packed)
 
     def consume_user_input(self, title="untitled user input"):
         "Take user input and create qa pairs"
@@ -260,93 +832,139 @@ be used for your input.")
         user_input = user_input.strip()
 
         print("\nFeeding your text to Autocards...")
-        user_input = self._sanitize_text(user_input)
         self.consume_var(user_input, title, per_paragraph=False)
         print("Done feeding text.")
 
-    def consume_pdf(self, pdf_path, per_paragraph=True):
+    def _read_pdf(self, pdf_path):
+        "Return the title and the text of a pdf file"
+        from stages import read_pdf
+        return read_pdf(pdf_path)
+
+    def consume_pdf(self, pdf_path, per_paragraph=True, packed=False):
         "Take pdf file as input and create qa pairs"
+        from stages import Unit
+
         if not Path(pdf_path).exists():
             print(f"PDF file not found at {pdf_path}!")
             return None
 
-        print("Warning: pdf parsing is usually of poor quality because \
-there are no good cross platform libraries. Consider using consume_textfile() \
-after preprocessing the text yourself.")
-        title = pdf_path.replace("\\", "").split("/")[-1]
-        raw = str(parser.from_file(pdf_path))
-        safe_text = raw.encode('utf-8', errors='ignore')
-        safe_text = str(safe_text).replace("\\n", "\n").replace("\\t", " ").replace("\\", "")
-
-        text = self._sanitize_text(safe_text)
+        self._consume([Unit(source=pdf_path)], kind="pdf",
+                      per_paragraph=per_paragraph, packed=packed)
 
-        self.consume_var(text, title, per_paragraph)
-
-    def consume_textfile(self, filepath, per_paragraph=False):
+    def consume_textfile(self, filepath, per_paragraph=False, packed=False):
         "Take text file as input and create qa pairs"
         if not Path(filepath).exists():
             print(f"File not found at {filepath}")
         text = open(filepath).read()
         text = self._sanitize_text(text)
         filename = str(filepath).split("/")[-1]
-        if per_paragraph is False and len(text) > 300:
-            ans = input("The text is more than 300 characters long, \
+        if per_paragraph is False and packed is False and len(text) > 300:
+            if self._estimate_report is not None:
+                # a dry run does not ask, the default answer is to split
+                print("The text is more than 300 characters long, \
+estimating with per_paragraph=True.")
+                ans = "y"
+            else:
+                ans = input("The text is more than 300 characters long, \
 are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
             if ans != "n":
                 per_paragraph = True
         self.consume_var(text,
                          filename,
-                         per_paragraph=per_paragraph)
+                         per_paragraph=per_paragraph,
+                         packed=packed)
+
+    def _read_epub(self, filepath):
+        "Return the text of an epub file, paragraphs separated by blank lines"
+        from stages import read_epub
+        return read_epub(filepath)
 
-    def consume_epub(self, filepath, title="untitled epub file"):
+    def consume_epub(self, filepath, title="untitled epub file", packed=False):
         "Take an epub file as input and create qa pairs"
-        book = open_book(filepath)
-        text = " ".join(convert_epub_to_lines(book))
-        text = re.sub("<.*?>", "", text)
-        text = text.replace("&nbsp;", " ")
-        text = text.replace("&dash;", "-")
-        text = re.sub("&.*?;", " ", text)
-        # make paragraph limitation as expected in self.consume_var:
-        text = text.replace("\r", "\n\n")
-        text = re.sub("\n\n\n*", "\n\n", text)
-        text = self._sanitize_text(text)
-        self.consume_var(text, title, per_paragraph=True)
+        from stages import Unit
 
-    def consume_web(self, source, mode="url", element="p"):
-        "Take html file (local or via url) and create qa pairs"
-        if mode not in ["local", "url"]:
-            return "invalid arguments"
-        if mode == "local":
-            soup = BeautifulSoup(open(source), 'xml')
-        elif mode == "url":
-            res = requests.get(source, timeout=15)
-            html = res.content
-            soup = BeautifulSoup(html, 'xml')
+        self._consume([Unit(source=filepath, title=title)], kind="epub",
+                      per_paragraph=True, packed=packed)
 
-        try:
-            el = soup.article.body.find_all(element)
-        except AttributeError:
-            print("Using fallback method to extract page content")
-            el = soup.find_all(element)
-
-        title = ""
-        with suppress(Exception):
-            title = soup.find_all('h1')[0].text
-        if title == "":
-            with suppress(Exception):
-                title = soup.find_all('h1').text
-        if title == "":
-            with suppress(Exception):
-                title = soup.find_all('title').text
+    def consume_wiki_dump(self, path, titles=None, namespaces=(0,),
+                          max_pages=None, batch_size=32):
+        """
+        Take a local Wikipedia XML dump (.xml or .xml.bz2) as input and
+        create qa pairs from the paragraphs of its articles. The dump is
+        read as a stream and paragraphs given to the models batch_size at a
+        time, so it is never held in memory. titles filters the pages to
+        read: a collection of titles or a function taking a title and
+        returning whether to read that page. namespaces are the namespace
+        numbers of the pages to read, None for all. See wiki_dump.py.
+        """
+        import wiki_dump
+        from stages import Unit
+
+        n_cards = len(self.qa_dic_list)
+        with tqdm(desc="Reading dump", unit="page") as progress:
+
+            def units():
+                pages = wiki_dump.iter_pages(path, namespaces, titles)
+                for n, (title, wikitext) in enumerate(pages):
+                    if max_pages is not None and n >= max_pages:
+                        break
+                    self.title = title
+                    for _, paragraph in wiki_dump.page_sections(wikitext):
+                        yield Unit(text=paragraph, title=title, source=path)
+                    progress.update()
+                    progress.set_postfix(cards=len(self.qa_dic_list) - n_cards)
+
+            # pages are already cut into paragraphs
+            pipeline = self.pipeline(batch_size=batch_size).remove("segment")
+            pipeline.run(units(), collect=False)
+            progress.set_postfix(cards=len(self.qa_dic_list) - n_cards)
+
+    def consume_corpus(self, path, start=0, stop=None, batch_size=None):
+        """
+        Take a pre-tokenized corpus written by token_corpus.py as input and
+        create qa pairs from its paragraphs start to stop, without reading,
+        cleaning, segmenting or tokenizing the documents again. The corpus
+        must have been tokenized by the tokenizer of self.model. Several
+        processes can each consume a range of TokenCorpus(path).shards(n),
+        see token_corpus.consume.
+        """
+        from token_corpus import TokenCorpus
+
+        corpus = TokenCorpus(path)
+        if self.engine == "qg":
+            corpus.check(self.qg)
+        if self.in_lang != "en":
+            print("Corpora are consumed as they were written, without \
+translation.")
+        with tqdm(desc="Processing by paragraph", unit="paragraph",
+                  total=(stop or len(corpus)) - start) as progress:
+            pipeline = self.pipeline(batch_size=batch_size, progress=progress)
+            # the corpus is already read, segmented, filtered and tokenized,
+            # estimate() pipelines have no translate_in stage
+            for name in ["ingest", "clean", "segment", "filter", "translate_in"]:
+                if name in pipeline:
+                    pipeline.remove(name)
+            pipeline.run(corpus.units(start, stop), collect=False)
+
+    def _parse_web(self, html, source, element="p"):
+        """
+        Return the title of an html page and its text sections that are
+        long enough to be worth creating qa pairs from
+        """
+        import html_extract
+
+        title, sections = html_extract.extract(html, element, self.html_parser)
+        return self._valid_sections(title, sections, source)
+
+    def _valid_sections(self, title, sections, source):
+        "Title and long enough sections of a parsed html page"
         if title == "":
             print("Couldn't find title of the page")
             title = source
         title = title.strip()
-        self.title = title
 
         valid_sections = []  # remove text sections that are too short:
-        for section in el:
-            section = ' '.join(section.get_text().split())
+        for section in sections:
             if len(section) > 40:
                 valid_sections += [section]
             else:
@@ -356,18 +974,75 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
             print("No valid sections found, change the 'element' argument\
  to look for other html sections than 'p'. Find the relevant 'element' using \
  the 'inspect' functionnality in your favorite browser.")
-            return None
+        return title, valid_sections
+
+    def consume_web(self, source, mode="url", element="p"):
+        "Take html file (local or via url) and create qa pairs"
+        from stages import Unit
+
+        if mode not in ["local", "url"]:
+            return "invalid arguments"
+        self._consume([Unit(source=source)], "Processing by section",
+                      "section", kind="web", mode=mode, element=element)
 
-        for section in tqdm(valid_sections,
-                            desc="Processing by section",
-                            unit="section"):
-            section = self._sanitize_text(section)
-            self._call_qg(section, title)
+    def consume_web_pages(self, sources, mode="url", element="p",
+                          processes=None):
+        """
+        Take many html files (local or via url) and create qa pairs. Pages
+        are downloaded and parsed in a pool of processes (by default one per
+        cpu) while the models create cards from the pages already parsed,
+        see html_extract.py.
+        """
+        from stages import Unit, IngestStage
+
+        if mode not in ["local", "url"]:
+            return "invalid arguments"
+        with tqdm(desc="Processing by section", unit="section") as progress:
+            pipeline = self.pipeline(kind="web", mode=mode, element=element,
+                                     progress=progress)
+            pipeline.replace("ingest", IngestStage(
+                "web", mode, element, self.html_parser,
+                workers=processes or os.cpu_count() or 1, processes=True))
+            pipeline.run((Unit(source=source) for source in sources),
+                         collect=False)
 
     def clear_qa(self):
         "Delete currently stored qa pairs"
         self.qa_dic_list = []
 
+    @property
+    def index(self):
+        "CardIndex of self.qa_dic_list, see card_index.py"
+        if self._index is None or self._index.cards is not self.qa_dic_list:
+            from card_index import CardIndex
+            self._index = CardIndex(self.qa_dic_list)
+        return self._index
+
+    def query(self, source_title=None, note_type=None, text=None,
+              predicate=None):
+        """
+        Stored qa pairs matching all the given filters, found with indexes
+        instead of scanning every card:
+            - source_title, note_type: a value or a collection of values
+            - text: qa pairs whose question, answer or cloze contain all the
+              words of text, ignoring case. ValueError if text has no words
+            - predicate: function taking a qa pair and returning whether to
+              keep it
+        """
+        return self.index.query(source_title, note_type, text, predicate)
+
+    def _select(self, qa_list, where):
+        """
+        qa_list, by default all the stored qa pairs, filtered by where: a
+        dictionnary of arguments of query
+        """
+        if where is None:
+            return self.qa_dic_list if qa_list is None else qa_list
+        if qa_list is None or qa_list is self.qa_dic_list:
+            return self.query(**where)
+        from card_index import CardIndex
+        return CardIndex(qa_list).query(**where)
+
     def string_output(self, prefix='', jeopardy=False):
         "Return qa pairs to the user"
         if prefix != "" and prefix[-1] != ' ':
@@ -402,13 +1077,20 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
             combined += f"{col.upper()}: {dict(row)[col]}<br>\n"
         return "#"*15 + "Combined columns:<br>\n" + combined + "#"*15
 
-    def pandas_df(self, prefix=''):
-        if len(self.qa_dic_list) == 0:
+    def pandas_df(self, prefix='', qa_list=None, where=None):
+        """
+        Output a Pandas DataFrame containing qa pairs and metadata. qa_list
+        defaults to all the qa pairs stored in self.qa_dic_list, where
+        filters them, see query
+        """
+        import pandas as pd
+
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
             print("No qa generated yet!")
             return None
-        "Output a Pandas DataFrame containing qa pairs and metadata"
-        df = pd.DataFrame(columns=list(self.qa_dic_list[0].keys()))
-        for qa in self.qa_dic_list:
+        df = pd.DataFrame(columns=list(qa_list[0].keys()))
+        for qa in qa_list:
             df = df.append(qa, ignore_index=True)
         for i in df.index:
             for c in df.columns:
@@ -424,15 +1106,20 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
                              for x in df.index ]
         return df
 
-    def to_csv(self, filename="Autocards_export.csv", prefix=''):
-        "Export qa pairs as csv file"
-        if len(self.qa_dic_list) == 0:
+    def to_csv(self, filename="Autocards_export.csv", prefix='',
+               qa_list=None, where=None):
+        """
+        Export qa pairs (by default all of self.qa_dic_list) as csv file,
+        only those matching where if given, see query
+        """
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
             print("No qa generated yet!")
             return None
         if prefix != "" and prefix[-1] != ' ':
             prefix += ' '
 
-        df = self.pandas_df(prefix)
+        df = self.pandas_df(prefix, qa_list)
 
         for i in df.index:
             for c in df.columns:
@@ -444,15 +1131,20 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
         df[df["note_type"] != "cloze"].to_csv(f"{filename}_basic.csv")
         print(f"Done writing qa pairs to {filename}_cloze.csv and {filename}_basic.csv")
 
-    def to_json(self, filename="Autocards_export.json", prefix=''):
-        "Export qa pairs as json file"
-        if len(self.qa_dic_list) == 0:
+    def to_json(self, filename="Autocards_export.json", prefix='',
+                qa_list=None, where=None):
+        """
+        Export qa pairs (by default all of self.qa_dic_list) as json file,
+        only those matching where if given, see query
+        """
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
             print("No qa generated yet!")
             return None
         if prefix != "" and prefix[-1] != ' ':
             prefix += ' '
 
-        df = self.pandas_df(prefix)
+        df = self.pandas_df(prefix, qa_list)
 
         if ".json" in filename:
             filename = filename.replace(".json", "")
@@ -461,6 +1153,52 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
         print(f"Done writing qa pairs to {filename}_cloze.json and \
 {filename}_basic.json")
 
+    def to_arrow(self, qa_list=None, where=None):
+        """
+        Return qa pairs (by default all of self.qa_dic_list) as a pyarrow
+        Table, only those matching where if given, see query
+        """
+        import arrow_export
+
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
+            print("No qa generated yet!")
+            return None
+        return arrow_export.to_table(qa_list)
+
+    def to_parquet(self, filename="Autocards_export.parquet", qa_list=None,
+                   row_group_size=10000, where=None):
+        """
+        Export qa pairs (by default all of self.qa_dic_list, only those
+        matching where if given, see query) as a single parquet file,
+        written one row group at a time
+        """
+        import arrow_export
+
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
+            print("No qa generated yet!")
+            return None
+        arrow_export.write_parquet(qa_list, filename, row_group_size)
+        print(f"Done writing qa pairs to {filename}")
+
+    def to_feather(self, filename="Autocards_export.feather", qa_list=None,
+                   batch_size=10000, compression="zstd", where=None):
+        """
+        Export qa pairs (by default all of self.qa_dic_list, only those
+        matching where if given, see query) as a single feather file,
+        written one record batch at a time. With compression=None it can be
+        read back memory-mapped without copies.
+        """
+        import arrow_export
+
+        qa_list = self._select(qa_list, where)
+        if len(qa_list) == 0:
+            print("No qa generated yet!")
+            return None
+        arrow_export.write_feather(qa_list, filename, batch_size, compression)
+        print(f"Done writing qa pairs to {filename}")
+
     def _ankiconnect_invoke(self, action, **params):
         "send requests to ankiconnect addon"
 
@@ -489,13 +1227,16 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
             raise Exception(response['error'])
         return response['result']
 
-    def to_anki(self, deckname="Autocards_export", tags=[""]):
-        "Export cards to anki using anki-connect addon"
-        df = self.pandas_df()
+    def _anki_notes(self, qa_list, deckname, tags):
+        """
+        Anki notes of the qa pairs, creating the Autocards note type and the
+        deck if needed
+        """
+        df = self.pandas_df(qa_list=qa_list)
         df["generation_order"] = [str(int(x)+1) for x in list(df.index)]
         columns = df.columns.tolist()
         columns.remove("combined_columns")
-        tags.append(f"Autocards::{self.title.replace(' ', '_')}")
+        tags = tags + [f"Autocards::{self.title.replace(' ', '_')}"]
         with suppress(ValueError):
             tags.remove("")
 
@@ -523,6 +1264,14 @@ are you sure you don't want to try to split the text by paragraph?\n(y/n)>")
 
         # create new deck
         self._ankiconnect_invoke(action="createDeck", deck=deckname)
+        return note_list
+
+    def to_anki(self, deckname="Autocards_export", tags=[""], where=None):
+        """
+        Export cards to anki using anki-connect addon, only those matching
+        where if given, see query
+        """
+        note_list = self._anki_notes(self._select(None, where), deckname, tags)
 
         # send notes to anki
         out = self._ankiconnect_invoke(action="addNotes", notes=note_list)
@@ -537,3 +1286,151 @@ sent correctly.")
         else:
             print("An error happened: no cards were successfuly sent to anki.")
             return out
+
+    def sync_anki(self, text, source, title=None, deckname="Autocards_export",
+                  tags=[""], packed=False, delete_orphans=False,
+                  manifest_dir=None):
+        """
+        Bring the anki notes made from a document up to date with its
+        current text, consumed by paragraph. source identifies the document
+        across syncs, like its path or url. Only the paragraphs that are new
+        or were edited since the last sync are turned into cards: cards
+        asking for the same answer as a card of an edited or removed
+        paragraph update its note with updateNoteFields, the others are
+        added with addNotes. The notes of removed paragraphs left over are
+        deleted with delete_orphans=True, otherwise they stay in anki and
+        are remembered to be deleted by a later sync. What was sent is
+        stored in a manifest per source in manifest_dir, see anki_sync.py.
+        Returns the number of notes added, updated and orphaned.
+        """
+        import anki_sync
+        from stages import Unit
+
+        self.title = title or source
+        manifest = anki_sync.Manifest(source, manifest_dir)
+        units = self._split_var(text, per_paragraph=True, packed=packed)
+        hashes = [anki_sync.paragraph_hash(unit) for unit in units]
+
+        # paragraphs to regenerate, each hash once
+        todo = {}
+        for unit, par_hash in zip(units, hashes):
+            if not manifest.is_complete(par_hash):
+                todo.setdefault(par_hash, unit)
+        kept = set(hashes) - set(todo)
+        print(f"{len(kept)} paragraphs unchanged since the last sync, \
+{len(todo)} to create cards from.")
+
+        # notes of the paragraphs that are gone or regenerated, which the
+        # new cards can take over
+        released = {}
+        for par_hash, ids in manifest.paragraphs.items():
+            if par_hash in kept:
+                continue
+            for i in ids:
+                card = manifest.cards.pop(i)
+                if card["note"] is not None:
+                    released[i] = card
+
+        new_paragraphs = {h: manifest.paragraphs[h] for h in kept}
+        new_cards = []  # (id, qa) pairs
+        by_hash = {par_hash: [] for par_hash in todo}
+        with tqdm(desc="Processing by paragraph", unit="paragraph") as progress:
+            pipeline = self.pipeline(progress=progress)
+            # the paragraphs are already cut
+            for name in ["ingest", "clean", "segment"]:
+                pipeline.remove(name)
+            for unit in pipeline.stream(
+                    Unit(text=unit, title=self.title, meta={"hash": par_hash})
+                    for par_hash, unit in todo.items()):
+                by_hash[unit.meta["hash"]] = [qa for qa in unit.cards
+                                              if qa["question"] != "skipped"]
+        for par_hash, cards in by_hash.items():
+            ids = anki_sync.card_ids(source, par_hash, cards)
+            new_paragraphs[par_hash] = ids
+            new_cards.extend(zip(ids, cards))
+
+        # reuse the note of the same card, or of a released card asking for
+        # the same answer
+        reusable = {}
+        for i, card in released.items():
+            reusable.setdefault(card["key"], []).append(i)
+        to_update = []
+        to_add = []
+        for i, qa in new_cards:
+            key = anki_sync.answer_key(qa)
+            if i in released and i in reusable.get(key, []):
+                reusable[key].remove(i)
+                to_update.append((i, qa, released[i]["note"]))
+            elif reusable.get(key):
+                to_update.append((i, qa, released[reusable[key].pop()]["note"]))
+            else:
+                to_add.append((i, qa))
+        orphans = [released[i]["note"] for ids in reusable.values()
+                   for i in ids]
+
+        if to_update or to_add:
+            notes = self._anki_notes([qa for _, qa, _ in to_update]
+                                     + [qa for _, qa in to_add],
+                                     deckname, tags)
+        if to_update:
+            self._ankiconnect_invoke(
+                action="multi",
+                actions=[{"action": "updateNoteFields",
+                          "version": 6,
+                          "params": {"note": {"id": note_id,
+                                              "fields": note["fields"]}}}
+                         for (_, _, note_id), note in zip(to_update, notes)])
+            for i, qa, note_id in to_update:
+                manifest.cards[i] = {"note": note_id,
+                                     "key": anki_sync.answer_key(qa)}
+        if to_add:
+            out = self._ankiconnect_invoke(action="addNotes",
+                                           notes=notes[len(to_update):])
+            for (i, qa), note_id in zip(to_add, out):
+                manifest.cards[i] = {"note": note_id,
+                                     "key": anki_sync.answer_key(qa)}
+            if None in out:
+                print(f"{out.count(None)} cards were not sent correctly, \
+they will be created again by the next sync.")
+
+        if delete_orphans:
+            orphans += manifest.orphans
+            if orphans:
+                self._ankiconnect_invoke(action="deleteNotes", notes=orphans)
+            manifest.orphans = []
+        else:
+            manifest.orphans += orphans
+        manifest.paragraphs = new_paragraphs
+        manifest.save()
+
+        print(f"Sync done: {len(to_add)} notes added, {len(to_update)} \
+updated, {len(orphans)} {'deleted' if delete_orphans else 'orphaned'}.")
+        return {"added": len(to_add), "updated": len(to_update),
+                "orphaned": len(orphans)}
+
+
+class AutocardsSession(Autocards):
+    """
+    Autocards with the settings and loaded models of another instance but
+    its own qa_dic_list and title, see Autocards.session. Closing the
+    instance while its sessions are in use is not supported.
+    """
+
+    def __init__(self, autocards):
+        autocards.warmup()
+        self.__dict__.update(autocards.__dict__)
+        self.__dict__.pop("title", None)
+        self.qa_dic_list = []
+        self._index = None
+        self.autocards = autocards
+
+    def warmup(self):
+        "The models are the ones of the Autocards instance, already loaded"
+
+    def close(self):
+        "Nothing to release, the models belong to the Autocards instance"
+
+
+if __name__ == "__main__":
+    from cli import main
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Throughput autotuner: find the settings that create cards fastest on this
+machine and save them to a profile that Autocards loads automatically.
+
+`python autotune.py` runs a short calibration of the question generation
+pipeline on sample text (or on your own text with --sample) and searches,
+in order:
+    - the number of torch threads
+    - the number of text units given to the models per call (batch size),
+      increasing it as long as the peak memory stays under the ceiling
+    - the number of beams of the question generation, only among the
+      values given with --beams since fewer beams are faster but give worse
+      questions
+    - the number of worker processes sharing the cpus, each with its share
+      of the threads and its own copy of the models, under the ceiling, and
+      TOKENIZERS_PARALLELISM in them, which oversubscribes the cpus when
+      several processes each tokenize in parallel
+The memory ceiling defaults to 80% of the physical memory.
+
+The profile is written to ~/.autocards/profile.json, or to the path in the
+AUTOCARDS_PROFILE environment variable, and applied by Autocards instances
+using the same model. The worker processes are used by
+token_corpus.consume to create the cards of a corpus. It also holds the calibration of the cost estimates
+of Autocards.estimate, see cost_estimate.py.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+PROFILE_ENV = "AUTOCARDS_PROFILE"
+
+SAMPLE_TEXT = """\
+The Amazon rainforest covers much of the Amazon basin of South America. \
+This basin encompasses seven million square kilometers, of which five and a \
+half million square kilometers are covered by the rainforest. The region \
+includes territory belonging to nine nations, the majority of the forest \
+being contained within Brazil.
+
+The steam engine was improved by James Watt between 1763 and 1775. His \
+separate condenser greatly reduced the fuel consumption of the engines, \
+which made them economical to use far from coal mines and helped start the \
+Industrial Revolution in Britain.
+
+Photosynthesis is the process used by plants and other organisms to convert \
+light energy into chemical energy. Most plants release oxygen as a waste \
+product. The process takes place in the chloroplasts, which contain the \
+green pigment chlorophyll.
+
+The Treaty of Westphalia was signed in 1648 in the cities of Osnabruck and \
+Munster. It ended the Thirty Years' War and is often cited as the beginning \
+of the modern system of sovereign states in Europe."""
+
+
+def default_profile_path():
+    "Profile given by the AUTOCARDS_PROFILE environment variable, or the default one"
+    return Path(os.environ.get(PROFILE_ENV,
+                               Path.home() / ".autocards" / "profile.json"))
+
+
+def load_profile(path=None):
+    "Saved profile as a dictionnary, None if there is none"
+    path = Path(path) if path is not None else default_profile_path()
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _peak_memory_mb():
+    "Peak resident memory of this process, 0 if it can't be measured"
+    try:
+        import resource
+    except ImportError:  # windows
+        try:
+            import psutil
+        except ImportError:
+            return 0
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 ** 2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes on linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _total_memory_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _units(sample_text, n):
+    "At least n text units, repeating the paragraphs of the sample"
+    paragraphs = [p.strip() for p in sample_text.split("\n\n") if p.strip()]
+    return (paragraphs * (n // len(paragraphs) + 1))[:max(n, len(paragraphs))]
+
+
+def _throughput(qg, units, batch_size, seconds):
+    "Text units per second processed by qg, batch_size at a time"
+    qg(units[:batch_size])  # warmup
+    done = 0
+    start = time.perf_counter()
+    while True:
+        batch = [units[(done + i) % len(units)] for i in range(batch_size)]
+        try:
+            qg(batch)
+        except IndexError:
+            pass
+        done += batch_size
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return done / elapsed
+
+
+def _load(model, ans_model, model_dir):
+    from pipelines import qg_pipeline
+    return qg_pipeline("question-generation", model=model, ans_model=ans_model,
+                       model_dir=model_dir)
+
+
+def _worker(config, sample_text, seconds, barrier, results):
+    "Calibration run of one of several worker processes"
+    # before the tokenizers are imported by this new process
+    os.environ["TOKENIZERS_PARALLELISM"] = config["tokenizers_parallelism"]
+    import torch
+
+    torch.set_num_threads(config["threads"])
+    qg = _load(config["model"], config["ans_model"], config["model_dir"])
+    qg.num_beams = config["num_beams"]
+    units = _units(sample_text, 4 * config["batch_size"])
+    qg(units[:config["batch_size"]])
+    barrier.wait()
+    rate = _throughput(qg, units, config["batch_size"], seconds)
+    results.put((rate, _peak_memory_mb()))
+
+
+def _measure_workers(config, workers, sample_text, seconds):
+    "Total throughput and memory of workers processes run at the same time"
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker,
+                             args=(config, sample_text, seconds, barrier, results))
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    measures = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    return sum(m[0] for m in measures), sum(m[1] for m in measures)
+
+
+def autotune(model="valhalla/distilt5-qa-qg-hl-12-6",
+             ans_model="valhalla/distilt5-qa-qg-hl-12-6",
+             sample_text=None,
+             batch_sizes=(1, 2, 4, 8, 16, 32),
+             threads=None,
+             beams=(4,),
+             workers=None,
+             memory_limit_mb=None,
+             seconds=5,
+             path=None,
+             model_dir=None):
+    """
+    Search the fastest settings and save them to the profile at path, see
+    the module docstring. threads and workers default to the powers of 2
+    up to the number of cpus. Returns the profile.
+    """
+    import torch
+
+    sample_text = sample_text or SAMPLE_TEXT
+    cpus = os.cpu_count() or 1
+    powers = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    if cpus not in powers:
+        powers.append(cpus)
+    threads = threads or powers
+    workers = workers or powers
+    if memory_limit_mb is None:
+        total = _total_memory_mb()
+        memory_limit_mb = 0.8 * total if total is not None else float("inf")
+
+    print("Loading models...")
+    qg = _load(model, ans_model, model_dir)
+    units = _units(sample_text, 2 * max(batch_sizes))
+    config = {"model": model, "ans_model": ans_model, "model_dir": model_dir,
+              "batch_size": min(4, max(batch_sizes)), "num_beams": max(beams),
+              "tokenizers_parallelism": "true", "threads": cpus}
+    qg.num_beams = config["num_beams"]
+
+    def measure(label):
+        rate = _throughput(qg, units, config["batch_size"], seconds)
+        print(f"  {label}: {rate:.2f} units/s")
+        return rate
+
+    print("Torch threads:")
+    rates = {}
+    for n in threads:
+        torch.set_num_threads(n)
+        rates[n] = measure(f"{n} threads")
+    config["threads"] = max(rates, key=rates.get)
+    torch.set_num_threads(config["threads"])
+
+    print(f"Batch size, under {memory_limit_mb:.0f}MB:")
+    rates = {}
+    for batch_size in sorted(batch_sizes):
+        config["batch_size"] = batch_size
+        rate = measure(f"batch size {batch_size}")
+        if _peak_memory_mb() > memory_limit_mb:
+            print(f"  batch size {batch_size} goes over the memory ceiling")
+            break
+        rates[batch_size] = rate
+    config["batch_size"] = max(rates, key=rates.get) if rates else min(batch_sizes)
+    process_memory = _peak_memory_mb()
+
+    if len(beams) > 1:
+        print("Beams:")
+        rates = {}
+        for n in beams:
+            qg.num_beams = n
+            rates[n] = measure(f"{n} beams")
+        config["num_beams"] = max(rates, key=rates.get)
+        qg.num_beams = config["num_beams"]
+
+    best_rate = _throughput(qg, units, config["batch_size"], seconds)
+    # the threads of a single process stay in the profile, the workers get
+    # their share of the cpus
+    config.update(workers=1, worker_threads=config["threads"])
+    candidates = [w for w in workers if w > 1
+                  and w * process_memory <= memory_limit_mb]
+    if candidates:
+        print("Worker processes:")
+        print(f"  1 worker with {config['threads']} threads: {best_rate:.2f} units/s")
+    over_ceiling = False
+    for w in candidates:
+        for value in ["true", "false"]:
+            worker_config = dict(config, threads=max(1, cpus // w),
+                                 tokenizers_parallelism=value)
+            rate, memory = _measure_workers(worker_config, w, sample_text, seconds)
+            print(f"  {w} workers with {worker_config['threads']} threads and "
+                  f"TOKENIZERS_PARALLELISM={value}: {rate:.2f} units/s")
+            if memory > memory_limit_mb:
+                print(f"  {w} workers go over the memory ceiling")
+                over_ceiling = True
+                break
+            if rate > best_rate:
+                best_rate = rate
+                config.update(workers=w, worker_threads=worker_config["threads"],
+                              tokenizers_parallelism=value)
+        if over_ceiling:
+            break
+
+    profile = {key: config[key] for key in
+               ["model", "ans_model", "batch_size", "threads",
+                "tokenizers_parallelism", "num_beams", "workers",
+                "worker_threads"]}
+    profile.update(units_per_second=round(best_rate, 3),
+                   memory_mb=round(process_memory, 1),
+                   cpus=cpus,
+                   date=time.asctime())
+    # speed of the models with these settings, for Autocards.estimate
+    import cost_estimate
+    profile["calibration"] = cost_estimate.calibrate(qg, "qg", sample_text,
+                                                     config["batch_size"])
+    path = Path(path) if path is not None else default_profile_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Profile saved to {path}:")
+    print(json.dumps(profile, indent=2))
+    return profile
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("--model", default="valhalla/distilt5-qa-qg-hl-12-6")
+parser.add_argument("--ans-model", default="valhalla/distilt5-qa-qg-hl-12-6")
+parser.add_argument("--model-dir", default=None,
+                    help="local model store, see model_store.py")
+parser.add_argument("--sample", type=str, default=None,
+                    help="text file to calibrate on, paragraphs separated \
+by blank lines")
+parser.add_argument("--batch-sizes", type=int, nargs="+",
+                    default=[1, 2, 4, 8, 16, 32])
+parser.add_argument("--threads", type=int, nargs="+", default=None)
+parser.add_argument("--beams", type=int, nargs="+", default=[4])
+parser.add_argument("--workers", type=int, nargs="+", default=None)
+parser.add_argument("--memory-limit-mb", type=float, default=None)
+parser.add_argument("--seconds", type=float, default=5,
+                    help="duration of each measure")
+parser.add_argument("--profile", type=str, default=None,
+                    help=f"where to save the profile, defaults to \
+${PROFILE_ENV} or ~/.autocards/profile.json")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    autotune(model=args.model,
+             ans_model=args.ans_model,
+             sample_text=Path(args.sample).read_text() if args.sample else None,
+             batch_sizes=args.batch_sizes,
+             threads=args.threads,
+             beams=args.beams,
+             workers=args.workers,
+             memory_limit_mb=args.memory_limit_mb,
+             seconds=args.seconds,
+             path=args.profile,
+             model_dir=args.model_dir)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare the html extraction backends of html_extract.py (see consume_web)
+on the same pages: time per page, number of sections found, and the
+throughput of parsing many pages in a process pool.
+Pages are html files given on the command line, or a generated page with
+navigation, a sidebar, a long article and a footer.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import html_extract  # noqa: E402
+
+PARAGRAPH = ("Napoleon Bonaparte, born in Corsica in 1769, rose to prominence "
+             "during the French Revolution and led several successful "
+             "campaigns during the Revolutionary Wars, then, as Emperor, "
+             "dominated European affairs for over a decade.")
+
+
+def generated_page(n_paragraphs):
+    nav = "".join(f'<li><a href="/p{i}">Link {i}</a></li>' for i in range(50))
+    side = "".join(f"<p>Related article {i}, read it now.</p>" for i in range(20))
+    body = "".join(f"<p>{i}. {PARAGRAPH}</p>" for i in range(n_paragraphs))
+    return f"""<!DOCTYPE html><html><head><title>Napoleon</title>
+<script>var x = 1;</script><style>p {{ color: red; }}</style></head><body>
+<div id="header"><nav class="menu"><ul>{nav}</ul></nav></div>
+<div class="sidebar">{side}</div>
+<div id="content"><h1>Napoleon</h1><div class="article-body">{body}</div></div>
+<div class="footer"><p>Copyright, all rights reserved, terms of use.</p></div>
+</body></html>"""
+
+
+def available_parsers():
+    parsers = []
+    for name in html_extract.PARSERS:
+        try:
+            html_extract.extract("<html><body><p>test</p></body></html>",
+                                 parser=name)
+        except ImportError:
+            print(f"{name} is not installed, skipping it")
+            continue
+        parsers.append(name)
+    return parsers
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("pages", nargs="*", help="html files, default is a \
+generated page")
+parser.add_argument("--paragraphs", type=int, default=500,
+                    help="paragraphs of the generated page")
+parser.add_argument("--runs", "-n", type=int, default=5)
+parser.add_argument("--pool-pages", type=int, default=64,
+                    help="number of pages parsed in the process pool test")
+parser.add_argument("--processes", "-p", type=int, default=None)
+parser.add_argument("--element", "-e", default="p")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.pages:
+        pages = [Path(p).read_bytes() for p in args.pages]
+    else:
+        pages = [generated_page(args.paragraphs)]
+    total_bytes = sum(len(p) for p in pages)
+    print(f"{len(pages)} pages, {total_bytes / 1024:.0f} KiB")
+
+    parsers = available_parsers()
+    for name in parsers:
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            results = [html_extract.extract(p, args.element, name) for p in pages]
+            timings.append((time.perf_counter() - start) / len(pages))
+        sections = sum(len(s) for _, s in results)
+        print(f"{name:>10}: {statistics.median(timings) * 1000:8.1f}ms per page, "
+              f"{sections} sections, title '{results[0][0]}'")
+
+    many = (pages * args.pool_pages)[:max(args.pool_pages, len(pages))]
+    for name in parsers:
+        for processes in [1, args.processes]:
+            start = time.perf_counter()
+            html_extract.extract_many(many, args.element, name, processes)
+            elapsed = time.perf_counter() - start
+            label = "sequential" if processes == 1 else \
+                f"{processes or 'all cpu'} processes"
+            print(f"{name:>10}, {label}: {len(many) / elapsed:7.1f} pages/s")
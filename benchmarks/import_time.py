@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measure how long `import autocards` takes in a fresh interpreter and check
+that it does not import the heavy dependencies, which are only needed once
+models are loaded or a specific input format is consumed.
+Exits with status 1 if the import is slower than --max-seconds or pulls in
+one of the heavy modules.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY_MODULES = ["torch", "transformers", "pandas", "nltk", "tika", "bs4",
+                 "epub_conversion", "requests", "pipelines"]
+
+CHECK = f"""
+import sys, time
+start = time.perf_counter()
+import autocards
+elapsed = time.perf_counter() - start
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("--runs", "-n", type=int, default=5)
+parser.add_argument("--max-seconds", type=float, default=0.5)
+parser.add_argument("--module", "-m", default="autocards",
+                    help="module to import instead of autocards")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    repo = Path(__file__).resolve().parent.parent
+    code = CHECK.replace("autocards", args.module)
+
+    timings = []
+    heavy = ""
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=repo,
+                             capture_output=True, text=True, check=True)
+        fields = out.stdout.split()
+        timings.append(float(fields[0]))
+        heavy = fields[1] if len(fields) > 1 else ""
+
+    median = statistics.median(timings)
+    print(f"import {args.module}: median {median * 1000:.1f}ms, "
+          f"min {min(timings) * 1000:.1f}ms over {args.runs} runs")
+    failed = False
+    if heavy:
+        print(f"Heavy modules imported at import time: {heavy}")
+        failed = True
+    if median > args.max_seconds:
+        print(f"Slower than the {args.max_seconds}s limit")
+        failed = True
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Send concurrent requests to a local server.py and report latencies and
+throughput. Start the server first, for example `python server.py`.
+"""
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_TEXT = """Philip II of Macedon was the king of the ancient kingdom of \
+Macedonia from 359 BC until his assassination in 336 BC. He was the father of \
+Alexander the Great.
+
+Philip transformed the Macedonian army by introducing the phalanx armed with \
+the sarissa, a pike of about six metres. With it he defeated Athens and Thebes \
+at the Battle of Chaeronea in 338 BC."""
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("--url", default="http://127.0.0.1:8000/cards")
+parser.add_argument("--requests", "-n", type=int, default=64,
+                    help="total number of requests")
+parser.add_argument("--concurrency", "-c", type=int, default=8,
+                    help="number of requests in flight at the same time")
+parser.add_argument("--textfile", type=str, default=None,
+                    help="text to send instead of the built in sample")
+
+
+def one_request(url, payload):
+    "Return the http status, the number of cards and the latency"
+    start = time.perf_counter()
+    req = urllib.request.Request(url, json.dumps(payload).encode("utf-8"),
+                                 {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req) as res:
+            status = res.status
+            n_cards = len(json.load(res)["cards"])
+    except urllib.error.HTTPError as e:
+        status, n_cards = e.code, 0
+    return status, n_cards, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    text = SAMPLE_TEXT
+    if args.textfile is not None:
+        text = open(args.textfile).read()
+    payload = {"text": text, "title": "load test", "per_paragraph": True}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: one_request(args.url, payload),
+                                range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r[0] == 200]
+    latencies = sorted(r[2] for r in ok)
+    print(f"{len(ok)}/{len(results)} successful requests in {elapsed:.1f}s "
+          f"({len(results) / elapsed:.2f} requests/s, "
+          f"{sum(r[1] for r in ok) / elapsed:.1f} cards/s)")
+    errors = sorted({r[0] for r in results if r[0] != 200})
+    for status in errors:
+        print(f"HTTP {status}: {sum(r[0] == status for r in results)} requests")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"latency: mean {statistics.mean(latencies):.2f}s, "
+              f"median {statistics.median(latencies):.2f}s, "
+              f"p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
@@ -0,0 +1,113 @@
+"""
+Indexed queries over a list of cards, see Autocards.query.
+
+Cards are indexed by source_title and note_type (hash indexes) and by the
+words of their question, answer and cloze (inverted index), so that
+selecting a subset of a large run does not scan every card. The index
+follows a list that only grows, like Autocards.qa_dic_list: cards appended
+since the last query are indexed on the next one. Cards edited in place
+after being indexed must be reindexed with rebuild().
+"""
+
+import re
+from collections import defaultdict
+
+TEXT_FIELDS = ["question", "answer", "cloze"]
+
+_WORD = re.compile(r"\w+")
+
+
+def tokens(text):
+    "Lowercased words of a text, cloze markers excluded"
+    return _WORD.findall(re.sub(r"{{c\d+::|}}", " ", text or "").lower())
+
+
+class CardIndex:
+    def __init__(self, cards):
+        self.cards = cards
+        self.rebuild()
+
+    def rebuild(self):
+        "Index all the cards again"
+        self.by_title = defaultdict(list)
+        self.by_note_type = defaultdict(list)
+        self.by_token = defaultdict(list)
+        self.indexed = 0
+        self.update()
+
+    def update(self):
+        "Index the cards appended since the last update"
+        if len(self.cards) < self.indexed:
+            # cards were removed, positions are not valid anymore
+            return self.rebuild()
+        for i in range(self.indexed, len(self.cards)):
+            card = self.cards[i]
+            self.by_title[card.get("source_title")].append(i)
+            self.by_note_type[card.get("note_type")].append(i)
+            words = set()
+            for field in TEXT_FIELDS:
+                words.update(tokens(card.get(field)))
+            for word in words:
+                self.by_token[word].append(i)
+        self.indexed = len(self.cards)
+
+    @staticmethod
+    def _values(index, values):
+        "Positions of the cards with one of values, from a hash index"
+        if isinstance(values, str) or values is None:
+            values = [values]
+        positions = set()
+        for value in values:
+            positions.update(index.get(value, ()))
+        return positions
+
+    def positions(self, source_title=None, note_type=None, text=None,
+                  predicate=None):
+        """
+        Sorted positions of the cards matching all the given filters, see
+        query
+        """
+        self.update()
+        candidates = []
+        if source_title is not None:
+            candidates.append(self._values(self.by_title, source_title))
+        if note_type is not None:
+            candidates.append(self._values(self.by_note_type, note_type))
+        if text is not None:
+            words = set(tokens(text))
+            if not words:
+                # every card contains all the words of an empty text
+                raise ValueError(f"No words to search for in text {text!r}")
+            for word in words:
+                candidates.append(self.by_token.get(word, ()))
+        if candidates:
+            candidates.sort(key=len)
+            matching = set(candidates[0])
+            for other in candidates[1:]:
+                if not matching:
+                    break
+                matching.intersection_update(other)
+        else:
+            matching = range(len(self.cards))
+        matching = sorted(matching)
+        if predicate is not None:
+            matching = [i for i in matching if predicate(self.cards[i])]
+        return matching
+
+    def query(self, source_title=None, note_type=None, text=None,
+              predicate=None):
+        """
+        Cards matching all the given filters, in their order of creation:
+            - source_title, note_type: a value or a collection of values
+            - text: cards whose question, answer or cloze contain all the
+              words of text, ignoring case. ValueError if text has no words
+            - predicate: function taking a card and returning whether to
+              keep it, only called on the cards matching the other filters
+        """
+        return [self.cards[i] for i in
+                self.positions(source_title, note_type, text, predicate)]
+
+    def titles(self):
+        "Number of cards of each source_title"
+        self.update()
+        return {title: len(positions) for title, positions in self.by_title.items()}
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Create flashcards from whole directories of documents with a single model
+load. Run it with `python -m autocards` or `python cli.py`, see --help.
+
+Inputs can be files, directories (searched recursively), glob patterns and
+urls, plus a text file of urls given with --urls. The consume_* method is
+picked from the file extension: .txt and .md files are consumed as text,
+.pdf as pdf, .epub as epub and .html or .htm as local web pages.
+"""
+
+import argparse
+import asyncio
+import glob
+import time
+from functools import partial
+from pathlib import Path
+
+from tqdm import tqdm
+
+from async_autocards import AsyncAutocards
+
+TEXT_SUFFIXES = [".txt", ".md"]
+SUFFIXES = TEXT_SUFFIXES + [".pdf", ".epub", ".html", ".htm"]
+
+
+def collect_inputs(paths, urls_file=None):
+    "Expand files, directories, globs and urls into a sorted list of inputs"
+    found = set()
+    urls = []
+    for path in paths:
+        if path.startswith("http://") or path.startswith("https://"):
+            urls.append(path)
+        elif Path(path).is_dir():
+            found.update(str(p) for p in Path(path).rglob("*")
+                         if p.suffix.lower() in SUFFIXES)
+        elif Path(path).is_file():
+            found.add(path)
+        else:
+            matches = glob.glob(path, recursive=True)
+            if not matches:
+                print(f"No file found at {path}")
+            found.update(p for p in matches
+                         if Path(p).is_file() and Path(p).suffix.lower() in SUFFIXES)
+    if urls_file is not None:
+        for line in Path(urls_file).read_text().splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(line)
+    return sorted(found) + urls
+
+
+async def consume(auto, source, args):
+    "Consume one input with the consume_* method matching its type"
+    if source.startswith("http://") or source.startswith("https://"):
+        return await auto.consume_web(source, mode="url", element=args.element)
+    suffix = Path(source).suffix.lower()
+    if suffix in TEXT_SUFFIXES:
+        return await auto.consume_textfile(source, per_paragraph=True,
+                                           packed=args.packed)
+    elif suffix == ".pdf":
+        return await auto.consume_pdf(source, packed=args.packed)
+    elif suffix == ".epub":
+        return await auto.consume_epub(source, title=Path(source).stem,
+                                       packed=args.packed)
+    elif suffix in [".html", ".htm"]:
+        return await auto.consume_web(source, mode="local",
+                                      element=args.element)
+    print(f"Unsupported input type, skipping {source}")
+    return []
+
+
+def export(auto, cards, filename, fmt):
+    "Write cards to filename, blocking, see run_export"
+    if fmt == "csv":
+        auto.autocards.to_csv(filename, qa_list=cards)
+    elif fmt == "json":
+        auto.autocards.to_json(filename, qa_list=cards)
+    else:
+        getattr(auto.autocards, f"to_{fmt}")(f"{filename}.{fmt}", qa_list=cards)
+
+
+async def run_export(auto, cards, filename, fmt):
+    "export in the loop's default executor, not to hold back the other inputs"
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, partial(export, auto, cards, filename, fmt))
+
+
+def output_name(source):
+    "Export file name of one input, without extension"
+    if source.startswith("http://") or source.startswith("https://"):
+        name = source.split("://", 1)[1]
+    else:
+        name = str(Path(source).with_suffix(""))
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+async def run(args):
+    sources = collect_inputs(args.inputs, args.urls)
+    if not sources:
+        print("Nothing to process.")
+        return 1
+    print(f"Found {len(sources)} inputs to process.")
+
+    auto = AsyncAutocards(max_in_flight=args.max_in_flight,
+                          store_content=not args.no_content,
+                          in_lang=args.in_lang,
+                          out_lang=args.out_lang,
+                          token_budget=args.token_budget,
+                          engine=args.engine,
+                          note_type=args.note_type,
+                          cascade=args.cascade,
+                          cascade_threshold=args.cascade_threshold)
+    jobs = asyncio.Semaphore(args.jobs)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    failed = {}
+    start = time.time()
+
+    async def process(source):
+        async with jobs:
+            try:
+                cards = await consume(auto, source, args)
+            except Exception as e:
+                failed[source] = e
+                return
+            results[source] = cards
+            if not args.merge and cards:
+                await run_export(auto, cards,
+                                 str(output_dir / output_name(source)),
+                                 args.format)
+
+    tasks = [asyncio.ensure_future(process(source)) for source in sources]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks),
+                     desc="Processing inputs", unit="input"):
+        await task
+    auto.close()
+
+    if args.merge:
+        merged = [qa for source in sources for qa in results.get(source, [])]
+        if merged:
+            await run_export(auto, merged, str(output_dir / args.merge),
+                             args.format)
+
+    n_cards = sum(len(cards) for cards in results.values())
+    print(f"\nProcessed {len(results)}/{len(sources)} inputs in "
+          f"{time.time() - start:.1f}s, {n_cards} cards created.")
+    empty = [source for source, cards in results.items() if not cards]
+    if empty:
+        print(f"{len(empty)} inputs gave no cards:")
+        for source in empty:
+            print(f"  {source}")
+    if failed:
+        print(f"{len(failed)} inputs failed:")
+        for source, e in failed.items():
+            print(f"  {source}: {e}")
+    return 1 if failed else 0
+
+
+parser = argparse.ArgumentParser(
+    prog="autocards",
+    description=__doc__.strip().split("\n")[0])
+parser.add_argument("inputs", nargs="*",
+                    help="files, directories, glob patterns or urls")
+parser.add_argument("--urls", type=str, default=None,
+                    help="text file containing one url per line")
+parser.add_argument("--output-dir", "-o", type=str, default=".",
+                    help="where to write the exports, default is '.'")
+parser.add_argument("--merge", "-m", type=str, default=None, metavar="NAME",
+                    help="write all the cards to a single export named NAME \
+instead of one export per input")
+parser.add_argument("--format", "-f", default="csv",
+                    choices=["csv", "json", "parquet", "feather"])
+parser.add_argument("--jobs", "-j", type=int, default=4,
+                    help="number of inputs read and parsed concurrently")
+parser.add_argument("--max-in-flight", type=int, default=32,
+                    help="maximum number of text units waiting for the model")
+parser.add_argument("--packed", action="store_true",
+                    help="pack paragraphs to make the most of each model call")
+parser.add_argument("--token-budget", type=int, default=None,
+                    help="maximum number of tokens per packed unit")
+parser.add_argument("--engine", default="qg", choices=["qg", "e2e"],
+                    help="e2e generates all the questions of a text unit in \
+one pass, faster but usually with fewer cards")
+parser.add_argument("--note-type", default="both",
+                    choices=["cloze", "basic", "both"],
+                    help="cloze only skips the question generation model")
+parser.add_argument("--cascade", default=None,
+                    help="'greedy' or a smaller model decoding the questions \
+first, only the least confident ones are decoded again with beam search")
+parser.add_argument("--cascade-threshold", type=float, default=0.6,
+                    help="confidence under which a question is decoded again")
+parser.add_argument("--element", "-e", type=str, default="p",
+                    help="html element containing the text of web pages")
+parser.add_argument("--in-lang", type=str, default="en")
+parser.add_argument("--out-lang", type=str, default="en")
+parser.add_argument("--no-content", action="store_true",
+                    help="don't store the source text in the cards")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if not args.inputs and args.urls is None:
+        parser.error("give at least one input or --urls")
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Dry-run cost estimate of consuming documents, see Autocards.estimate.
+
+The documents go through the cheap stages of the pipeline only (reading,
+cleaning, segmentation, filtering) and the text units are turned into the
+answer extraction inputs the models would get, without calling them. The
+report counts the paragraphs, sentences, generate() calls (including the
+question answering batches of verify=True), real and padded tokens and the
+tokens lost to truncation, and projects the wall-clock time
+from calibration numbers measured on this machine: seconds per padded
+token of answer extraction and per generated question (or per text unit
+for the e2e engine). autotune.py saves them in the profile, otherwise
+Autocards measures them once on sample text.
+
+Translation and verification time is not part of the projection.
+"""
+
+import math
+import time
+
+from stages import ModelStage
+
+# questions per question answering batch of Autocards._verify_qa
+QA_BATCH_SIZE = 32
+
+
+def new_report():
+    "Empty report, filled by EstimateStage then project"
+    return {"paragraphs": 0, "sentences": 0, "batches": 0,
+            "generate_calls": 0, "verify_batches": 0, "tokens": 0,
+            "padded_tokens": 0,
+            "truncated_tokens": 0, "truncated_inputs": 0,
+            "projected_seconds": None}
+
+
+def _batch_tokens(lengths, budget, n_special):
+    "Real, padded and truncated tokens of a batch of inputs of lengths"
+    real = [min(n, budget) + n_special for n in lengths]
+    truncated = [max(0, n - budget) for n in lengths]
+    padded = len(real) * max(real) if real else 0
+    return sum(real), padded, sum(truncated), sum(1 for t in truncated if t)
+
+
+def input_lengths(qg, texts):
+    """
+    Token length (without special tokens) of each model input the texts
+    give: one answer extraction input per sentence for QGPipeline, one
+    input per text for the e2e engine. Also returns the sentence count.
+    """
+    if hasattr(qg, "_prepare_inputs_for_ans_extraction"):
+        lengths, n_sents = [], 0
+        for text in texts:
+            sents, inputs = qg._prepare_inputs_for_ans_extraction(" ".join(text.split()))
+            lengths.extend(len(ids) for ids in inputs)
+            n_sents += len(sents)
+        return lengths, n_sents
+    from nltk import sent_tokenize
+    # the prefix and separators around each context
+    overhead = 512 - qg.content_token_budget() \
+        - qg.e2e.tokenizer.num_special_tokens_to_add()
+    lengths = [n + overhead for n in qg.count_tokens(texts)]
+    return lengths, sum(len(sent_tokenize(text)) for text in texts)
+
+
+class EstimateStage(ModelStage):
+    """
+    Last stage of the pipeline of Autocards.estimate: adds the costs of
+    each batch of text units to report instead of creating cards
+    """
+    name = "estimate"
+
+    def __init__(self, autocards, report, batch_size=None, progress=None):
+        super().__init__(autocards)
+        self.report = report
+        self.batch_size = batch_size or autocards.batch_size
+        self.progress = progress
+
+    def process(self, units):
+        autocards = self.autocards
+        # the tokenizers only, unless the models are already loaded
+        qg = autocards._counter()
+        report = self.report
+        per_unit = [input_lengths(qg, [unit.text]) for unit in units]
+        lengths = [n for unit_lengths, _ in per_unit for n in unit_lengths]
+        unit_sents = [n for _, n in per_unit]
+        n_sents = sum(unit_sents)
+        tokenizer = qg.tokenizer if hasattr(qg, "tokenizer") else qg.e2e.tokenizer
+        n_special = tokenizer.num_special_tokens_to_add()
+        real, padded, truncated, truncated_inputs = _batch_tokens(
+            lengths, 512 - n_special, n_special)
+
+        report["paragraphs"] += len(units)
+        report["sentences"] += n_sents
+        report["batches"] += 1
+        report["tokens"] += real
+        report["padded_tokens"] += padded
+        report["truncated_tokens"] += truncated
+        report["truncated_inputs"] += truncated_inputs
+        if autocards.engine == "e2e":
+            # questions then question answering
+            calls = math.ceil(len(units) / qg.e2e.batch_size) + 1
+        else:
+            calls = 1 + (autocards.note_type != "cloze")
+        if autocards.verify:
+            # the questions of each unit are answered QA_BATCH_SIZE at a time
+            per_sentence = autocards.calibration()["answers_per_sentence"]
+            verify = sum(math.ceil(n * per_sentence / QA_BATCH_SIZE)
+                         for n in unit_sents)
+            report["verify_batches"] += verify
+            calls += verify
+        report["generate_calls"] += calls
+        if self.progress is not None:
+            self.progress.update(len(units))
+        return units
+
+
+def calibrate(qg, engine="qg", sample_text=None, batch_size=4):
+    """
+    Speed of the models of qg on this machine, measured on sample text
+    (autotune's by default) after a first warmup call: seconds per padded
+    token of answer extraction, per generated question and answers per
+    sentence for QGPipeline, seconds per text unit for the e2e engine.
+    """
+    import autotune
+
+    units = autotune._units(sample_text or autotune.SAMPLE_TEXT, batch_size)
+    batches = [units[i:i + batch_size] for i in range(0, len(units), batch_size)]
+    qg(batches[0])  # warmup
+    calibration = {"engine": engine, "batch_size": batch_size}
+    if engine == "e2e":
+        start = time.perf_counter()
+        for batch in batches:
+            qg(batch)
+        calibration["seconds_per_unit"] = (time.perf_counter() - start) / len(units)
+        return calibration
+
+    n_special = qg.tokenizer.num_special_tokens_to_add()
+    extract_time = generate_time = 0
+    padded = n_sents = n_answers = 0
+    for batch in batches:
+        lengths, batch_sents = input_lengths(qg, batch)
+        padded += _batch_tokens(lengths, 512 - n_special, n_special)[1]
+        n_sents += batch_sents
+        start = time.perf_counter()
+        extracted = qg.extract(batch)
+        extract_time += time.perf_counter() - start
+        start = time.perf_counter()
+        qg.generate(batch, extracted)
+        generate_time += time.perf_counter() - start
+        n_answers += sum(len(sent_answers) for _, answers in extracted
+                         for sent_answers in answers)
+    calibration.update(
+        seconds_per_token=extract_time / max(padded, 1),
+        seconds_per_question=generate_time / max(n_answers, 1),
+        answers_per_sentence=n_answers / max(n_sents, 1))
+    return calibration
+
+
+def project(report, calibration, note_type="both"):
+    "Add the projected wall-clock seconds of the report, from calibration"
+    if calibration.get("engine") == "e2e":
+        seconds = report["paragraphs"] * calibration["seconds_per_unit"]
+    else:
+        seconds = report["padded_tokens"] * calibration["seconds_per_token"]
+        if note_type != "cloze":
+            seconds += (report["sentences"] * calibration["answers_per_sentence"]
+                        * calibration["seconds_per_question"])
+    report["projected_seconds"] = round(seconds, 1)
+    return report
+
+
+def summary(report):
+    "Human readable summary of a report"
+    padding = 1 - report["tokens"] / report["padded_tokens"] \
+        if report["padded_tokens"] else 0
+    lines = [f"{report['paragraphs']} paragraphs, {report['sentences']} sentences",
+             f"{report['generate_calls']} generate() calls in "
+             f"{report['batches']} batches"
+             + (f", {report['verify_batches']} of them to verify the cards"
+                if report["verify_batches"] else ""),
+             f"{report['tokens']} tokens, {report['padded_tokens']} with padding "
+             f"({padding:.0%} padding)",
+             f"{report['truncated_tokens']} tokens lost to truncation in "
+             f"{report['truncated_inputs']} inputs"]
+    if report["projected_seconds"] is not None:
+        minutes, seconds = divmod(round(report["projected_seconds"]), 60)
+        hours, minutes = divmod(minutes, 60)
+        lines.append(f"projected time: {hours}h{minutes:02d}m{seconds:02d}s")
+    return "\n".join(lines)
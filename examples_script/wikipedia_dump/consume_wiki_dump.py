@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Create flashcards from a local Wikipedia dump, for example
+enwiki-latest-pages-articles.xml.bz2 from https://dumps.wikimedia.org/enwiki/
+Defaults to the small sample dump of this folder.
+"""
+
+import argparse
+import sys
+sys.path.append("../../.")
+from autocards import Autocards
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("dump", nargs="?", default="sample-pages-articles.xml.bz2")
+parser.add_argument("--titles", "-t", nargs="*", default=None,
+                    help="titles of the articles to read, default is all")
+parser.add_argument("--max-pages", "-n", type=int, default=None)
+parser.add_argument("--output", "-o", default="wiki_dump_cards.csv")
+args = parser.parse_args()
+
+auto = Autocards()
+auto.consume_wiki_dump(args.dump, titles=args.titles, max_pages=args.max_pages)
+auto.to_csv(args.output)
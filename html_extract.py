@@ -0,0 +1,209 @@
+"""
+Extraction of the title and main text sections of html pages, for
+consume_web.
+
+Three backends are available, picked by name:
+    - "selectolax": fastest, its lexbor parser, needs `pip install selectolax`
+    - "lxml": fast, lxml is already needed by BeautifulSoup's xml parser
+    - "bs4": the original BeautifulSoup xml parser, kept for comparison
+By default the fastest installed one is used. The lxml and selectolax
+backends parse the page as html and find the main content readability
+style: every text element scores its parent and, for half, its
+grandparent, by its length and number of commas, and the sections kept
+are the ones of the best scoring container and of its sibling containers
+scoring at least a fifth of it, like the sections of an article.
+Navigation, footers, sidebars and comments are penalized.
+
+extract_many parses many downloaded pages in a process pool.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+PARSERS = ["selectolax", "lxml", "bs4"]
+
+# class or id of containers unlikely to hold the main content
+_UNLIKELY = re.compile(r"comment|footer|nav|menu|sidebar|banner|"
+                       r"ad-|ads|share|social|related|cookie|popup|header",
+                       re.IGNORECASE)
+_LIKELY = re.compile(r"article|body|content|entry|main|page|post|text|story",
+                     re.IGNORECASE)
+_SKIPPED_TAGS = ["script", "style", "noscript", "template"]
+# share of the best score a sibling container needs to be kept
+_SIBLING_SHARE = 0.2
+
+
+def default_parser():
+    "Name of the fastest installed backend"
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+        return "selectolax"
+    except ImportError:
+        pass
+    try:
+        import lxml
+        return "lxml"
+    except ImportError:
+        return "bs4"
+
+
+def _clean(text):
+    return " ".join(text.split())
+
+
+def _label_weight(label):
+    "Readability style weight of a container from its class and id"
+    weight = 0
+    if _UNLIKELY.search(label):
+        weight -= 25
+    if _LIKELY.search(label):
+        weight += 25
+    return weight
+
+
+def _main_content(paragraphs):
+    """
+    Texts of the main content, from (text, parent, grandparent) tuples where
+    parent and grandparent are (key, label) pairs identifying a container
+    and giving its class and id.
+    """
+    scores = {}
+    # container of each parent container
+    up = {}
+    for text, parent, grandparent in paragraphs:
+        up[parent[0]] = grandparent[0]
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        for (key, label), share in [(parent, 1), (grandparent, 0.5)]:
+            if key is None:
+                continue
+            if key not in scores:
+                scores[key] = _label_weight(label)
+            scores[key] += score * share
+    if not scores:
+        return [text for text, _, _ in paragraphs if text]
+    best = max(scores, key=scores.get)
+    kept = {best}
+    if up.get(best) is not None:
+        kept.update(key for key, score in scores.items()
+                    if up.get(key) == up[best]
+                    and score >= _SIBLING_SHARE * scores[best])
+    return [text for text, parent, grandparent in paragraphs
+            if text and (parent[0] in kept or grandparent[0] in kept)]
+
+
+def _parse_selectolax(html, element):
+    from selectolax.lexbor import LexborHTMLParser
+
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(_SKIPPED_TAGS)
+
+    def container(node):
+        if node is None:
+            return None, ""
+        attrs = node.attributes
+        return node.mem_id, f"{attrs.get('class') or ''} {attrs.get('id') or ''}"
+
+    paragraphs = []
+    for node in tree.css(element):
+        parent = node.parent
+        grandparent = parent.parent if parent is not None else None
+        paragraphs.append((_clean(node.text(separator=" ")),
+                           container(parent), container(grandparent)))
+
+    title = ""
+    for selector in ["h1", "title"]:
+        node = tree.css_first(selector)
+        if node is not None and _clean(node.text()):
+            title = _clean(node.text())
+            break
+    return title, _main_content(paragraphs)
+
+
+def _parse_lxml(html, element):
+    import lxml.html
+    from lxml.etree import ParserError
+
+    if isinstance(html, str):
+        # lxml refuses str with an encoding declaration
+        html = re.sub(r"^\s*<\?xml[^>]*>", "", html)
+    try:
+        root = lxml.html.document_fromstring(html)
+    except ParserError:
+        return "", []
+    for node in list(root.iter(*_SKIPPED_TAGS)):
+        node.drop_tree()
+
+    def container(node):
+        if node is None:
+            return None, ""
+        # the element itself is the key: lxml gives the same proxy object
+        # for a node as long as a reference to it is kept
+        return node, f"{node.get('class', '')} {node.get('id', '')}"
+
+    paragraphs = []
+    for node in root.iter(element):
+        parent = node.getparent()
+        grandparent = parent.getparent() if parent is not None else None
+        paragraphs.append((_clean(node.text_content()),
+                           container(parent), container(grandparent)))
+
+    title = ""
+    for tag in ["h1", "title"]:
+        node = next(root.iter(tag), None)
+        if node is not None and _clean(node.text_content()):
+            title = _clean(node.text_content())
+            break
+    return title, _main_content(paragraphs)
+
+
+def _parse_bs4(html, element):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'xml')
+
+    try:
+        el = soup.article.body.find_all(element)
+    except AttributeError:
+        print("Using fallback method to extract page content")
+        el = soup.find_all(element)
+
+    title = ""
+    for tag in ["h1", "title"]:
+        node = soup.find(tag)
+        if node is not None and _clean(node.text):
+            title = _clean(node.text)
+            break
+    return title, [_clean(section.get_text()) for section in el]
+
+
+def extract(html, element="p", parser=None):
+    """
+    Title of an html page, empty if none was found, and the text of each
+    of its element tags holding the main content
+    """
+    parser = parser or default_parser()
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown html parser {parser}, available parsers \
+are {PARSERS}")
+    return globals()[f"_parse_{parser}"](html, element)
+
+
+def extract_many(pages, element="p", parser=None, processes=None):
+    """
+    extract() every page, in a pool of processes (by default one per cpu)
+    when there are several pages, in the order of pages
+    """
+    parser = parser or default_parser()
+    work = partial(extract, element=element, parser=parser)
+    if processes == 1 or len(pages) < 2:
+        return [work(page) for page in pages]
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(work, pages,
+                             chunksize=max(1, len(pages) // (4 * processes))))
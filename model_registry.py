@@ -0,0 +1,201 @@
+"""
+Process-wide registry of loaded models, tokenizers and translation pipelines.
+
+Everything loaded through the registry is keyed by its kind and name, so two
+Autocards instances, or the question generation and answer extraction models
+of one qg_pipeline, asking for the same checkpoint share a single loaded
+object. Users are reference counted: objects nobody uses anymore stay loaded
+for the next user but are evicted, least recently used first, as soon as the
+loaded models exceed memory_budget bytes. The budget defaults to the
+AUTOCARDS_MODEL_MEMORY_MB environment variable, no budget means idle models
+are never evicted.
+
+Each registered object also has a lock: the fast tokenizers and the models
+must not be called from two threads at once, even by two users of the
+registry. ModelLock holds the locks of all the objects of one user.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+MEMORY_BUDGET_ENV = "AUTOCARDS_MODEL_MEMORY_MB"
+
+
+def _memory_size(obj):
+    "Bytes used by the parameters and buffers of a model or pipeline"
+    model = getattr(obj, "model", obj)
+    if not hasattr(model, "parameters"):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    # tied weights are counted once
+    seen = {t.data_ptr(): t.numel() * t.element_size() for t in tensors}
+    return sum(seen.values())
+
+
+class _Entry:
+    def __init__(self):
+        self.obj = None
+        self.size = 0
+        self.refcount = 0
+        # held while the object is loaded
+        self.loading = threading.Lock()
+        # held while the object is called, see ModelLock
+        self.lock = threading.RLock()
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget=None):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def acquire(self, kind, name, loader):
+        """
+        Return the object registered as (kind, name), calling loader() to
+        load it if needed, and count one more user of it. Every acquire
+        must be matched by a release once the object is not used anymore.
+        Only the users of the same key wait for loader, the registry stays
+        usable for the others while it runs.
+        """
+        key = (kind, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry()
+                self._entries[key] = entry
+            # not evicted while it loads
+            entry.refcount += 1
+            self._entries.move_to_end(key)
+        try:
+            with entry.loading:
+                if entry.obj is None:
+                    obj = loader()
+                    entry.size = _memory_size(obj)
+                    entry.obj = obj
+        except BaseException:
+            with self._lock:
+                entry.refcount -= 1
+                # the next user tries to load it again
+                if entry.obj is None and entry.refcount == 0 \
+                        and self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        with self._lock:
+            self._evict()
+        return entry.obj
+
+    def release(self, kind, name):
+        "Count one less user of (kind, name), which becomes evictable at 0"
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            if entry is None or entry.refcount == 0:
+                return
+            entry.refcount -= 1
+            self._evict()
+
+    def release_all(self, keys):
+        for kind, name in keys:
+            self.release(kind, name)
+
+    def lock(self, kind, name):
+        "Lock of the object registered as (kind, name), None if there is none"
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            return None if entry is None else entry.lock
+
+    def memory_used(self):
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def _evict(self):
+        if self.memory_budget is None:
+            return
+        used = self.memory_used()
+        for key in list(self._entries):
+            if used <= self.memory_budget:
+                break
+            entry = self._entries[key]
+            if entry.refcount == 0:
+                used -= entry.size
+                del self._entries[key]
+
+    def clear(self):
+        "Forget all idle objects"
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.refcount == 0]:
+                del self._entries[key]
+
+    def stats(self):
+        "One dictionnary per registered object, least recently used first"
+        with self._lock:
+            return [{"kind": kind, "name": name, "refcount": entry.refcount,
+                     "bytes": entry.size}
+                    for (kind, name), entry in self._entries.items()]
+
+
+class ModelLock:
+    """
+    Reentrant lock of a user of the registry, like an Autocards instance,
+    that also holds the locks of the registered objects in keys, a list
+    the user keeps up to date: users sharing a model or a tokenizer never
+    call it from two threads at once.
+    """
+
+    def __init__(self, keys, registry=None):
+        self.keys = keys
+        self._registry = registry
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._held = {}  # key: entry lock, while the lock is held
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            self._owner = threading.get_ident()
+            try:
+                self._hold()
+            except BaseException:
+                self.__exit__()
+                raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            self._release_held()
+            self._owner = None
+        self._lock.release()
+
+    def refresh(self):
+        """
+        Also hold the locks of the keys added since the lock was taken, if
+        it is held by this thread, e.g. after loading a model
+        """
+        if self._owner == threading.get_ident() and set(self.keys) != set(self._held):
+            self._release_held()
+            self._hold()
+
+    def _hold(self):
+        reg = self._registry or registry
+        # always in the same order, so that users never wait for each other
+        for key in sorted(set(self.keys)):
+            lock = reg.lock(*key)
+            if lock is not None:
+                lock.acquire()
+                self._held[key] = lock
+
+    def _release_held(self):
+        for lock in self._held.values():
+            lock.release()
+        self._held = {}
+
+
+def _default_budget():
+    budget = os.environ.get(MEMORY_BUDGET_ENV)
+    return None if budget is None else float(budget) * 1024 ** 2
+
+
+registry = ModelRegistry(memory_budget=_default_budget())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Local store of pre-serialised models for fast, offline startup.
+
+`python model_store.py valhalla/distilt5-qa-qg-hl-12-6 --model-dir DIR`
+converts models once into DIR: weights as safetensors, the config, and the
+fast tokenizer pickled. Loading from DIR memory-maps the weights instead of
+deserialising them into private memory, so the OS page cache shares one copy
+of the weights between all the worker processes of a node, and never
+contacts the model hub.
+
+The store is used by qg_pipeline and Autocards when they are given a
+model_dir, or when the AUTOCARDS_MODEL_DIR environment variable is set.
+It needs the safetensors package (`pip install safetensors`), without it
+the models are downloaded from the hub as usual. Memory-mapping also needs
+torch >= 2.1, with older versions the stored weights are copied into the
+model, still offline.
+"""
+
+import argparse
+import os
+import pickle
+from collections import defaultdict
+from pathlib import Path
+
+MODEL_DIR_ENV = "AUTOCARDS_MODEL_DIR"
+WEIGHTS_NAME = "model.safetensors"
+TOKENIZER_NAME = "tokenizer.pkl"
+
+
+def default_model_dir():
+    "Model store given by the AUTOCARDS_MODEL_DIR environment variable"
+    return os.environ.get(MODEL_DIR_ENV)
+
+
+def _has_safetensors():
+    try:
+        import safetensors.torch  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _can_assign():
+    "Whether load_state_dict can use the tensors as parameters, torch >= 2.1"
+    import inspect
+    import torch
+
+    return "assign" in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def stored_path(name, model_dir):
+    """
+    Directory of a model in the store, None if it was not converted or if
+    the store can't be read without safetensors
+    """
+    if model_dir is None:
+        return None
+    path = Path(model_dir).expanduser() / name.replace("/", "--")
+    if not (path / WEIGHTS_NAME).exists():
+        return None
+    if not _has_safetensors():
+        print(f"Not using the model store for {name}, it needs the \
+safetensors package: pip install safetensors")
+        return None
+    return path
+
+
+def export_model(name, model_dir):
+    "Download a seq2seq model and its tokenizer and add them to the store"
+    if not _has_safetensors():
+        raise ImportError("The model store needs the safetensors package: \
+pip install safetensors")
+    from safetensors.torch import save_model
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+    path = Path(model_dir).expanduser() / name.replace("/", "--")
+    path.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+    model = AutoModelForSeq2SeqLM.from_pretrained(name)
+    model.config.save_pretrained(path)
+    # save_model deduplicates tied weights such as T5's shared embeddings
+    save_model(model, str(path / WEIGHTS_NAME))
+    with open(path / TOKENIZER_NAME, "wb") as f:
+        pickle.dump(tokenizer, f)
+    return path
+
+
+def _add_tied_weights(model, state_dict):
+    """
+    Add to state_dict the weights tied to a stored one under another name:
+    export_model stores each shared tensor once, under any of its names
+    """
+    names = defaultdict(list)
+    for name, tensor in model.state_dict(keep_vars=True).items():
+        names[id(tensor)].append(name)
+    for tied in names.values():
+        stored = [name for name in tied if name in state_dict]
+        for name in tied:
+            if stored and name not in state_dict:
+                state_dict[name] = state_dict[stored[0]]
+
+
+def load_model(path):
+    "Load a stored model, with memory-mapped weights when possible"
+    import torch
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, AutoModelForSeq2SeqLM
+
+    config = AutoConfig.from_pretrained(path, local_files_only=True)
+    # tensors returned by load_file are views of the memory-mapped file
+    state_dict = load_file(str(Path(path) / WEIGHTS_NAME), device="cpu")
+    if _can_assign():
+        with torch.device("meta"):
+            model = AutoModelForSeq2SeqLM.from_config(config)
+        _add_tied_weights(model, state_dict)
+        # assign=True makes them the parameters instead of copying them
+        result = model.load_state_dict(state_dict, strict=False, assign=True)
+    else:
+        print(f"Copying the weights of {path}, memory-mapping them needs \
+torch >= 2.1")
+        model = AutoModelForSeq2SeqLM.from_config(config)
+        _add_tied_weights(model, state_dict)
+        result = model.load_state_dict(state_dict, strict=False)
+    # buffers not in the state dict stay on the meta device
+    missing = result.missing_keys + [name for name, buffer in model.named_buffers()
+                                     if getattr(buffer, "is_meta", False)]
+    if missing or result.unexpected_keys:
+        raise ValueError(f"The model stored in {path} does not match its \
+config (missing: {missing}, unexpected: {result.unexpected_keys}), convert it \
+again with model_store.py")
+    model.tie_weights()
+    return model.eval()
+
+
+def load_tokenizer(path):
+    "Load a stored fast tokenizer"
+    with open(Path(path) / TOKENIZER_NAME, "rb") as f:
+        return pickle.load(f)
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("models", nargs="+",
+                    help="names of the models to convert, like \
+valhalla/distilt5-qa-qg-hl-12-6 or Helsinki-NLP/opus-mt-fr-en")
+parser.add_argument("--model-dir", "-d", type=str, default=default_model_dir(),
+                    help=f"where to store the models, defaults to \
+${MODEL_DIR_ENV}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.model_dir is None:
+        parser.error(f"give --model-dir or set ${MODEL_DIR_ENV}")
+    if not _has_safetensors():
+        parser.error("the model store needs the safetensors package: \
+pip install safetensors")
+    for name in args.models:
+        print(f"Converting {name}...")
+        print(f"Stored in {export_model(name, args.model_dir)}")
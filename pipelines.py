@@ -1,19 +1,69 @@
 import itertools
 import logging
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, List, Union
 
 from nltk import sent_tokenize
 
 import torch
+import model_store
+from model_registry import registry
 from transformers import(
+    AutoConfig,
     AutoModelForSeq2SeqLM, 
     AutoTokenizer,
+    PretrainedConfig,
     PreTrainedModel,
     PreTrainedTokenizer,
 )
 
 logger = logging.getLogger(__name__)
 
+
+def _read_model(name, model_dir=None):
+    "Load a seq2seq model, from the local model store if it was converted"
+    path = model_store.stored_path(name, model_dir or model_store.default_model_dir())
+    if path is not None:
+        return model_store.load_model(path)
+    return AutoModelForSeq2SeqLM.from_pretrained(name)
+
+
+def _read_tokenizer(name, model_dir=None, **kwargs):
+    "Load a tokenizer, from the local model store if it was converted"
+    path = model_store.stored_path(name, model_dir or model_store.default_model_dir())
+    if path is not None and not kwargs:
+        return model_store.load_tokenizer(path)
+    return AutoTokenizer.from_pretrained(name, **kwargs)
+
+
+def _read_config(name, model_dir=None):
+    "Config of a model, from the local model store if it was converted"
+    path = model_store.stored_path(name, model_dir or model_store.default_model_dir())
+    if path is not None:
+        return AutoConfig.from_pretrained(path, local_files_only=True)
+    return AutoConfig.from_pretrained(name)
+
+
+def _load_model(name, model_dir=None, loaded=None):
+    """
+    Get a seq2seq model from the process-wide model registry, loading it if
+    needed. The registry key is appended to loaded, to be released later.
+    """
+    model = registry.acquire("model", name, lambda: _read_model(name, model_dir))
+    if loaded is not None:
+        loaded.append(("model", name))
+    return model
+
+
+def _load_tokenizer(name, model_dir=None, loaded=None, **kwargs):
+    "Same as _load_model for tokenizers"
+    key = name if not kwargs else f"{name} {sorted(kwargs.items())}"
+    tokenizer = registry.acquire("tokenizer", key,
+                                 lambda: _read_tokenizer(name, model_dir, **kwargs))
+    if loaded is not None:
+        loaded.append(("tokenizer", key))
+    return tokenizer
+
+
 class QGPipeline:
     """Poor man's QG pipeline"""
     def __init__(
@@ -34,73 +84,280 @@ class QGPipeline:
         self.qg_format = qg_format
 
         self.device = "cuda" if torch.cuda.is_available() and use_cuda else "cpu"
-        self.model.to(self.device)
-
-        if self.ans_model is not self.model:
-            self.ans_model.to(self.device)
-
-        assert self.model.__class__.__name__ in ["T5ForConditionalGeneration", "BartForConditionalGeneration"]
-        
-        if "T5ForConditionalGeneration" in self.model.__class__.__name__:
-            self.model_type = "t5"
+        if isinstance(model, PretrainedConfig):
+            # tokenizers only, see qg_pipeline(tokenizer_only=True)
+            self.model = self.ans_model = None
+            self.model_type = "bart" if model.model_type == "bart" else "t5"
         else:
-            self.model_type = "bart"
-
-    def __call__(self, inputs: str):
-        inputs = " ".join(inputs.split())
-        sents, answers = self._extract_answers(inputs)
-        flat_answers = list(itertools.chain(*answers))
-        
-        if len(flat_answers) == 0:
-          return []
-
-        if self.qg_format == "prepend":
-            qg_examples = self._prepare_inputs_for_qg_from_answers_prepend(inputs, answers)
+            self.model.to(self.device)
+
+            if self.ans_model is not self.model:
+                self.ans_model.to(self.device)
+
+            assert self.model.__class__.__name__ in ["T5ForConditionalGeneration", "BartForConditionalGeneration"]
+
+            if "T5ForConditionalGeneration" in self.model.__class__.__name__:
+                self.model_type = "t5"
+            else:
+                self.model_type = "bart"
+
+        # the fixed parts of every model input, encoded once
+        self.span_cache_size = 100_000
+        self.num_beams = 4
+        # answers are decoded only from spans of their highlighted sentence
+        self.constrained_answers = True
+        # "cloze" skips the question generation model, "basic" the clozes
+        self.note_type = "both"
+        # questions decoded greedily by cascade first (self.model or a
+        # smaller model sharing its tokenizer), only those with a confidence
+        # under cascade_threshold decoded again by self.model with beams
+        self.cascade = None
+        self.cascade_threshold = 0.6
+        self.cascade_counts = {"fast": 0, "escalated": 0}
+        self._span_cache = {}
+        self._ans_prefix_ids = self.tokenizer.encode("extract answers:", add_special_tokens=False)
+        self._qg_prefix_ids = self.tokenizer.encode("generate question:", add_special_tokens=False)
+        self._hl_ids = self.tokenizer.encode("<hl>", add_special_tokens=False)
+        # special tokens around every model input, added by _build_batch
+        self._bos_ids = [self.tokenizer.bos_token_id] if self.model_type == "bart" else []
+        self._eos_ids = [self.tokenizer.eos_token_id]
+        self._sep_id = self.ans_tokenizer.convert_tokens_to_ids("<sep>")
+
+    def __call__(self, inputs: Union[str, List[str]]):
+        """
+        Create qa pairs from a text. Given a list of texts, the model calls of
+        all of them are batched together and a list of outputs is returned.
+        """
+        if isinstance(inputs, str):
+            return self._call_batch([inputs])[0]
+        return self._call_batch(inputs)
+
+    def _call_batch(self, texts):
+        return self.generate(texts, self.extract(texts))
+
+    def extract(self, texts: List[str], segmented: Optional[List[tuple]] = None) -> List[tuple]:
+        """
+        First step of __call__: the sentences of each text and the answers
+        extracted from each sentence, to give to generate. Raises IndexError
+        when none of the texts has a sentence. segmented is the sentences of
+        each text and their token ids, from a TokenCorpus, in which case the
+        texts are not split nor tokenized again.
+        """
+        if segmented is not None:
+            self._add_spans([s for sents, _ in segmented for s in sents],
+                            [ids for _, sent_ids in segmented for ids in sent_ids])
+            texts = [" ".join(sents) for sents, _ in segmented]
+            sents = [list(sents) for sents, _ in segmented]
         else:
-            qg_examples = self._prepare_inputs_for_qg_from_answers_hl(sents, answers)
-        
-        qg_inputs = [example['source_text'] for example in qg_examples]
-        questions = self._generate_questions(qg_inputs)
-        output = [{'answer': example['answer'], 
-                   'question': que,
-                   'cloze': "",
-                   'note_type': "basic"} for example, que in
-                  zip(qg_examples, questions)]
-        output.extend([ {'cloze': cl,
-                         "note_type": "cloze",
-                         "question": "",
-                         "answer": ""} for cl in qg_inputs])
-        return output
+            texts = [" ".join(text.split()) for text in texts]
+            sents = None
+        sents, answers = self._extract_answers(texts, sents)
+        return list(zip(sents, answers))
+
+    def generate(self, texts: List[str], extracted: List[tuple]) -> List[List[dict]]:
+        "Second step of __call__: the qa pairs of each text from its answers"
+        texts = [" ".join(text.split()) for text in texts]
+        sents = [text_sents for text_sents, _ in extracted]
+        answers = [text_answers for _, text_answers in extracted]
+
+        qg_examples = []
+        for text, text_sents, text_answers in zip(texts, sents, answers):
+            flat_answers = list(itertools.chain(*text_answers))
+            if len(flat_answers) == 0:
+                qg_examples.append([])
+            elif self.qg_format == "prepend":
+                qg_examples.append(self._prepare_inputs_for_qg_from_answers_prepend(text, text_answers))
+            else:
+                qg_examples.append(self._prepare_inputs_for_qg_from_answers_hl(text_sents, text_answers))
+
+        flat_examples = list(itertools.chain(*qg_examples))
+        questions, confidences = [], []
+        if flat_examples and self.note_type != "cloze":
+            questions, confidences = self._generate_questions(
+                [example['input_ids'] for example in flat_examples])
+        questions = iter(zip(questions, confidences))
+
+        outputs = []
+        for examples in qg_examples:
+            output = []
+            if self.note_type != "cloze":
+                for example in examples:
+                    question, confidence = next(questions)
+                    output.append({'answer': example['answer'],
+                                   'question': question,
+                                   'cloze': "",
+                                   'note_type': "basic"})
+                    if confidence is not None:
+                        output[-1]['confidence'] = confidence
+            if self.note_type != "basic":
+                output.extend([ {'cloze': example['source_text'],
+                                 "note_type": "cloze",
+                                 "question": "",
+                                 "answer": ""} for example in examples])
+            outputs.append(output)
+        return outputs
     
     def _generate_questions(self, inputs):
-        inputs = self._tokenize(inputs, padding=True, truncation=True)
-        
-        outs = self.model.generate(
-            input_ids=inputs['input_ids'].to(self.device), 
-            attention_mask=inputs['attention_mask'].to(self.device), 
+        """
+        Question generated from each input, and its confidence when
+        self.cascade is set (None otherwise): the questions are decoded
+        greedily by the cascade model and the ones whose confidence is under
+        cascade_threshold decoded again by self.model with num_beams beams.
+        """
+        if self.cascade is None:
+            questions, _ = self._decode_questions(self.model, inputs, self.num_beams,
+                                                  scores=False)
+            return questions, [None] * len(questions)
+
+        questions, confidences = self._decode_questions(self.cascade, inputs, 1)
+        escalated = [i for i, confidence in enumerate(confidences)
+                     if confidence < self.cascade_threshold]
+        if self.cascade is self.model and self.num_beams == 1:
+            escalated = []  # would decode the same questions again
+        if escalated:
+            better, better_confidences = self._decode_questions(
+                self.model, [inputs[i] for i in escalated], self.num_beams)
+            for i, question, confidence in zip(escalated, better, better_confidences):
+                questions[i], confidences[i] = question, confidence
+        self.cascade_counts["fast"] += len(inputs) - len(escalated)
+        self.cascade_counts["escalated"] += len(escalated)
+        return questions, confidences
+
+    def _decode_questions(self, model, inputs, num_beams, scores=True):
+        """
+        Questions generated by model from inputs, and the confidence of each
+        one if scores: the geometric mean of the probabilities of its tokens
+        """
+        inputs = self._build_batch(inputs)
+
+        outs = model.generate(
+            input_ids=inputs['input_ids'].to(self.device),
+            attention_mask=inputs['attention_mask'].to(self.device),
             max_length=32,
-            num_beams=4,
+            num_beams=num_beams,
+            output_scores=scores,
+            return_dict_in_generate=True,
         )
-        
-        questions = [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in outs]
-        return questions
+
+        questions = self.tokenizer.batch_decode(outs.sequences, skip_special_tokens=True)
+        if not scores:
+            return questions, None
+        if num_beams > 1:
+            # mean log probability of the tokens of the best beam
+            log_probs = outs.sequences_scores
+        else:
+            # the scores of each step are the logits of the next token
+            tokens = outs.sequences[:, -len(outs.scores):]
+            token_log_probs = torch.stack(
+                [torch.log_softmax(step_scores.float(), dim=-1)
+                 .gather(1, tokens[:, i, None])[:, 0]
+                 for i, step_scores in enumerate(outs.scores)], dim=1)
+            # the tokens up to the end of each question, not the padding
+            # after the end of the shorter ones
+            ended = (tokens == self.tokenizer.eos_token_id).long()
+            generated = (ended.cumsum(1) - ended) == 0
+            token_log_probs = torch.where(generated, token_log_probs,
+                                          torch.zeros_like(token_log_probs))
+            log_probs = token_log_probs.sum(1) / generated.sum(1).clamp(min=1)
+        return questions, torch.exp(log_probs).tolist()
     
-    def _extract_answers(self, context):
-        sents, inputs = self._prepare_inputs_for_ans_extraction(context)
-        inputs = self._tokenize(inputs, padding=True, truncation=True)
+    def _extract_answers(self, contexts, sents=None):
+        """
+        answers of each sentence of each context, extracted in one batch.
+        sents are the sentences of each context if they are already known.
+        """
+        if sents is None:
+            sents = [None] * len(contexts)
+        sents, inputs = list(sents), []
+        for i, context in enumerate(contexts):
+            context_sents, context_inputs = self._prepare_inputs_for_ans_extraction(context, sents[i])
+            sents[i] = context_sents
+            inputs.extend(context_inputs)
+        inputs = self._build_batch(inputs)
+
+        max_length = 32
+        generate_kwargs = {}
+        if self.constrained_answers:
+            tries = [self._span_trie(ids, max_length)
+                     for context_sents in sents
+                     for ids in self._encode_spans(context_sents)]
+            generate_kwargs["prefix_allowed_tokens_fn"] = self._allowed_answer_tokens(tries)
 
         outs = self.ans_model.generate(
             input_ids=inputs['input_ids'].to(self.device), 
             attention_mask=inputs['attention_mask'].to(self.device), 
-            max_length=32,
+            max_length=max_length,
+            **generate_kwargs
         )
         
-        dec = [self.ans_tokenizer.decode(ids, skip_special_tokens=False) for ids in outs]
+        dec = self.ans_tokenizer.batch_decode(outs, skip_special_tokens=False)
         answers = [item.split('<sep>') for item in dec]
         answers = [i[:-1] for i in answers]
+
+        grouped, start = [], 0
+        for context_sents in sents:
+            grouped.append(answers[start:start + len(context_sents)])
+            start += len(context_sents)
         
-        return sents, answers
+        return sents, grouped
     
+    def _span_trie(self, ids, depth):
+        """
+        Trie of the spans of whole words of at most depth tokens of ids, as
+        nested dicts. The None key marks the nodes where a span can end.
+        """
+        tokens = self.tokenizer.convert_ids_to_tokens(ids)
+        # before token i is a word boundary if it starts a new word (marked
+        # by sentencepiece or byte level BPE) or is punctuation
+        boundary = [t.startswith(("\u2581", "\u0120"))
+                    or not any(c.isalnum() for c in t) for t in tokens] + [True]
+        root = {}
+        for start in range(len(ids)):
+            if not (boundary[start] and any(c.isalnum() for c in tokens[start])):
+                continue
+            node = root
+            for end in range(start, min(len(ids), start + depth)):
+                node = node.setdefault(ids[end], {})
+                if boundary[end + 1]:
+                    node[None] = True
+        return root
+
+    def _allowed_answer_tokens(self, tries):
+        """
+        prefix_allowed_tokens_fn constraining the answers generated for each
+        input to spans of its highlighted sentence, given as tries (see
+        _span_trie): an answer starts at a word, can only continue with the
+        next token of one of the spans it matches, and ends with <sep> at a
+        word boundary, necessarily at the end of the sentence. Answers that
+        would have been dropped for not being in the sentence are never
+        decoded.
+        """
+        sep_id = self._sep_id
+        eos_id = self.ans_tokenizer.eos_token_id
+        pad_id = self.ans_tokenizer.pad_token_id
+
+        def allowed(batch_id, prefix):
+            root = tries[batch_id]
+            node = root
+            # the first token is the decoder start token
+            for token in prefix.tolist()[1:]:
+                if token == sep_id:
+                    node = root
+                elif token in (eos_id, pad_id):
+                    return [pad_id]  # finished, only padding follows
+                else:
+                    node = node.get(token)
+                    if node is None:
+                        return [sep_id]
+            if node is root:
+                return list(root) + [eos_id]
+            allowed_ids = [token for token in node if token is not None]
+            if None in node or not allowed_ids:
+                allowed_ids.append(sep_id)
+            return allowed_ids
+
+        return allowed
+
     def _tokenize(self,
         inputs,
         padding=True,
@@ -108,36 +365,95 @@ class QGPipeline:
         add_special_tokens=True,
         max_length=512
     ):
-        inputs = self.tokenizer.batch_encode_plus(
-            inputs, 
+        inputs = self.tokenizer(
+            inputs,
             max_length=max_length,
             add_special_tokens=add_special_tokens,
             truncation=truncation,
-            padding="max_length" if padding else False,
-            pad_to_max_length=padding,
+            padding="longest" if padding else False,
             return_tensors="pt"
         )
         return inputs
+
+    def _encode_spans(self, texts):
+        """
+        Token ids (without special tokens) of each text span. Spans are
+        cached so that a sentence is only tokenized once, however many model
+        inputs it ends up in. Cache misses are encoded in one batched call.
+        """
+        # looked up once so that a concurrent clear of the cache is harmless
+        found = {t: self._span_cache.get(t) for t in set(texts) if t}
+        missing = [t for t, ids in found.items() if ids is None]
+        if missing:
+            if len(self._span_cache) + len(missing) > self.span_cache_size:
+                self._span_cache.clear()
+            # inside a model input every span follows a space, which matters
+            # for bart's byte level BPE but is a no-op for sentencepiece
+            to_encode = [" " + t if self.model_type == "bart" else t for t in missing]
+            encoded = self.tokenizer(to_encode, add_special_tokens=False)["input_ids"]
+            found.update(zip(missing, encoded))
+            self._span_cache.update(zip(missing, encoded))
+        return [found[t] if t else [] for t in texts]
+
+    def _add_spans(self, texts, ids):
+        "Put spans tokenized beforehand, with the same tokenizer, in the cache"
+        if len(self._span_cache) + len(texts) > self.span_cache_size:
+            self._span_cache.clear()
+        self._span_cache.update(zip(texts, ids))
+
+    def count_tokens(self, texts):
+        "number of tokens of each text once inside a model input"
+        return [len(ids) for ids in self._encode_spans(texts)]
+
+    def content_token_budget(self, max_length=512):
+        """
+        Number of context tokens that fit in an answer extraction or question
+        generation input before _build_batch starts truncating.
+        """
+        overhead = max(len(self._ans_prefix_ids), len(self._qg_prefix_ids))
+        overhead += 2 * len(self._hl_ids) + len(self._bos_ids) + len(self._eos_ids)
+        return max_length - overhead
+
+    def _build_batch(self, inputs, max_length=512):
+        """
+        Pad a list of token id lists into a batch, same as _tokenize would
+        have done with the equivalent strings: content is truncated to leave
+        room for the special tokens, and padding is to the longest input.
+        """
+        if not inputs:
+            # same as the tokenizer, Autocards._call_qg relies on it
+            raise IndexError("Cannot build a batch without inputs")
+        budget = max_length - len(self._bos_ids) - len(self._eos_ids)
+        inputs = [self._bos_ids + ids[:budget] + self._eos_ids for ids in inputs]
+        longest = max(len(ids) for ids in inputs)
+        pad_id = self.tokenizer.pad_token_id
+
+        input_ids = torch.full((len(inputs), longest), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(inputs), longest), dtype=torch.long)
+        for row, ids in enumerate(inputs):
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
     
-    def _prepare_inputs_for_ans_extraction(self, text):
-        sents = sent_tokenize(text)
+    def _prepare_inputs_for_ans_extraction(self, text, sents=None):
+        if sents is None:
+            sents = sent_tokenize(text)
+        sent_ids = self._encode_spans(sents)
 
         inputs = []
         for i in range(len(sents)):
-            source_text = "extract answers:"
-            for j, sent in enumerate(sents):
+            ids = list(self._ans_prefix_ids)
+            for j, ids_j in enumerate(sent_ids):
                 if i == j:
-                    sent = "<hl> %s <hl>" % sent
-                source_text = "%s %s" % (source_text, sent)
-                source_text = source_text.strip()
-            
-            if self.model_type == "t5":
-                source_text = source_text + " </s>"
-            inputs.append(source_text)
+                    ids += self._hl_ids + ids_j + self._hl_ids
+                else:
+                    ids += ids_j
+            inputs.append(ids)
 
         return sents, inputs
     
     def _prepare_inputs_for_qg_from_answers_hl(self, sents, answers):
+        sent_ids = self._encode_spans(sents)
         inputs = []
         for i, answer in enumerate(answers):
             if len(answer) == 0: continue
@@ -147,23 +463,41 @@ class QGPipeline:
                 
                 answer_text = answer_text.strip()
 
-                if answer_text.startswith('<pad> '):
-                    answer_text = answer_text[6:]
+                if answer_text.startswith('<pad>'):
+                    answer_text = answer_text[5:].strip()
 
                 if answer_text in sent: 
-                    ans_start_idx = sent.lower().index(answer_text.lower())
+                    ans_start_idx = sent.index(answer_text)
                 else:
                     continue
                 
-                sent = f"{sent[:ans_start_idx]} <hl> {answer_text} <hl> {sent[ans_start_idx + len(answer_text): ]}"
+                before = sent[:ans_start_idx]
+                after = sent[ans_start_idx + len(answer_text): ]
+                sent = f"{before} <hl> {answer_text} <hl> {after}"
                 sents_copy[i] = sent
                 
                 source_text = " ".join(sents_copy)
                 source_text = f"generate question: {source_text}" 
                 if self.model_type == "t5":
                     source_text = source_text + " </s>"
+                if self.note_type == "cloze":
+                    # no question to generate, the input is not needed
+                    inputs.append({"answer": answer_text,
+                                   "source_text": source_text})
+                    continue
+
+                before_ids, answer_ids, after_ids = self._encode_spans(
+                    [before.strip(), answer_text, after.strip()])
+                ids = list(self._qg_prefix_ids)
+                for ids_j in sent_ids[:i]:
+                    ids += ids_j
+                ids += before_ids + self._hl_ids + answer_ids + self._hl_ids + after_ids
+                for ids_j in sent_ids[i + 1:]:
+                    ids += ids_j
                 
-                inputs.append({"answer": answer_text, "source_text": source_text})
+                inputs.append({"answer": answer_text,
+                               "source_text": source_text,
+                               "input_ids": ids})
         
         return inputs
     
@@ -176,17 +510,31 @@ class QGPipeline:
                 source_text = source_text + " </s>"
             
             examples.append({"answer": answer, "source_text": source_text})
+        # _build_batch adds the special tokens, not the literal "</s>"
+        encoded = self.tokenizer([f"answer: {ex['answer']} context: {context}"
+                                  for ex in examples],
+                                 add_special_tokens=False)["input_ids"]
+        for example, ids in zip(examples, encoded):
+            example["input_ids"] = ids
         return examples
 
     
 class MultiTaskQAQGPipeline(QGPipeline):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._qa_question_ids = self.tokenizer.encode("question:", add_special_tokens=False)
+        self._qa_context_ids = self.tokenizer.encode("context:", add_special_tokens=False)
     
-    def __call__(self, inputs: Union[Dict, str]):
+    def __call__(self, inputs: Union[Dict, str, List[Dict], List[str]]):
         if type(inputs) is str:
             # do qg
             return super().__call__(inputs)
+        elif type(inputs) is list and inputs and type(inputs[0]) is str:
+            # do qg, batched
+            return super().__call__(inputs)
+        elif type(inputs) is list:
+            # do qa, batched
+            return self.answer_questions([(i["question"], i["context"]) for i in inputs])
         else:
             # do qa
             return self._extract_answer(inputs["question"], inputs["context"])
@@ -196,19 +544,42 @@ class MultiTaskQAQGPipeline(QGPipeline):
         if self.model_type == "t5":
             source_text = source_text + " </s>"
         return  source_text
+
+    def _prepare_ids_for_qa(self, pairs):
+        "token ids of _prepare_inputs_for_qa for each pair, contexts encoded once"
+        questions = self._encode_spans([q for q, _ in pairs])
+        contexts = self._encode_spans([c for _, c in pairs])
+        return [self._qa_question_ids + q_ids + self._qa_context_ids + c_ids
+                for q_ids, c_ids in zip(questions, contexts)]
     
     def _extract_answer(self, question, context):
-        source_text = self._prepare_inputs_for_qa(question, context)
-        inputs = self._tokenize([source_text], padding=False)
-    
-        outs = self.model.generate(
-            input_ids=inputs['input_ids'].to(self.device), 
-            attention_mask=inputs['attention_mask'].to(self.device), 
-            max_length=16,
-        )
+        return self.answer_questions([(question, context)])[0]
+
+    def answer_questions(self, pairs, batch_size=32):
+        """
+        Answer each (question, context) pair. Inputs are sorted by length and
+        run as padded batches of batch_size, so that little compute is spent
+        on padding.
+        """
+        if not pairs:
+            return []
+        inputs = self._prepare_ids_for_qa(pairs)
+        order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]))
+        answers = [None] * len(inputs)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self._build_batch([inputs[i] for i in batch])
+
+            outs = self.model.generate(
+                input_ids=encoded['input_ids'].to(self.device), 
+                attention_mask=encoded['attention_mask'].to(self.device), 
+                max_length=16,
+            )
 
-        answer = self.tokenizer.decode(outs[0], skip_special_tokens=True)
-        return answer
+            decoded = self.tokenizer.batch_decode(outs, skip_special_tokens=True)
+            for i, answer in zip(batch, decoded):
+                answers[i] = answer
+        return answers
 
 
 class E2EQGPipeline:
@@ -223,14 +594,19 @@ class E2EQGPipeline:
         self.tokenizer = tokenizer
 
         self.device = "cuda" if torch.cuda.is_available() and use_cuda else "cpu"
-        self.model.to(self.device)
-
-        assert self.model.__class__.__name__ in ["T5ForConditionalGeneration", "BartForConditionalGeneration"]
-        
-        if "T5ForConditionalGeneration" in self.model.__class__.__name__:
-            self.model_type = "t5"
+        if isinstance(model, PretrainedConfig):
+            # tokenizer only, see qg_pipeline(tokenizer_only=True)
+            self.model = None
+            self.model_type = "bart" if model.model_type == "bart" else "t5"
         else:
-            self.model_type = "bart"
+            self.model.to(self.device)
+
+            assert self.model.__class__.__name__ in ["T5ForConditionalGeneration", "BartForConditionalGeneration"]
+
+            if "T5ForConditionalGeneration" in self.model.__class__.__name__:
+                self.model_type = "t5"
+            else:
+                self.model_type = "bart"
         
         self.default_generate_kwargs = {
             "max_length": 256,
@@ -239,9 +615,29 @@ class E2EQGPipeline:
             "no_repeat_ngram_size": 3,
             "early_stopping": True,
         }
-    
-    def __call__(self, context: str, **generate_kwargs):
-        inputs = self._prepare_inputs_for_e2e_qg(context)
+        self.batch_size = 8
+
+    def __call__(self, context: Union[str, List[str]], **generate_kwargs):
+        """
+        Questions generated from a context, or from each context of a list,
+        generated batch_size contexts at a time
+        """
+        if isinstance(context, str):
+            return self._generate_questions([context], generate_kwargs)[0]
+
+        # contexts of similar length are batched together to limit padding
+        order = sorted(range(len(context)), key=lambda i: len(context[i]))
+        questions = [None] * len(context)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            outputs = self._generate_questions([context[i] for i in batch],
+                                               generate_kwargs)
+            for i, output in zip(batch, outputs):
+                questions[i] = output
+        return questions
+
+    def _generate_questions(self, contexts, generate_kwargs):
+        inputs = self._prepare_inputs_for_e2e_qg(contexts)
 
         # TODO: when overrding default_generate_kwargs all other arguments need to be passsed
         # find a better way to do this
@@ -264,19 +660,34 @@ class E2EQGPipeline:
             **generate_kwargs
         )
 
-        prediction = self.tokenizer.decode(outs[0], skip_special_tokens=True)
-        questions = prediction.split("<sep>")
-        questions = [question.strip() for question in questions[:-1]]
+        predictions = self.tokenizer.batch_decode(outs, skip_special_tokens=True)
+        questions = []
+        for prediction in predictions:
+            prediction = prediction.split("<sep>")
+            questions.append([question.strip() for question in prediction[:-1]])
         return questions
     
-    def _prepare_inputs_for_e2e_qg(self, context):
-        source_text = f"generate questions: {context}"
-        if self.model_type == "t5":
-            source_text = source_text + " </s>"
+    def _prepare_inputs_for_e2e_qg(self, contexts):
+        source_texts = []
+        for context in contexts:
+            source_text = f"generate questions: {context}"
+            if self.model_type == "t5":
+                source_text = source_text + " </s>"
+            source_texts.append(source_text)
         
-        inputs = self._tokenize([source_text], padding=False)
+        inputs = self._tokenize(source_texts, padding=len(source_texts) > 1)
         return inputs
     
+    def count_tokens(self, texts):
+        "Number of tokens of each text"
+        return [len(ids) for ids in self.tokenizer(
+            texts, add_special_tokens=False)["input_ids"]]
+
+    def content_token_budget(self, max_length=512):
+        "Number of tokens of a context that fit in the model input"
+        prefix = self.tokenizer.encode("generate questions:", add_special_tokens=False)
+        return max_length - len(prefix) - 2 * self.tokenizer.num_special_tokens_to_add()
+
     def _tokenize(
         self,
         inputs,
@@ -285,18 +696,94 @@ class E2EQGPipeline:
         add_special_tokens=True,
         max_length=512
     ):
-        inputs = self.tokenizer.batch_encode_plus(
-            inputs, 
+        inputs = self.tokenizer(
+            inputs,
             max_length=max_length,
             add_special_tokens=add_special_tokens,
             truncation=truncation,
-            padding="max_length" if padding else False,
-            pad_to_max_length=padding,
+            padding="longest" if padding else False,
             return_tensors="pt"
         )
         return inputs
 
 
+class E2ECardPipeline:
+    """
+    Cards made in a single generation pass per context: the questions come
+    from an E2EQGPipeline and their answers from the batched question
+    answering of a MultiTaskQAQGPipeline, which is much cheaper than the
+    beam search of the generation. Returns the same card dictionnaries as
+    QGPipeline, a cloze card is made for each answer found in the context.
+    The questions are needed to find the answers, so note_type "cloze" only
+    saves the basic cards, "basic" skips the clozes.
+    """
+
+    def __init__(self, e2e: E2EQGPipeline, qa: MultiTaskQAQGPipeline):
+        self.e2e = e2e
+        self.qa = qa
+        self.registry_keys = e2e.registry_keys + qa.registry_keys
+        self.note_type = "both"
+
+    def __call__(self, inputs: Union[str, List[str]]):
+        if isinstance(inputs, str):
+            return self._call_batch([inputs])[0]
+        return self._call_batch(inputs)
+
+    def _call_batch(self, texts):
+        texts = [" ".join(text.split()) for text in texts]
+        questions = self.e2e(texts)
+        pairs = [(question, text)
+                 for text, text_questions in zip(texts, questions)
+                 for question in text_questions if question]
+        answers = iter(self.qa.answer_questions(pairs) if pairs else [])
+
+        outputs = []
+        for text, text_questions in zip(texts, questions):
+            output = []
+            clozes = []
+            for question in text_questions:
+                if not question:
+                    continue
+                answer = next(answers).strip()
+                if not answer:
+                    continue
+                if self.note_type != "cloze":
+                    output.append({'answer': answer,
+                                   'question': question,
+                                   'cloze': "",
+                                   'note_type': "basic"})
+                if self.note_type == "basic":
+                    continue
+                cloze = self._highlight(text, answer)
+                if cloze is not None and cloze not in clozes:
+                    clozes.append(cloze)
+            output.extend([{'cloze': cl,
+                            "note_type": "cloze",
+                            "question": "",
+                            "answer": ""} for cl in clozes])
+            outputs.append(output)
+        return outputs
+
+    def _highlight(self, text, answer):
+        "text with answer highlighted like QGPipeline's cloze cards"
+        start = text.lower().find(answer.lower())
+        if start == -1:
+            return None
+        before = text[:start].strip()
+        after = text[start + len(answer):].strip()
+        source_text = f"{before} <hl> {text[start:start + len(answer)]} <hl> {after}"
+        source_text = f"generate question: {source_text.strip()}"
+        if self.e2e.model_type == "t5":
+            source_text = source_text + " </s>"
+        return source_text
+
+    def count_tokens(self, texts):
+        return self.e2e.count_tokens(texts)
+
+    def content_token_budget(self, max_length=512):
+        return self.e2e.content_token_budget(max_length)
+
+
 SUPPORTED_TASKS = {
     "question-generation": {
         "impl": QGPipeline,
@@ -327,14 +814,24 @@ def qg_pipeline(
     ans_model: Optional = None,
     ans_tokenizer: Optional[Union[str, PreTrainedTokenizer]] = None,
     use_cuda: Optional[bool] = True,
+    model_dir: Optional[str] = None,
+    tokenizer_only: bool = False,
     **kwargs,
 ):
+    """
+    Pipeline of a task with its models and tokenizers, loaded from their
+    names through the model registry. With tokenizer_only=True only the
+    tokenizers and the configs of the models are loaded: the pipeline can
+    count and prepare model inputs, for cost estimates, but not call the
+    models.
+    """
     # Retrieve the task
     if task not in SUPPORTED_TASKS:
         raise KeyError("Unknown task {}, available tasks are {}".format(task, list(SUPPORTED_TASKS.keys())))
 
     targeted_task = SUPPORTED_TASKS[task]
     task_class = targeted_task["impl"]
+    loaded = []
 
     # Use default model/config/tokenizer for the task if no model is provided
     if model is None:
@@ -355,20 +852,22 @@ def qg_pipeline(
     if isinstance(tokenizer, (str, tuple)):
         if isinstance(tokenizer, tuple):
             # For tuple we have (tokenizer name, {kwargs})
-            tokenizer = AutoTokenizer.from_pretrained(tokenizer[0], **tokenizer[1])
+            tokenizer = _load_tokenizer(tokenizer[0], model_dir, loaded, **tokenizer[1])
         else:
-            tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+            tokenizer = _load_tokenizer(tokenizer, model_dir, loaded)
     
     # Instantiate model if needed
     if isinstance(model, str):
-        model = AutoModelForSeq2SeqLM.from_pretrained(model)
+        model = _read_config(model, model_dir) if tokenizer_only \
+            else _load_model(model, model_dir, loaded)
     
     if task == "question-generation":
         if ans_model is None:
             # load default ans model
             ans_model = targeted_task["default"]["ans_model"]
-            ans_tokenizer = AutoTokenizer.from_pretrained(ans_model)
-            ans_model = AutoModelForSeq2SeqLM.from_pretrained(ans_model)
+            ans_tokenizer = _load_tokenizer(ans_model, model_dir, loaded)
+            ans_model = _read_config(ans_model, model_dir) if tokenizer_only \
+                else _load_model(ans_model, model_dir, loaded)
         else:
             # Try to infer tokenizer from model or config name (if provided as str)
             if ans_tokenizer is None:
@@ -385,16 +884,21 @@ def qg_pipeline(
             if isinstance(ans_tokenizer, (str, tuple)):
                 if isinstance(ans_tokenizer, tuple):
                     # For tuple we have (tokenizer name, {kwargs})
-                    ans_tokenizer = AutoTokenizer.from_pretrained(ans_tokenizer[0], **ans_tokenizer[1])
+                    ans_tokenizer = _load_tokenizer(ans_tokenizer[0], model_dir, loaded, **ans_tokenizer[1])
                 else:
-                    ans_tokenizer = AutoTokenizer.from_pretrained(ans_tokenizer)
+                    ans_tokenizer = _load_tokenizer(ans_tokenizer, model_dir, loaded)
 
             if isinstance(ans_model, str):
-                ans_model = AutoModelForSeq2SeqLM.from_pretrained(ans_model)
+                ans_model = _read_config(ans_model, model_dir) if tokenizer_only \
+                    else _load_model(ans_model, model_dir, loaded)
     
     if task == "e2e-qg":
-        return task_class(model=model, tokenizer=tokenizer, use_cuda=use_cuda)
+        pipeline = task_class(model=model, tokenizer=tokenizer, use_cuda=use_cuda)
     elif task == "question-generation":
-        return task_class(model=model, tokenizer=tokenizer, ans_model=ans_model, ans_tokenizer=ans_tokenizer, qg_format=qg_format, use_cuda=use_cuda)
+        pipeline = task_class(model=model, tokenizer=tokenizer, ans_model=ans_model, ans_tokenizer=ans_tokenizer, qg_format=qg_format, use_cuda=use_cuda)
     else:
-        return task_class(model=model, tokenizer=tokenizer, ans_model=model, ans_tokenizer=tokenizer, qg_format=qg_format, use_cuda=use_cuda)
+        pipeline = task_class(model=model, tokenizer=tokenizer, ans_model=model, ans_tokenizer=tokenizer, qg_format=qg_format, use_cuda=use_cuda)
+    # registry keys of the models and tokenizers loaded from their names,
+    # to give to registry.release_all once the pipeline is not used anymore
+    pipeline.registry_keys = loaded
+    return pipeline
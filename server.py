@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Long lived http service that keeps the models loaded and creates flashcards
+for many clients. Model calls of concurrent requests are batched together by
+DynamicBatcher.
+
+Start it with `python server.py --port 8000` then POST json to /cards:
+    {"text": "...", "title": "...", "per_paragraph": true, "packed": false}
+or
+    {"url": "https://...", "element": "p"}
+The answer is {"title": "...", "cards": [...]} where cards are the same
+dictionnaries as in Autocards.qa_dic_list. Invalid payloads are answered
+with a 400, internal failures with a 500. GET /health returns the queue
+depth.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, CancelledError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from autocards import Autocards
+from stages import Stage, Unit
+
+
+class DynamicBatcher:
+    """
+    Collect the texts submitted by concurrent requests and give them to
+    generate as a single batch, so that answer extraction and question
+    generation each run one generate() call for the whole batch. generate
+    is Autocards._qg_batch, which holds the model lock of the instance
+    while the models are called. A batch is started as soon as
+    max_batch_size texts are waiting or max_wait seconds after its first
+    text arrived. At most max_queue texts can be waiting, submit raises
+    queue.Full above that.
+    """
+
+    def __init__(self, generate, max_batch_size=16, max_wait=0.05, max_queue=256):
+        self.generate = generate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._loop,
+                                        name="autocards-batcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """
+        Queue a text and return a Future of the pipeline output for it, None
+        if no cards can be made from that text
+        """
+        future = Future()
+        if not text.strip():
+            future.set_result(None)
+            return future
+        self.queue.put_nowait((text, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # texts of requests that timed out in the meantime are dropped
+        return [(text, future) for text, future in batch
+                if future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                outputs = self.generate([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+class BatcherStage(Stage):
+    """
+    Generate stage of the pipelines of CardService: the text units are
+    given to a DynamicBatcher, so that they are batched with the ones of
+    the other requests. Raises TimeoutError past deadline, a
+    time.monotonic() value.
+    """
+    name = "generate"
+
+    def __init__(self, batcher, deadline):
+        self.batcher = batcher
+        self.deadline = deadline
+        # the units of a request are submitted together
+        self.batch_size = batcher.max_batch_size
+
+    def __call__(self, units):
+        futures = []
+        try:
+            for unit in units:
+                futures.append(self.batcher.submit(unit.text))
+            for unit, future in zip(units, futures):
+                remaining = max(0, self.deadline - time.monotonic())
+                unit.cards = future.result(timeout=remaining)
+        except (FutureTimeoutError, CancelledError):
+            raise TimeoutError("No answer before the deadline")
+        finally:
+            for future in futures:
+                future.cancel()
+        return units
+
+
+class CardService:
+    "Turn a request payload into cards using one Autocards instance"
+
+    def __init__(self, autocards, batcher, timeout=120):
+        self.autocards = autocards
+        self.batcher = batcher
+        self.timeout = timeout
+
+    def _units(self, payload):
+        "Return the title and the text units of a request"
+        if "url" in payload:
+            res = requests.get(payload["url"], timeout=15)
+            title, sections = self.autocards._parse_web(
+                res.content, payload["url"], payload.get("element", "p"))
+            return title, [self.autocards._sanitize_text(s) for s in sections]
+        units = self.autocards._split_var(payload["text"],
+                                          payload.get("per_paragraph", False),
+                                          payload.get("packed", False))
+        return payload.get("title", "untitled variable"), units
+
+    def create_cards(self, payload):
+        """
+        Return the title and the cards of a request, made by the stage
+        pipeline of the Autocards instance with the models called through
+        the batcher. Raises queue.Full if the batcher is saturated and
+        TimeoutError if the cards were not ready within self.timeout seconds.
+        """
+        deadline = time.monotonic() + self.timeout
+        title, units = self._units(payload)
+
+        cards = []
+        pipeline = self.autocards.pipeline(qa_list=cards)
+        # the text units are already cut, and the answers are extracted by
+        # the batched generate calls
+        for name in ["ingest", "clean", "segment", "extract"]:
+            pipeline.remove(name)
+        pipeline.replace("generate", BatcherStage(self.batcher, deadline))
+        try:
+            pipeline.run((Unit(text=text, title=title) for text in units),
+                         collect=False)
+        except TimeoutError:
+            raise TimeoutError(f"No answer within {self.timeout}s")
+        return title, cards
+
+
+PAYLOAD_FIELDS = {"text": str, "title": str, "per_paragraph": bool,
+                  "packed": bool, "url": str, "element": str}
+
+
+def check_payload(payload):
+    "Raise ValueError if payload is not a valid request of /cards"
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a json object")
+    if "text" not in payload and "url" not in payload:
+        raise ValueError("payload needs a 'text' or an 'url' field")
+    for field, value in payload.items():
+        if field not in PAYLOAD_FIELDS:
+            raise ValueError(f"unknown field '{field}'")
+        if not isinstance(value, PAYLOAD_FIELDS[field]):
+            raise ValueError(f"field '{field}' must be a "
+                             f"{PAYLOAD_FIELDS[field].__name__}")
+
+
+class CardRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._send_json(404, {"error": "not found"})
+        self._send_json(200, {"status": "ok",
+                              "queue_depth": self.service.batcher.queue.qsize()})
+
+    def do_POST(self):
+        if self.path != "/cards":
+            return self._send_json(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length))
+            check_payload(payload)
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+
+        try:
+            title, cards = self.service.create_cards(payload)
+        except queue.Full:
+            return self._send_json(503, {"error": "too many pending requests"})
+        except TimeoutError as e:
+            return self._send_json(504, {"error": str(e)})
+        except requests.RequestException as e:
+            return self._send_json(502, {"error": f"could not fetch url: {e}"})
+        except Exception:
+            traceback.print_exc()
+            return self._send_json(500, {"error": "internal error"})
+        self._send_json(200, {"title": title, "cards": cards})
+
+
+def serve(autocards, host="127.0.0.1", port=8000, max_batch_size=16,
+          max_wait=0.05, max_queue=256, timeout=120):
+    "Serve cards over http until interrupted"
+    autocards.warmup()
+    batcher = DynamicBatcher(autocards._qg_batch, max_batch_size=max_batch_size,
+                             max_wait=max_wait, max_queue=max_queue)
+    CardRequestHandler.service = CardService(autocards, batcher, timeout)
+    httpd = ThreadingHTTPServer((host, port), CardRequestHandler)
+    print(f"Serving flashcards on http://{host}:{port}/cards")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--max-batch-size", type=int, default=16,
+                    help="maximum number of texts per model batch")
+parser.add_argument("--max-wait-ms", type=float, default=50,
+                    help="maximum time a text waits for a batch to fill up")
+parser.add_argument("--max-queue", type=int, default=256,
+                    help="texts waiting above this are rejected with a 503")
+parser.add_argument("--timeout", type=float, default=120,
+                    help="seconds before a request is answered with a 504")
+parser.add_argument("--in-lang", default="en")
+parser.add_argument("--out-lang", default="en")
+parser.add_argument("--no-content", action="store_true",
+                    help="don't store the source text in the cards")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    autocards = Autocards(store_content=not args.no_content,
+                          in_lang=args.in_lang,
+                          out_lang=args.out_lang)
+    serve(autocards,
+          host=args.host,
+          port=args.port,
+          max_batch_size=args.max_batch_size,
+          max_wait=args.max_wait_ms / 1000,
+          max_queue=args.max_queue,
+          timeout=args.timeout)
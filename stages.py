@@ -0,0 +1,606 @@
+"""
+Composable pipeline of batch stages behind the consume_* methods of
+Autocards:
+
+    ingest -> clean -> segment -> filter -> translate in -> extract
+        -> generate -> translate out -> format -> export
+
+Each stage takes a list of Units and returns a list of Units, so any of
+them can be replaced, removed or wrapped, and new ones inserted. Each
+stage runs in its own thread and is connected to the next one by a
+bounded queue, so a slow stage holds back the ones before it instead of
+letting work pile up in memory. A stage with workers > 1 processes that
+many batches at the same time, in a thread pool, or in a process pool
+if processes=True (the stage and its units must then be picklable, like
+IngestStage). Units keep their order through the whole pipeline.
+The stages calling the models of an Autocards instance (ModelStage)
+share its model lock, so they run one at a time while the other stages
+overlap with them.
+
+Autocards.pipeline() builds the default pipeline of an instance, for
+example to parse web pages in 4 processes and export the cards of each
+batch as they are made:
+
+    pipeline = autocards.pipeline(kind="web")
+    pipeline.replace("ingest", IngestStage(kind="web", workers=4, processes=True))
+    pipeline.insert_after("format", ExportStage(write_cards))
+    pipeline.run(Unit(source=url) for url in urls)
+
+Pipeline.run returns the units coming out of the last stage, or drops them
+with collect=False, and Pipeline.stream yields them as they come. A
+pipeline can also be fed by a queue.Queue and run as long as units are
+put in it, see AsyncAutocards, max_wait then keeps partial batches from
+waiting forever.
+"""
+
+import queue
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional
+
+# end of the stream of units, put in the queue after the last one
+_END = object()
+# seconds between two checks of the stop event by a blocked stage
+_POLL = 0.1
+
+
+@dataclass
+class Unit:
+    """
+    Piece of work going through the stages: a document before segment, a
+    text unit to create cards from after it. text_orig is the text before
+    translation, empty if it was not translated, cards the output of the
+    question generation then the formatted qa pairs. meta holds what
+    stages pass to each other (sections of a web page, extracted answers).
+    """
+    text: str = ""
+    title: str = ""
+    source: str = ""
+    text_orig: str = ""
+    cards: Optional[list] = None
+    meta: dict = field(default_factory=dict)
+
+
+def sanitize_text(text):
+    "correct common errors in text"
+    text = text.strip()
+    # occurs sometimes in epubs apparently:
+    text = text.replace("\xa0", " ")
+    # wikipedia style citation:
+    text = re.sub(r"\[\d*\]", "", text)
+    return text
+
+
+def read_pdf(pdf_path):
+    "Return the title and the text of a pdf file"
+    print("Warning: pdf parsing is usually of poor quality because \
+there are no good cross platform libraries. Consider using consume_textfile() \
+after preprocessing the text yourself.")
+    from tika import parser
+
+    title = pdf_path.replace("\\", "").split("/")[-1]
+    raw = str(parser.from_file(pdf_path))
+    safe_text = raw.encode('utf-8', errors='ignore')
+    safe_text = str(safe_text).replace("\\n", "\n").replace("\\t", " ").replace("\\", "")
+    return title, sanitize_text(safe_text)
+
+
+def read_epub(filepath):
+    "Return the text of an epub file, paragraphs separated by blank lines"
+    from epub_conversion.utils import open_book, convert_epub_to_lines
+
+    book = open_book(filepath)
+    text = " ".join(convert_epub_to_lines(book))
+    text = re.sub("<.*?>", "", text)
+    text = text.replace("&nbsp;", " ")
+    text = text.replace("&dash;", "-")
+    text = re.sub("&.*?;", " ", text)
+    # make paragraph limitation as expected in Autocards.consume_var:
+    text = text.replace("\r", "\n\n")
+    text = re.sub("\n\n\n*", "\n\n", text)
+    return sanitize_text(text)
+
+
+def read_html(source, mode="url"):
+    "Content of a local html file or of an url"
+    if mode == "local":
+        with open(source) as f:
+            return f.read()
+    import requests
+    return requests.get(source, timeout=15).content
+
+
+class Stage:
+    """
+    Base of the stages: __call__ takes a batch of at most batch_size units
+    and returns the units to give to the next stage. workers is the number
+    of batches processed at the same time, in threads or, with
+    processes=True, in processes.
+    """
+    name = "stage"
+    batch_size = 1
+    workers = 1
+    processes = False
+
+    def __call__(self, units: List[Unit]) -> List[Unit]:
+        raise NotImplementedError
+
+    def close(self):
+        "Called once the last batch went through the stage"
+
+
+class FunctionStage(Stage):
+    "Stage from a function taking and returning a list of units"
+
+    def __init__(self, name, function, batch_size=1, workers=1,
+                 processes=False):
+        self.name = name
+        self.function = function
+        self.batch_size = batch_size
+        self.workers = workers
+        self.processes = processes
+
+    def __call__(self, units):
+        return self.function(units)
+
+
+class ModelStage(Stage):
+    """
+    Stage using the models of an Autocards instance. process is called
+    holding the model lock of the instance, since its models and
+    tokenizers are not safe to call from several threads at once.
+    """
+
+    def __init__(self, autocards):
+        self.autocards = autocards
+
+    def __call__(self, units):
+        with self.autocards._model_lock:
+            return self.process(units)
+
+    def process(self, units: List[Unit]) -> List[Unit]:
+        raise NotImplementedError
+
+
+def kind_of(source):
+    "Kind of document and web mode of a source, from its extension"
+    source = str(source)
+    if source.startswith(("http://", "https://")):
+        return "web", "url"
+    suffix = source.rsplit(".", 1)[-1].lower() if "." in source else ""
+    if suffix in ["html", "htm"]:
+        return "web", "local"
+    if suffix in ["pdf", "epub"]:
+        return suffix, None
+    return "textfile", None
+
+
+class IngestStage(Stage):
+    """
+    Read the document of each unit from its source: kind is "text" (the
+    text is already there), "textfile", "pdf", "epub", "web" (mode and
+    element as in consume_web, the title and sections of the page are put
+    in meta["sections"], see html_extract.py) or "auto" to pick the kind of
+    each source from its extension, see kind_of, units with a text being
+    kept as they are. Does not depend on Autocards so that it can run in a
+    process pool.
+    """
+    name = "ingest"
+
+    def __init__(self, kind="text", mode="url", element="p", html_parser=None,
+                 workers=1, processes=False):
+        if kind not in ["text", "textfile", "pdf", "epub", "web", "auto"]:
+            raise ValueError(f"Unknown kind of document {kind}")
+        self.kind = kind
+        self.mode = mode
+        self.element = element
+        self.html_parser = html_parser
+        self.workers = workers
+        self.processes = processes
+
+    def __call__(self, units):
+        for unit in units:
+            kind, mode = self.kind, self.mode
+            if kind == "auto":
+                if unit.text:
+                    continue
+                kind, mode = kind_of(unit.source)
+            if kind == "textfile":
+                with open(unit.source) as f:
+                    unit.text = f.read()
+                unit.title = unit.title or str(unit.source).split("/")[-1]
+            elif kind == "pdf":
+                unit.title, unit.text = read_pdf(unit.source)
+            elif kind == "epub":
+                unit.text = read_epub(unit.source)
+            elif kind == "web":
+                import html_extract
+                html = read_html(unit.source, mode)
+                unit.title, unit.meta["sections"] = html_extract.extract(
+                    html, self.element, self.html_parser)
+        return units
+
+
+class CleanStage(Stage):
+    "Correct common errors in the text, or in the sections of web pages"
+    name = "clean"
+
+    def __init__(self, clean=sanitize_text):
+        self.clean = clean
+
+    def __call__(self, units):
+        for unit in units:
+            unit.text = self.clean(unit.text.replace('\xad ', ''))
+            if "sections" in unit.meta:
+                unit.meta["sections"] = [self.clean(s)
+                                         for s in unit.meta["sections"]]
+        return units
+
+
+class SegmentStage(ModelStage):
+    """
+    Cut each document into the text units to create cards from: the
+    sections of web pages, otherwise as Autocards.consume_var does
+    """
+    name = "segment"
+
+    def __init__(self, autocards, per_paragraph=False, packed=False):
+        super().__init__(autocards)
+        self.per_paragraph = per_paragraph
+        self.packed = packed
+
+    def process(self, units):
+        out = []
+        for unit in units:
+            if "sections" in unit.meta:
+                title, texts = self.autocards._valid_sections(
+                    unit.title, unit.meta.pop("sections"), unit.source)
+            else:
+                title = unit.title
+                texts = self.autocards._split_var(unit.text,
+                                                  self.per_paragraph,
+                                                  self.packed)
+            if texts:
+                self.autocards.title = title
+            out.extend(Unit(text=text, title=title, source=unit.source,
+                            meta=dict(unit.meta))
+                       for text in texts)
+        return out
+
+
+class FilterStage(Stage):
+    "Drop the text units not worth a model call, see text_filter.py"
+    name = "filter"
+    batch_size = 256
+
+    def __init__(self, autocards):
+        self.autocards = autocards
+
+    def __call__(self, units):
+        texts = [unit.text for unit in units]
+        kept = self.autocards._filter_units(texts)
+        # kept is the subsequence of texts worth a model call
+        out = []
+        for unit, text in zip(units, texts):
+            if len(out) < len(kept) and text is kept[len(out)]:
+                out.append(unit)
+        return out
+
+
+class TranslateInStage(ModelStage):
+    "Translate the text units to english, see Autocards.in_lang"
+    name = "translate_in"
+
+    def __init__(self, autocards, batch_size=16):
+        super().__init__(autocards)
+        self.batch_size = batch_size
+
+    def process(self, units):
+        translated = self.autocards._translate_in_batch([u.text for u in units])
+        for unit, (text, text_orig) in zip(units, translated):
+            unit.text, unit.text_orig = text, text_orig
+        return units
+
+
+class ExtractStage(ModelStage):
+    """
+    Extract the answers to ask about from the text units, in
+    meta["extracted"]. Does nothing for pipelines without a separate
+    extraction step, like the e2e engine.
+    """
+    name = "extract"
+
+    def __init__(self, autocards, batch_size=None):
+        super().__init__(autocards)
+        self.batch_size = batch_size or autocards.batch_size
+
+    def process(self, units):
+        qg = self.autocards.qg
+        if not hasattr(qg, "extract"):
+            return units
+        # sentences and token ids of pre-tokenized units, see token_corpus.py
+        segmented = [unit.meta.get("segmented") for unit in units]
+        if None in segmented:
+            segmented = None
+        try:
+            extracted = qg.extract([unit.text for unit in units], segmented)
+        except IndexError:
+            # one of the texts gives no answer to ask about
+            extracted = []
+            for i, unit in enumerate(units):
+                try:
+                    extracted.extend(qg.extract(
+                        [unit.text], segmented and [segmented[i]]))
+                except IndexError:
+                    extracted.append(None)
+        for unit, answers in zip(units, extracted):
+            unit.meta["extracted"] = answers
+        return units
+
+
+class GenerateStage(ModelStage):
+    """
+    Create the qa pairs of the text units in unit.cards, None when no card
+    could be made, from the answers of ExtractStage if it ran. Cards are
+    verified if Autocards.verify is set.
+    """
+    name = "generate"
+
+    def __init__(self, autocards, batch_size=None, progress=None):
+        super().__init__(autocards)
+        self.batch_size = batch_size or autocards.batch_size
+        self.progress = progress
+
+    def process(self, units):
+        autocards = self.autocards
+        if all("extracted" in unit.meta for unit in units):
+            todo = [unit for unit in units
+                    if unit.meta["extracted"] is not None]
+            outputs = autocards.qg.generate(
+                [unit.text for unit in todo],
+                [unit.meta.pop("extracted") for unit in todo])
+            for unit, to_add in zip(todo, outputs):
+                if autocards.verify and to_add:
+                    to_add = autocards._verify_qa(to_add, unit.text)
+                unit.cards = to_add
+        else:
+            outputs = autocards._qg_batch([unit.text for unit in units])
+            for unit, to_add in zip(units, outputs):
+                unit.cards = to_add
+        if self.progress is not None:
+            self.progress.update(len(units))
+        return units
+
+
+class TranslateStage(ModelStage):
+    "Translate the qa pairs to Autocards.out_lang"
+    name = "translate"
+
+    def process(self, units):
+        for unit in units:
+            if unit.cards:
+                self.autocards._translate_qa(unit.cards)
+        return units
+
+
+class FormatStage(Stage):
+    """
+    Format the qa pairs of each unit (clozes, metadata) and append them to
+    qa_list, Autocards.qa_dic_list by default
+    """
+    name = "format"
+
+    def __init__(self, autocards, qa_list=None):
+        self.autocards = autocards
+        self.qa_list = autocards.qa_dic_list if qa_list is None else qa_list
+
+    def __call__(self, units):
+        for unit in units:
+            unit.cards = self.autocards._format_qa(
+                unit.cards, unit.text, unit.text_orig, unit.title,
+                self.qa_list, translate=False)
+        return units
+
+
+class ExportStage(Stage):
+    "Give the formatted qa pairs of each batch to write, a function"
+    name = "export"
+
+    def __init__(self, write, batch_size=1):
+        self.write = write
+        self.batch_size = batch_size
+
+    def __call__(self, units):
+        cards = [qa for unit in units for qa in unit.cards or []]
+        if cards:
+            self.write(cards)
+        return units
+
+
+class Pipeline:
+    """
+    Stages run one after the other on a stream of units, each in its own
+    thread with a bounded queue of queue_size units before it. A stage
+    waits for a full batch, or the end of the units, before processing it,
+    or at most max_wait seconds after the first unit of the batch arrived.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size=64, max_wait=None):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+    def _position(self, name):
+        for i, stage in enumerate(self.stages):
+            if stage.name == name:
+                return i
+        raise KeyError(f"No stage named {name}, stages are "
+                       f"{[stage.name for stage in self.stages]}")
+
+    def __getitem__(self, name):
+        return self.stages[self._position(name)]
+
+    def __contains__(self, name):
+        return any(stage.name == name for stage in self.stages)
+
+    def replace(self, name, stage):
+        "Replace the stage called name by stage"
+        self.stages[self._position(name)] = stage
+        return self
+
+    def insert_after(self, name, stage):
+        "Insert stage after the one called name"
+        self.stages.insert(self._position(name) + 1, stage)
+        return self
+
+    def remove(self, name):
+        "Remove the stage called name"
+        del self.stages[self._position(name)]
+        return self
+
+    @staticmethod
+    def _put(q, item, stop):
+        "Put item in q unless the pipeline is stopped, False if it is"
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _taken(source, stop):
+        "Units taken from the queue source until None, or until stopped"
+        while not stop.is_set():
+            try:
+                unit = source.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+            if unit is None:
+                return
+            yield unit
+
+    def _feed(self, units, q, stop, errors):
+        try:
+            if isinstance(units, queue.Queue):
+                units = self._taken(units, stop)
+            for unit in units:
+                if not self._put(q, unit, stop):
+                    return
+            self._put(q, _END, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def _run_stage(self, stage, inq, outq, stop, errors):
+        executor = None
+        if stage.workers > 1:
+            from concurrent.futures import (ProcessPoolExecutor,
+                                            ThreadPoolExecutor)
+            pool = ProcessPoolExecutor if stage.processes else ThreadPoolExecutor
+            executor = pool(stage.workers)
+        pending = deque()  # batches submitted to the pool, in order
+
+        def emit(units):
+            for unit in units:
+                if not self._put(outq, unit, stop):
+                    return
+
+        try:
+            batch = []
+            done = False
+            while not done and not stop.is_set():
+                # pass on the batches done by the pool while waiting
+                while pending and pending[0].done():
+                    emit(pending.popleft().result())
+                timeout = _POLL
+                if batch and self.max_wait is not None:
+                    timeout = min(_POLL, max(0, deadline - time.monotonic()))
+                try:
+                    item = inq.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _END:
+                    done = True
+                elif item is not None:
+                    if not batch and self.max_wait is not None:
+                        deadline = time.monotonic() + self.max_wait
+                    batch.append(item)
+                waited = self.max_wait is not None and batch \
+                    and time.monotonic() >= deadline
+                if batch and (done or waited or len(batch) >= stage.batch_size):
+                    if executor is None:
+                        emit(stage(batch))
+                    else:
+                        pending.append(executor.submit(stage, batch))
+                        while len(pending) > stage.workers:
+                            emit(pending.popleft().result())
+                    batch = []
+            while pending and not stop.is_set():
+                emit(pending.popleft().result())
+            if done:
+                stage.close()
+                self._put(outq, _END, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def stream(self, units: Iterable[Unit]) -> Iterator[Unit]:
+        """
+        Run the units, any iterable, through all the stages and yield the
+        units coming out of the last one as they come. units can also be a
+        queue.Queue, the units put in it are run until None is. An error in
+        a stage stops the pipeline and is raised here, and so does closing
+        the generator before the end.
+        """
+        stop = threading.Event()
+        errors = []
+        queues = [queue.Queue(self.queue_size)
+                  for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed,
+                                    args=(units, queues[0], stop, errors),
+                                    daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, name=f"stage-{stage.name}",
+                args=(stage, queues[i], queues[i + 1], stop, errors),
+                daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not stop.is_set():
+                try:
+                    item = queues[-1].get(timeout=_POLL)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # also stops the stages if interrupted
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def run(self, units: Iterable[Unit], collect=True) -> Optional[List[Unit]]:
+        """
+        Run the units through all the stages, see stream, and return the
+        units coming out of the last one. With collect=False they are
+        dropped as they come out and None is returned, so that consuming
+        large corpora does not keep them all in memory.
+        """
+        if not collect:
+            for _ in self.stream(units):
+                pass
+            return None
+        return list(self.stream(units))
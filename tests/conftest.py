@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules are at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SAMPLE_TEXT = """\
+The steam engine was improved by James Watt between 1763 and 1775. His \
+separate condenser greatly reduced the fuel consumption of the engines.
+
+Photosynthesis is the process used by plants to convert light energy into \
+chemical energy. It takes place in the chloroplasts of the plant cells.
+
+The Treaty of Westphalia was signed in 1648 in Osnabruck and Munster. It \
+ended the Thirty Years' War in Europe."""
+
+
+def _has_punkt():
+    import nltk
+    try:
+        nltk.sent_tokenize("One sentence. Another one.")
+    except LookupError:
+        return False
+    return True
+
+
+needs_punkt = pytest.mark.skipif(not _has_punkt(),
+                                 reason="needs the nltk punkt data")
+
+
+def _has_pinned_pandas():
+    import pandas
+    return hasattr(pandas.DataFrame, "append")
+
+
+# pandas_df uses DataFrame.append, removed in pandas 2
+needs_pinned_pandas = pytest.mark.skipif(not _has_pinned_pandas(),
+                                         reason="needs pandas < 2, as pinned")
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory):
+    """
+    Path of a tiny randomly initialized T5 model and its tokenizer, to test
+    the plumbing of the pipelines without downloading the real models
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from tokenizers.processors import TemplateProcessing
+    from transformers import T5Config, T5ForConditionalGeneration, T5TokenizerFast
+
+    path = tmp_path_factory.mktemp("tiny")
+    tokenizer = Tokenizer(models.Unigram())
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    tokenizer.decoder = decoders.Metaspace()
+    trainer = trainers.UnigramTrainer(vocab_size=300, unk_token="<unk>",
+                                      special_tokens=["<pad>", "</s>", "<unk>"])
+    tokenizer.train_from_iterator(SAMPLE_TEXT.split("\n"), trainer)
+    tokenizer.post_processor = TemplateProcessing(
+        single="$A </s>", special_tokens=[("</s>", tokenizer.token_to_id("</s>"))])
+    fast = T5TokenizerFast(tokenizer_object=tokenizer, eos_token="</s>",
+                           pad_token="<pad>", unk_token="<unk>", extra_ids=0)
+    fast.add_tokens(["<hl>", "<sep>"])
+    fast.save_pretrained(str(path))
+    config = T5Config(vocab_size=len(fast), d_model=16, d_ff=32, num_layers=1,
+                      num_heads=2, d_kv=8, decoder_start_token_id=fast.pad_token_id,
+                      pad_token_id=fast.pad_token_id, eos_token_id=fast.eos_token_id)
+    torch.manual_seed(0)
+    T5ForConditionalGeneration(config).save_pretrained(str(path))
+    return str(path)
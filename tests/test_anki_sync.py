@@ -0,0 +1,97 @@
+import io
+import json
+import urllib.request
+
+import pytest
+
+from conftest import needs_pinned_pandas
+
+PARAGRAPHS = ["Napoleon was born in Ajaccio in 1769, on the island of Corsica.",
+              "Corsica was ceded to France by the Republic of Genoa in 1768."]
+
+
+class FakeQG:
+    "A basic and a cloze card per text, both asking for its first word"
+
+    def __call__(self, texts):
+        cards = []
+        for text in texts:
+            first, rest = text.split(maxsplit=1)
+            cards.append([{"question": f"Who or what {rest[:30]}?", "answer": first,
+                           "cloze": "", "note_type": "basic"},
+                          {"question": "", "answer": "", "note_type": "cloze",
+                           "cloze": f"generate question: <hl> {first} <hl> {rest} </s>"}])
+        return cards
+
+
+class FakeAnkiConnect:
+    "Answers the requests of Autocards._ankiconnect_invoke, keeping the notes"
+
+    def __init__(self):
+        self.notes = {}
+        self.actions = []
+
+    def urlopen(self, request):
+        request = json.loads(request.data)
+        action, params = request["action"], request["params"]
+        self.actions.append(action)
+        result = None
+        if action == "addNotes":
+            result = []
+            for note in params["notes"]:
+                result.append(len(self.actions) * 100 + len(result))
+                self.notes[result[-1]] = note["fields"]
+        elif action == "multi":
+            for sub in params["actions"]:
+                note = sub["params"]["note"]
+                assert sub["action"] == "updateNoteFields" and note["id"] in self.notes
+                self.notes[note["id"]] = note["fields"]
+            result = [None] * len(params["actions"])
+        elif action == "deleteNotes":
+            for note_id in params["notes"]:
+                del self.notes[note_id]
+        return io.BytesIO(json.dumps({"result": result, "error": None}).encode())
+
+
+@pytest.fixture
+def anki(monkeypatch):
+    anki = FakeAnkiConnect()
+    monkeypatch.setattr(urllib.request, "urlopen", anki.urlopen)
+    return anki
+
+
+@needs_pinned_pandas
+def test_sync_anki(anki, tmp_path):
+    from autocards import Autocards
+
+    a = Autocards(profile=False, text_filter=False)
+    a._qg = FakeQG()
+
+    def sync(paragraphs, **kwargs):
+        return a.sync_anki("\n\n".join(paragraphs), "napoleon.txt",
+                           manifest_dir=tmp_path, **kwargs)
+
+    assert sync(PARAGRAPHS) == {"added": 4, "updated": 0, "orphaned": 0}
+    assert anki.actions == ["createModel", "createDeck", "addNotes"]
+    notes = sorted(anki.notes)
+    assert len(notes) == 4
+
+    # nothing changed, nothing sent
+    anki.actions.clear()
+    assert sync(PARAGRAPHS) == {"added": 0, "updated": 0, "orphaned": 0}
+    assert anki.actions == []
+
+    # an edited paragraph asking for the same answers updates its notes
+    edited = [PARAGRAPHS[0].replace("in 1769", "on 15 August 1769"), PARAGRAPHS[1]]
+    assert sync(edited) == {"added": 0, "updated": 2, "orphaned": 0}
+    assert anki.actions == ["createModel", "createDeck", "multi"]
+    assert sorted(anki.notes) == notes
+    updated = [i for i in notes if "15 August" in anki.notes[i]["source_text"]]
+    assert len(updated) == 2
+
+    # the note of a removed paragraph is deleted
+    anki.actions.clear()
+    assert sync(edited[:1], delete_orphans=True) == \
+        {"added": 0, "updated": 0, "orphaned": 2}
+    assert anki.actions == ["deleteNotes"]
+    assert sorted(anki.notes) == updated
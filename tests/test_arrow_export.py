@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import needs_pinned_pandas
+
+pytest.importorskip("pyarrow")
+
+import arrow_export
+
+
+def _cards(n=10):
+    "Cards as made by Autocards._format_qa, with a new title every 3 cards"
+    cards = []
+    for i in range(n):
+        card = {"question": f"Question {i}?", "answer": f"answer {i}",
+                "cloze": "", "note_type": "basic", "question_orig": "",
+                "answer_orig": "", "basic_in_clozed_format": f"Question {i}?<br>",
+                "confidence": i / n}
+        if i % 4 == 3:
+            card = {"cloze": f"The {{{{c1::answer {i}}}}}.", "note_type": "cloze",
+                    "question": "", "answer": "", "cloze_orig": "",
+                    "basic_in_clozed_format": ""}
+        card.update(date=f"Mon Oct {i // 5 + 1} 12:00:00 2026",
+                    source_title=f"chapter {i // 3}",
+                    source_text=f"Text of chapter {i // 3}.", source_text_orig="")
+        cards.append(card)
+    return cards
+
+
+def _rows(table):
+    "The cards of a table, without the fields they don't have"
+    return [{key: value for key, value in row.items() if value is not None}
+            for row in table.to_pylist()]
+
+
+@pytest.mark.parametrize("export", ["table", "parquet", "feather",
+                                    "feather-uncompressed"])
+def test_round_trip(tmp_path, export):
+    cards = _cards()
+    if export == "table":
+        table = arrow_export.to_table(cards, batch_size=4)
+    elif export == "parquet":
+        table = arrow_export.read_cards(arrow_export.write_parquet(
+            cards, tmp_path / "cards.parquet", row_group_size=4))
+    else:
+        compression = None if export == "feather-uncompressed" else "zstd"
+        table = arrow_export.read_cards(arrow_export.write_feather(
+            cards, tmp_path / "cards.feather", batch_size=4,
+            compression=compression))
+    assert _rows(table) == cards
+    assert table.schema == arrow_export.card_schema(cards)
+
+
+def test_feather_dictionary_deltas(tmp_path):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    cards = _cards()
+    path = arrow_export.write_feather(cards, tmp_path / "cards.feather",
+                                      batch_size=4, compression=None)
+    reader = ipc.open_file(pa.memory_map(str(path)))
+    assert reader.num_record_batches == 3
+    assert _rows(reader.read_all()) == cards
+    # 2 new titles and 1 new date in later batches, stored as deltas
+    assert reader.stats.num_dictionary_deltas == 3
+    assert reader.stats.num_replaced_dictionaries == 0
+
+
+@needs_pinned_pandas
+def test_same_as_pandas_df(tmp_path):
+    from autocards import Autocards
+
+    a = Autocards(profile=False, text_filter=False)
+    a.qa_dic_list.extend(_cards())
+    df = a.pandas_df()
+    table = arrow_export.read_cards(arrow_export.write_feather(
+        a.qa_dic_list, tmp_path / "cards.feather", batch_size=4))
+    # pandas_df fills the missing fields with ""
+    rows = [{key: "" if value is None else value for key, value in row.items()}
+            for row in table.to_pylist()]
+    for column in df.columns.drop("combined_columns"):
+        assert df[column].tolist() == [row[column] for row in rows]
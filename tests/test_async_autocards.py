@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+
+class FakeQG:
+    "One basic card per text, recording the batches it is given"
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if any("fail" in text for text in texts):
+            raise RuntimeError("generation failed")
+        return [[{"question": f"What about {text}?", "answer": text,
+                  "cloze": "", "note_type": "basic"}] for text in texts]
+
+
+def _auto(**kwargs):
+    from async_autocards import AsyncAutocards
+    from autocards import Autocards
+
+    a = Autocards(profile=False, text_filter=False, batch_size=8)
+    a._qg = FakeQG()
+    return AsyncAutocards(a, **kwargs)
+
+
+def _document(name, n=3):
+    return "\n\n".join(f"{name} paragraph {i}" for i in range(n))
+
+
+def _answers(cards):
+    return [card["answer"] for card in cards]
+
+
+def test_units_of_concurrent_calls_are_batched_together():
+    auto = _auto(max_wait=0.2)
+
+    async def main():
+        return await asyncio.gather(
+            auto.consume_var(_document("first"), "first", per_paragraph=True),
+            auto.consume_var(_document("second"), "second", per_paragraph=True))
+
+    first, second = asyncio.run(main())
+    auto.close()
+    assert _answers(first) == [f"first paragraph {i}" for i in range(3)]
+    assert _answers(second) == [f"second paragraph {i}" for i in range(3)]
+    assert {card["source_title"] for card in first} == {"first"}
+    assert [len(batch) for batch in auto.autocards.qg.batches] == [6]
+
+
+def test_max_in_flight_counts_text_units():
+    auto = _auto(max_in_flight=2, max_wait=0.05)
+    cards = asyncio.run(auto.consume_var(_document("some", 5), per_paragraph=True))
+    auto.close()
+    assert len(cards) == 5
+    assert max(len(batch) for batch in auto.autocards.qg.batches) == 2
+
+
+def test_errors_fail_the_waiting_calls_only():
+    auto = _auto(max_wait=0.05)
+
+    async def main():
+        with pytest.raises(RuntimeError, match="generation failed"):
+            await auto.consume_var(_document("fail"), per_paragraph=True)
+        # the pipeline is started again for the next calls
+        return await auto.consume_var(_document("next"), per_paragraph=True)
+
+    cards = asyncio.run(main())
+    auto.close()
+    assert _answers(cards) == [f"next paragraph {i}" for i in range(3)]
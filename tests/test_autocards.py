@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import needs_punkt
+
+
+class WordCounter:
+    "Stands for the question generation pipeline, one token per word"
+
+    def count_tokens(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+def _words(n, first=0):
+    "A sentence of n words"
+    return " ".join(f"w{i}" for i in range(first, first + n - 1)) + f" w{first + n - 1}."
+
+
+@pytest.fixture
+def pack():
+    from autocards import Autocards
+
+    a = Autocards(profile=False, text_filter=False, token_budget=10)
+    a._qg = WordCounter()
+    return a._pack_paragraphs
+
+
+@needs_punkt
+def test_short_paragraphs_are_merged(pack):
+    paragraphs = [_words(4), _words(4, 10), _words(4, 20)]
+    units, lost_unpacked, lost_packed = pack(paragraphs)
+    assert units == [" ".join(paragraphs[:2]), paragraphs[2]]
+    assert lost_unpacked == lost_packed == 0
+
+
+@needs_punkt
+def test_units_can_fill_the_budget(pack):
+    paragraphs = [_words(5), _words(5, 10), _words(1, 20)]
+    units, _, _ = pack(paragraphs)
+    assert units == [" ".join(paragraphs[:2]), paragraphs[2]]
+
+
+@needs_punkt
+def test_long_paragraphs_are_split_at_sentences(pack):
+    sents = [_words(6), _words(3, 10), _words(12, 20), _words(2, 40)]
+    units, lost_unpacked, lost_packed = pack([_words(2, 50), " ".join(sents)])
+    # the short paragraph is not merged with the sentences of the long one
+    assert units == [_words(2, 50), sents[0] + " " + sents[1], sents[2], sents[3]]
+    assert lost_unpacked == 23 - 10
+    # only the sentence longer than the budget is still truncated
+    assert lost_packed == 2
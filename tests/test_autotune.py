@@ -0,0 +1,71 @@
+import concurrent.futures
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from conftest import SAMPLE_TEXT, needs_punkt
+
+
+@needs_punkt
+def test_profile_round_trip(tiny_model, tmp_path, monkeypatch):
+    import torch
+    import autotune
+    from autocards import Autocards
+
+    path = tmp_path / "profile.json"
+    monkeypatch.setenv(autotune.PROFILE_ENV, str(path))
+    monkeypatch.setenv("TOKENIZERS_PARALLELISM", "true")
+    threads = torch.get_num_threads()
+    try:
+        profile = autotune.autotune(model=tiny_model, ans_model=tiny_model,
+                                    sample_text=SAMPLE_TEXT, batch_sizes=(1, 2),
+                                    threads=(1,), workers=(1,), seconds=0.05)
+    finally:
+        torch.set_num_threads(threads)
+    assert autotune.load_profile() == json.loads(path.read_text()) == profile
+    assert profile["batch_size"] in (1, 2)
+    assert profile["threads"] == profile["worker_threads"] == 1
+    assert profile["workers"] == 1
+    assert profile["calibration"]["seconds_per_token"] > 0
+
+    a = Autocards(model=tiny_model, ans_model=tiny_model, text_filter=False)
+    assert a.profile == profile
+    assert a.batch_size == profile["batch_size"]
+    # made for other models
+    assert Autocards(text_filter=False).profile is None
+
+
+@needs_punkt
+def test_consume_corpus_in_the_profile_workers(tiny_model, tmp_path, monkeypatch):
+    import token_corpus
+    import autotune
+    from autocards import Autocards
+
+    source = tmp_path / "notes.txt"
+    source.write_text(SAMPLE_TEXT)
+    kwargs = dict(model=tiny_model, ans_model=tiny_model, text_filter=False,
+                  batch_size=2)
+    corpus = tmp_path / "corpus"
+    token_corpus.build([str(source)], corpus, Autocards(profile=False, **kwargs))
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({
+        "model": tiny_model, "ans_model": tiny_model, "batch_size": 2,
+        "threads": 1, "tokenizers_parallelism": "false", "num_beams": 4,
+        "workers": 2, "worker_threads": 1}))
+    monkeypatch.setenv(autotune.PROFILE_ENV, str(path))
+    monkeypatch.setenv("TOKENIZERS_PARALLELISM", "true")
+    pools = []
+
+    class Pool(ProcessPoolExecutor):
+        def __init__(self, processes, **kwargs):
+            pools.append(processes)
+            super().__init__(processes, **kwargs)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", Pool)
+
+    single = token_corpus.consume(corpus, processes=1, **kwargs)
+    assert single and pools == []
+    cards = token_corpus.consume(corpus, **kwargs)
+    assert pools == [2]
+    # the cards of each paragraph, in the order of the corpus
+    paragraphs = list(dict.fromkeys(c["source_text"] for c in single))
+    assert len(paragraphs) == 3
+    assert list(dict.fromkeys(c["source_text"] for c in cards)) == paragraphs
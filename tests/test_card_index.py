@@ -0,0 +1,32 @@
+import pytest
+
+from card_index import CardIndex
+
+CARDS = [{"source_title": "steam", "note_type": "basic",
+          "question": "Who improved the steam engine?", "answer": "James Watt"},
+         {"source_title": "steam", "note_type": "cloze",
+          "cloze": "The {{c1::separate condenser}} reduced the fuel used."},
+         {"source_title": "war", "note_type": "basic",
+          "question": "When was the Treaty of Westphalia signed?", "answer": "1648"}]
+
+
+def test_query():
+    index = CardIndex(list(CARDS))
+    assert index.query(text="STEAM engine") == CARDS[:1]
+    assert index.query(text="condenser", note_type="cloze") == CARDS[1:2]
+    assert index.query(source_title="steam", note_type="basic") == CARDS[:1]
+    assert index.query(source_title=["steam", "war"]) == CARDS
+    assert index.query(text="steam", source_title="war") == []
+
+    # cards appended after the first query are found too
+    index.cards.append(dict(CARDS[0], source_title="war"))
+    assert index.query(text="watt") == [CARDS[0], index.cards[-1]]
+
+
+@pytest.mark.parametrize("text", ["", "  ", "?!", "{{c1::}}"])
+def test_query_text_without_words(text):
+    index = CardIndex(list(CARDS))
+    with pytest.raises(ValueError):
+        index.query(text=text)
+    with pytest.raises(ValueError):
+        index.query(text=text, source_title="steam")
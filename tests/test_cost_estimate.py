@@ -0,0 +1,65 @@
+import builtins
+
+from conftest import SAMPLE_TEXT, needs_punkt
+
+CALIBRATION = {"engine": "qg", "seconds_per_token": 1e-4,
+               "seconds_per_question": 1e-2, "answers_per_sentence": 20}
+
+
+def _autocards(model, verify=False):
+    from autocards import Autocards
+
+    a = Autocards(model=model, ans_model=model, profile=False,
+                  text_filter=False, batch_size=8, verify=verify)
+    a._calibration = CALIBRATION
+    return a
+
+
+def _estimate(model, path, verify):
+    return _autocards(model, verify).estimate("consume_textfile", str(path))
+
+
+@needs_punkt
+def test_estimate_counts_verification(tiny_model, tmp_path, monkeypatch):
+    def no_prompt(*args):
+        raise AssertionError("a dry run must not prompt")
+    monkeypatch.setattr(builtins, "input", no_prompt)
+    path = tmp_path / "notes.txt"
+    path.write_text(SAMPLE_TEXT)
+
+    report = _estimate(tiny_model, path, verify=False)
+    assert report["paragraphs"] == 3
+    assert report["verify_batches"] == 0
+    assert report["generate_calls"] == 2
+
+    verified = _estimate(tiny_model, path, verify=True)
+    # 2 sentences per paragraph, 40 questions, 2 batches of 32 each
+    assert verified["verify_batches"] == 6
+    assert verified["generate_calls"] == report["generate_calls"] + 6
+
+
+@needs_punkt
+def test_estimate_loads_the_tokenizers_only(tiny_model, tmp_path, monkeypatch):
+    import pipelines
+
+    path = tmp_path / "notes.txt"
+    path.write_text(SAMPLE_TEXT)
+    loaded = _autocards(tiny_model)
+    loaded.warmup()
+    expected = loaded.estimate("consume_textfile", str(path), packed=True)
+
+    def no_model(*args):
+        raise AssertionError("a dry run must not load the models")
+    monkeypatch.setattr(pipelines, "_load_model", no_model)
+    a = _autocards(tiny_model)
+    assert a.estimate("consume_textfile", str(path), packed=True) == expected
+    assert a._qg is None
+
+
+def test_summary_mentions_verification():
+    import cost_estimate
+
+    report = dict(cost_estimate.new_report(), generate_calls=8, batches=2,
+                  verify_batches=6)
+    assert "6 of them to verify" in cost_estimate.summary(report)
+    assert "verify" not in cost_estimate.summary(cost_estimate.new_report())
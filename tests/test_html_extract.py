@@ -0,0 +1,50 @@
+import pytest
+
+import html_extract
+
+SECTION_A = ["The first section of the article explains how steam engines work, "
+             "with pistons, valves, and condensers.",
+             "James Watt improved the condenser, which reduced the fuel used, "
+             "and made engines practical far from coal mines."]
+SECTION_B = ["The second section tells how the engines spread to factories, "
+             "mills, and railways across Britain.",
+             "By 1800 there were hundreds of Watt engines at work, pumping, "
+             "spinning, and hauling."]
+FOOTER = "Copyright 2021 Some Publisher, all rights reserved, do not copy this page."
+NAV = "Home, About, Contact, Subscribe to the newsletter, Follow us on social media"
+
+PAGE = f"""<html><head><title>Steam</title></head><body>
+<nav class="menu"><p>{NAV}</p></nav>
+<article>
+  <h1>Steam engines</h1>
+  <section class="intro">{"".join(f"<p>{p}</p>" for p in SECTION_A)}</section>
+  <section>{"".join(f"<p>{p}</p>" for p in SECTION_B)}</section>
+</article>
+<div class="footer"><p>{FOOTER}</p></div>
+</body></html>"""
+
+
+def _parsers():
+    parsers = []
+    for parser in ["lxml", "selectolax"]:
+        try:
+            html_extract.extract("<p>test</p>", parser=parser)
+        except ImportError:
+            continue
+        parsers.append(parser)
+    return parsers
+
+
+@pytest.mark.parametrize("parser", _parsers())
+def test_sections_of_an_article_are_kept(parser):
+    title, sections = html_extract.extract(PAGE, "p", parser)
+    assert title == "Steam engines"
+    assert sections == SECTION_A + SECTION_B
+
+
+@pytest.mark.parametrize("parser", _parsers())
+def test_single_container(parser):
+    page = f"""<html><body><div class="sidebar"><p>{NAV}</p></div>
+<div class="content">{"".join(f"<p>{p}</p>" for p in SECTION_A)}</div>
+<div class="footer"><p>{FOOTER}</p></div></body></html>"""
+    assert html_extract.extract(page, "p", parser)[1] == SECTION_A
@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+from model_registry import ModelLock, ModelRegistry
+
+def _linear(n):
+    import torch
+    return lambda: torch.nn.Linear(n, n, bias=False)
+
+
+def test_shared_instances_and_refcounts():
+    reg = ModelRegistry()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return object()
+    first = reg.acquire("model", "m", loader)
+    assert reg.acquire("model", "m", loader) is first
+    assert len(calls) == 1
+    assert reg.stats()[0]["refcount"] == 2
+    reg.release("model", "m")
+    reg.release("model", "m")
+    reg.release("model", "m")  # one release too many is ignored
+    assert reg.stats()[0]["refcount"] == 0
+    # idle objects stay loaded without a budget
+    assert reg.acquire("model", "m", loader) is first
+    reg.release("model", "m")
+    reg.clear()
+    assert reg.stats() == []
+
+
+def test_least_recently_used_idle_objects_are_evicted():
+    # 3 linear layers of 10x10 float32 weights, 400 bytes each
+    reg = ModelRegistry(memory_budget=1000)
+    for name in ["a", "b", "c"]:
+        reg.acquire("model", name, _linear(10))
+    # all are used, none can be evicted
+    assert reg.memory_used() == 1200
+    reg.release("model", "b")
+    reg.release("model", "a")
+    # a was used more recently than b
+    reg.acquire("model", "a", _linear(10))
+    reg.release("model", "a")
+    assert [entry["name"] for entry in reg.stats()] == ["c", "a"]
+    reg.acquire("model", "d", _linear(10))
+    assert [entry["name"] for entry in reg.stats()] == ["c", "d"]
+
+
+def test_loading_only_blocks_the_same_key():
+    reg = ModelRegistry()
+    started, finish = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def slow():
+        calls.append("slow")
+        started.set()
+        finish.wait(5)
+        return "slow model"
+
+    threads = [threading.Thread(target=lambda: results.append(
+        reg.acquire("model", "slow", slow))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    # other keys are served while the slow model loads
+    assert reg.acquire("model", "fast", lambda: "fast model") == "fast model"
+    assert {entry["name"] for entry in reg.stats()} == {"slow", "fast"}
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["slow model", "slow model"] and calls == ["slow"]
+    assert reg.stats()[0]["refcount"] == 2
+
+
+def test_failed_loads_are_retried():
+    reg = ModelRegistry()
+
+    def broken():
+        raise OSError("no such model")
+    with pytest.raises(OSError):
+        reg.acquire("model", "m", broken)
+    assert reg.stats() == []
+    assert reg.acquire("model", "m", lambda: "model") == "model"
+
+
+SENTS = ["James Watt improved the steam engine.",
+         "His separate condenser reduced the fuel consumption."]
+
+
+def test_model_locks_share_the_locks_of_their_objects():
+    reg = ModelRegistry()
+    for name in ["a", "b", "c"]:
+        reg.acquire("model", name, object)
+    first = ModelLock([("model", "a"), ("model", "b")], reg)
+    second = ModelLock([("model", "b")], reg)
+    other = ModelLock([("model", "c")], reg)
+    events = []
+
+    def use(lock, name):
+        with lock:
+            events.append(f"{name} start")
+            time.sleep(0.1)
+            events.append(f"{name} end")
+
+    with first:
+        with first:  # reentrant
+            threads = [threading.Thread(target=use, args=(lock, name))
+                       for lock, name in [(second, "second"), (other, "other")]]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.05)
+            # other shares nothing with first
+            assert events == ["other start"]
+    for thread in threads:
+        thread.join()
+    assert events == ["other start", "other end", "second start", "second end"] \
+        or events == ["other start", "second start", "other end", "second end"]
+
+
+def test_instances_sharing_a_model_take_turns(tiny_model, monkeypatch):
+    from autocards import Autocards
+
+    instances = [Autocards(model=tiny_model, ans_model=tiny_model, profile=False,
+                           text_filter=False) for _ in range(2)]
+    first, second = [a.qg for a in instances]
+    assert first is not second
+    assert first.model is second.model and first.tokenizer is second.tokenizer
+
+    active, seen, errors = [0], [], []
+    generate = first.model.generate
+
+    def counting_generate(*args, **kwargs):
+        active[0] += 1
+        seen.append(active[0])
+        time.sleep(0.01)
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            active[0] -= 1
+    monkeypatch.setattr(first.model, "generate", counting_generate)
+
+    def extract(a):
+        try:
+            for _ in range(5):
+                with a._model_lock:
+                    a.qg.extract(None, [(SENTS, a.qg._encode_spans(SENTS))])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=extract, args=(a,)) for a in instances]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert seen and max(seen) == 1
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+def _has_safetensors():
+    import model_store
+    return model_store._has_safetensors()
+
+
+needs_safetensors = pytest.mark.skipif(not _has_safetensors(),
+                                       reason="needs the safetensors package")
+
+
+@needs_safetensors
+@pytest.mark.parametrize("assign", [True, False])
+def test_load_stored_model(tiny_model, tmp_path, monkeypatch, assign):
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+
+    import model_store
+
+    if assign and not model_store._can_assign():
+        pytest.skip("needs torch >= 2.1")
+    # older versions of torch copy the weights
+    monkeypatch.setattr(model_store, "_can_assign", lambda: assign)
+    path = model_store.export_model(tiny_model, tmp_path)
+    assert model_store.stored_path(tiny_model, tmp_path) == path
+    offline = os.environ.get("HF_HUB_OFFLINE")
+    model = model_store.load_model(path)
+    assert os.environ.get("HF_HUB_OFFLINE") == offline
+
+    reference = AutoModelForSeq2SeqLM.from_pretrained(tiny_model).eval()
+    ids = torch.tensor([[5, 6, 7, 1]])
+    with torch.no_grad():
+        assert torch.allclose(model(input_ids=ids, decoder_input_ids=ids).logits,
+                              reference(input_ids=ids, decoder_input_ids=ids).logits)
+
+
+@needs_safetensors
+def test_incomplete_store_fails(tiny_model, tmp_path):
+    from safetensors.torch import load_file, save_file
+
+    import model_store
+
+    path = model_store.export_model(tiny_model, tmp_path)
+    state_dict = load_file(str(path / model_store.WEIGHTS_NAME))
+    removed = sorted(name for name in state_dict if "SelfAttention.q" in name)[0]
+    del state_dict[removed]
+    save_file(state_dict, str(path / model_store.WEIGHTS_NAME))
+    with pytest.raises(ValueError, match=removed):
+        model_store.load_model(path)
+
+
+def test_without_safetensors(tiny_model, tmp_path, monkeypatch):
+    import model_store
+
+    monkeypatch.setattr(model_store, "_has_safetensors", lambda: False)
+    (tmp_path / tiny_model.replace("/", "--")).mkdir(parents=True)
+    (tmp_path / tiny_model.replace("/", "--") / model_store.WEIGHTS_NAME).touch()
+    # the models are downloaded as usual
+    assert model_store.stored_path(tiny_model, tmp_path) is None
+    with pytest.raises(ImportError, match="pip install safetensors"):
+        model_store.export_model(tiny_model, tmp_path)
@@ -0,0 +1,209 @@
+import pytest
+
+from conftest import SAMPLE_TEXT
+
+
+@pytest.fixture
+def qg(tiny_model):
+    from pipelines import qg_pipeline
+    return qg_pipeline("question-generation", model=tiny_model,
+                       ans_model=tiny_model, use_cuda=False)
+
+
+def _inputs(qg):
+    texts = ["generate question: <hl> James Watt <hl> improved the steam engine. </s>",
+             "generate question: The treaty was signed in <hl> 1648 <hl> in "
+             "Osnabruck and Munster, ending the war. </s>"]
+    return [qg.tokenizer(text, add_special_tokens=False).input_ids for text in texts]
+
+
+def test_cascade_confidence_is_mean_token_probability(qg):
+    import torch
+
+    inputs = _inputs(qg)
+    qg.cascade, qg.cascade_threshold = qg.model, 0
+    questions, confidences = qg._generate_questions(inputs)
+    assert qg.cascade_counts == {"fast": 2, "escalated": 0}
+    for ids, confidence in zip(inputs, confidences):
+        # teacher forcing the greedy question gives the same probabilities
+        out = qg.model.generate(input_ids=torch.tensor([ids]), max_length=32)
+        with torch.no_grad():
+            logits = qg.model(input_ids=torch.tensor([ids]),
+                              decoder_input_ids=out[:, :-1]).logits
+        log_probs = torch.log_softmax(logits, -1).gather(-1, out[:, 1:, None])[..., 0]
+        tokens = out[0, 1:].tolist()
+        end = tokens.index(qg.tokenizer.eos_token_id) + 1 \
+            if qg.tokenizer.eos_token_id in tokens else len(tokens)
+        expected = torch.exp(log_probs[0, :end].mean()).item()
+        assert confidence == pytest.approx(expected, rel=0.05)
+
+
+def test_cascade_escalates_low_confidence(qg):
+    import torch
+    from transformers import T5ForConditionalGeneration
+
+    inputs = _inputs(qg)
+    beam_questions, confidences = qg._generate_questions(inputs)
+    assert confidences == [None, None]
+    # another small model, its greedy questions differ from the beam ones
+    torch.manual_seed(1)
+    qg.cascade = T5ForConditionalGeneration(qg.model.config).eval()
+    qg.cascade_threshold = 0
+    fast_questions, fast_confidences = qg._generate_questions(inputs)
+    assert fast_questions != beam_questions
+    assert qg.cascade_counts == {"fast": 2, "escalated": 0}
+
+    # only the least confident question is decoded again with beam search
+    low = fast_confidences.index(min(fast_confidences))
+    qg.cascade_threshold = sum(fast_confidences) / 2
+    questions, confidences = qg._generate_questions(inputs)
+    assert qg.cascade_counts == {"fast": 3, "escalated": 1}
+    assert questions[low] == beam_questions[low] != fast_questions[low]
+    assert questions[1 - low] == fast_questions[1 - low]
+    assert confidences[1 - low] == fast_confidences[1 - low]
+    assert 0 < confidences[low] <= 1
+
+SENTS = ["James Watt improved the steam engine.",
+         "His separate condenser reduced the fuel consumption."]
+
+
+def _built(qg, inputs):
+    return [ids[mask.bool()].tolist() for ids, mask in zip(
+        *qg._build_batch(inputs).values())]
+
+
+def test_built_inputs_match_the_tokenizer(qg):
+    texts = ["extract answers: <hl> {} <hl> {}".format(*SENTS),
+             "extract answers: {} <hl> {} <hl>".format(*SENTS)]
+    _, inputs = qg._prepare_inputs_for_ans_extraction(" ".join(SENTS), SENTS)
+    assert _built(qg, inputs) == [qg.tokenizer(text).input_ids for text in texts]
+
+    inputs = qg._prepare_inputs_for_qg_from_answers_hl(SENTS, [["James Watt"], []])
+    text = "generate question: <hl> James Watt <hl> improved the steam engine. " + SENTS[1]
+    built = _built(qg, [inputs[0]["input_ids"]])[0]
+    assert built == qg.tokenizer(text).input_ids
+    # a single end of sequence token
+    assert built.count(qg.tokenizer.eos_token_id) == 1
+
+
+def test_built_inputs_are_truncated_before_the_eos(qg):
+    batch = qg._build_batch([list(range(3, 40)), [3, 4]], max_length=16)
+    eos, pad = qg.tokenizer.eos_token_id, qg.tokenizer.pad_token_id
+    assert batch["input_ids"].tolist() == [list(range(3, 18)) + [eos],
+                                           [3, 4, eos] + [pad] * 13]
+    assert batch["attention_mask"].sum(1).tolist() == [16, 3]
+
+
+def _answers(qg, decoded):
+    "The answers of a decoded output, parsed like _extract_answers does"
+    return [a.replace("<pad>", "").strip() for a in decoded.split("<sep>")[:-1]]
+
+
+def test_constrained_answers_are_spans_of_the_sentence(qg):
+    import random
+
+    import torch
+
+    sents = [s for paragraph in SAMPLE_TEXT.split("\n\n")
+             for s in paragraph.replace(". ", ".\n").split("\n")]
+    tries = [qg._span_trie(ids, 32) for ids in qg._encode_spans(sents)]
+    allowed = qg._allowed_answer_tokens(tries)
+    start = qg.ans_model.config.decoder_start_token_id
+    eos, sep = qg.ans_tokenizer.eos_token_id, qg._sep_id
+    rng = random.Random(0)
+    answers = 0
+    for batch_id, sent in enumerate(sents):
+        for _ in range(20):
+            # random walks through the allowed tokens until the end
+            prefix = [start]
+            while prefix[-1] != eos and len(prefix) < 64:
+                tokens = allowed(batch_id, torch.tensor(prefix))
+                if eos in tokens:
+                    # never in the middle of an answer
+                    assert len(prefix) == 1 or prefix[-1] == sep
+                prefix.append(rng.choice(tokens))
+            decoded = qg.ans_tokenizer.decode(prefix, skip_special_tokens=False)
+            for answer in _answers(qg, decoded):
+                assert answer and answer in sent
+                answers += 1
+    assert answers > len(sents) * 20
+
+
+def test_constrained_answers_with_beam_search(qg):
+    import torch
+
+    sents = ["James Watt improved the steam engine.",
+             "The treaty was signed in 1648 in Osnabruck and Munster."]
+    tries = [qg._span_trie(ids, 32) for ids in qg._encode_spans(sents)]
+    inputs = qg._build_batch([qg.ans_tokenizer(f"extract answers: <hl> {sent} <hl>",
+                                               add_special_tokens=False).input_ids
+                              for sent in sents])
+    # each input expands to several beams, batch_id is the index of the input
+    torch.manual_seed(0)
+    outs = qg.ans_model.generate(**inputs, max_length=32, num_beams=3,
+                                 num_return_sequences=3, do_sample=True,
+                                 prefix_allowed_tokens_fn=qg._allowed_answer_tokens(tries))
+    decoded = qg.ans_tokenizer.batch_decode(outs, skip_special_tokens=False)
+    answers = [_answers(qg, output) for output in decoded]
+    assert any(answers[:3]) and any(answers[3:])
+    for i, output_answers in enumerate(answers):
+        for answer in output_answers:
+            assert answer in sents[i // 3]
+
+
+class FakeE2E:
+    "Questions of each text, given in advance"
+    model_type = "t5"
+    registry_keys = []
+
+    def __init__(self, questions):
+        self.questions = questions
+
+    def __call__(self, texts):
+        return [self.questions[text] for text in texts]
+
+
+class FakeQA:
+    "Answers of each question, given in advance"
+    registry_keys = []
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def answer_questions(self, pairs):
+        return [self.answers[question] for question, _ in pairs]
+
+
+def _e2e_cards(note_type="both"):
+    from pipelines import E2ECardPipeline
+
+    text = "James Watt improved the steam engine. Watt was born in Greenock."
+    pipeline = E2ECardPipeline(
+        FakeE2E({text: ["Who improved the steam engine?", "",
+                        "Who improved the engine?", "Where was Watt born?",
+                        "What did Watt invent?"]}),
+        FakeQA({"Who improved the steam engine?": " james watt ",
+                "Who improved the engine?": "James Watt",
+                "Where was Watt born?": "Greenock",
+                "What did Watt invent?": "the separate condenser"}))
+    pipeline.note_type = note_type
+    return pipeline([text])[0]
+
+
+def test_e2e_clozes_highlight_the_answers():
+    cards = _e2e_cards()
+    assert [card["answer"] for card in cards if card["note_type"] == "basic"] == \
+        ["james watt", "James Watt", "Greenock", "the separate condenser"]
+    # highlighted as found in the text, once per answer, not for the answers
+    # that are not in the text
+    assert [card["cloze"] for card in cards if card["note_type"] == "cloze"] == [
+        "generate question: <hl> James Watt <hl> improved the steam engine. "
+        "Watt was born in Greenock. </s>",
+        "generate question: James Watt improved the steam engine. Watt was "
+        "born in <hl> Greenock <hl> . </s>"]
+
+
+@pytest.mark.parametrize("note_type, count", [("basic", 4), ("cloze", 2)])
+def test_e2e_note_types(note_type, count):
+    cards = _e2e_cards(note_type)
+    assert [card["note_type"] for card in cards] == [note_type] * count
@@ -0,0 +1,68 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import server
+
+
+class FakeService:
+    "Answers with the text of the payload, or raises error"
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def create_cards(self, payload):
+        if self.error is not None:
+            raise self.error
+        return payload.get("title", "untitled"), [{"cloze": payload["text"]}]
+
+
+@pytest.fixture
+def post(monkeypatch):
+    monkeypatch.setattr(server.CardRequestHandler, "service", FakeService())
+    monkeypatch.setattr(server.CardRequestHandler, "log_message", lambda *args: None)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.CardRequestHandler)
+    threading.Thread(target=httpd.serve_forever, args=(0.01,), daemon=True).start()
+
+    def post(body):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{httpd.server_port}/cards",
+            body if isinstance(body, bytes) else json.dumps(body).encode())
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    yield post
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_cards(post):
+    assert post({"text": "Some text.", "title": "notes", "per_paragraph": True}) \
+        == (200, {"title": "notes", "cards": [{"cloze": "Some text."}]})
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"\xff", [], "some text", {},
+                                  {"title": "notes"}, {"text": 3},
+                                  {"text": "Some text.", "packed": "yes"},
+                                  {"url": ["https://example.com"]},
+                                  {"text": "Some text.", "lang": "fr"}])
+def test_bad_payload(post, body):
+    status, content = post(body)
+    assert status == 400 and content["error"]
+
+
+@pytest.mark.parametrize("error, status", [(server.queue.Full(), 503),
+                                           (TimeoutError("late"), 504),
+                                           (KeyError("text"), 500)])
+def test_failures(post, capsys, error, status):
+    server.CardRequestHandler.service.error = error
+    assert post({"text": "Some text."})[0] == status
+    if status == 500:
+        assert "KeyError" in capsys.readouterr().err
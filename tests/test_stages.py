@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+
+import pytest
+
+from stages import FunctionStage, Pipeline, Unit
+
+
+def _units(n, produced=None):
+    for i in range(n):
+        if produced is not None:
+            produced.append(i)
+        yield Unit(text=str(i))
+
+
+def test_units_keep_their_order():
+    def slow(units):
+        time.sleep(random.random() / 100)
+        return units
+
+    def double(units):
+        return [Unit(text=f"{unit.text}.{i}") for unit in units for i in range(2)]
+
+    pipeline = Pipeline([FunctionStage("slow", slow, batch_size=3, workers=4),
+                         FunctionStage("double", double),
+                         FunctionStage("batch", slow, batch_size=5, workers=2)],
+                        queue_size=4)
+    out = pipeline.run(_units(50))
+    assert [unit.text for unit in out] == [f"{i}.{j}" for i in range(50)
+                                           for j in range(2)]
+    assert pipeline.run(_units(50), collect=False) is None
+
+
+def test_queues_are_bounded():
+    produced = []
+    pipeline = Pipeline([FunctionStage("a", lambda units: units),
+                         FunctionStage("b", lambda units: units)],
+                        queue_size=2)
+    stream = pipeline.stream(_units(1000, produced))
+    for consumed in range(1, 4):
+        next(stream)
+        time.sleep(0.3)
+        # 3 queues of 2 units, a unit in each stage and one waiting to
+        # be put in each queue
+        assert len(produced) <= consumed + 3 * 2 + 2 + 3
+    stream.close()
+    assert len(produced) < 20
+
+
+def test_errors_stop_the_pipeline():
+    produced = []
+
+    def fail(units):
+        if units[0].text == "10":
+            raise ValueError("unit 10")
+        return units
+
+    pipeline = Pipeline([FunctionStage("fail", fail),
+                         FunctionStage("ok", lambda units: units, workers=2)],
+                        queue_size=2)
+    with pytest.raises(ValueError, match="unit 10"):
+        pipeline.run(_units(1000, produced))
+    assert len(produced) < 30
+    assert not [t for t in threading.enumerate() if t.name.startswith("stage-")]
+
+    def broken_input():
+        yield Unit(text="0")
+        raise OSError("unreadable")
+    with pytest.raises(OSError, match="unreadable"):
+        pipeline.run(broken_input())
+
+
+def test_pipeline_editing():
+    pipeline = Pipeline([FunctionStage(name, lambda units: units)
+                         for name in ["a", "b", "c"]])
+    pipeline.remove("b").insert_after("a", FunctionStage("d", lambda units: units))
+    pipeline.replace("c", FunctionStage("e", lambda units: units))
+    assert [stage.name for stage in pipeline.stages] == ["a", "d", "e"]
+    assert "d" in pipeline and "b" not in pipeline
+    with pytest.raises(KeyError):
+        pipeline["b"]
+
+
+def test_queue_fed_pipeline_does_not_wait_for_full_batches():
+    import queue
+
+    batches = []
+
+    def record(units):
+        batches.append(len(units))
+        return units
+
+    feed = queue.Queue()
+    pipeline = Pipeline([FunctionStage("record", record, batch_size=8)],
+                        max_wait=0.05)
+    stream = pipeline.stream(feed)
+    for i in range(3):
+        feed.put(Unit(text=str(i)))
+    # the partial batch comes out while the pipeline waits for more units
+    assert [next(stream).text for _ in range(3)] == ["0", "1", "2"]
+    assert batches == [3]
+    feed.put(Unit(text="3"))
+    feed.put(None)
+    assert [unit.text for unit in stream] == ["3"]
+    assert batches == [3, 1]
@@ -0,0 +1,38 @@
+from text_filter import TextFilter
+
+FOOTER = "Copyright 2021 Some Publisher, all rights reserved."
+PARAGRAPH = "The Treaty of Westphalia ended the Thirty Years' War in 1648."
+OTHER = "Photosynthesis takes place in the chloroplasts of the plant cells."
+
+
+def test_repeats_are_counted_across_runs():
+    text_filter = TextFilter(max_repeats=2)
+    # a footer repeated once per file
+    assert text_filter.filter([PARAGRAPH, FOOTER]) == [PARAGRAPH, FOOTER]
+    assert text_filter.filter([OTHER, FOOTER]) == [OTHER, FOOTER]
+    # digits are ignored
+    assert text_filter.filter([FOOTER.replace("2021", "2022"), FOOTER]) == []
+    assert text_filter.dropped["boilerplate"] == 2
+
+    text_filter.reset()
+    assert text_filter.dropped == {} and text_filter.kept == 0
+    assert text_filter.filter([FOOTER, FOOTER, FOOTER]) == [FOOTER, FOOTER]
+
+
+def test_seen_paragraphs_are_bounded():
+    text_filter = TextFilter(max_repeats=1, max_seen=2)
+    assert text_filter.filter([FOOTER, PARAGRAPH, OTHER]) == [FOOTER, PARAGRAPH, OTHER]
+    # the footer was forgotten, the least recently seen
+    assert text_filter.filter([FOOTER, OTHER]) == [FOOTER]
+    assert len(text_filter._seen) == 2
+
+
+def test_repeats_are_not_checked_without_max_repeats():
+    assert TextFilter(max_repeats=None).filter([FOOTER] * 3) == [FOOTER] * 3
+
+
+def test_cheap_checks():
+    text_filter = TextFilter(predicates=[lambda text: "Westphalia" not in text])
+    assert text_filter.filter(["short", "12 345 678 910 11 12 13 14", PARAGRAPH]) == []
+    assert text_filter.dropped == {"too short": 1, "not enough letters": 1,
+                                   "<lambda>": 1}
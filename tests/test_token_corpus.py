@@ -0,0 +1,44 @@
+import pickle
+
+from conftest import SAMPLE_TEXT, needs_punkt
+
+
+def _autocards(model):
+    from autocards import Autocards
+    return Autocards(model=model, ans_model=model, profile=False,
+                     text_filter=False, batch_size=2)
+
+
+@needs_punkt
+def test_build_and_read(tiny_model, tmp_path):
+    import token_corpus
+
+    source = tmp_path / "notes.txt"
+    source.write_text(SAMPLE_TEXT)
+    a = _autocards(tiny_model)
+    meta = token_corpus.build([str(source)], tmp_path / "corpus", a)
+    corpus = token_corpus.TokenCorpus(tmp_path / "corpus")
+    assert len(corpus) == meta["paragraphs"] == 3
+    sents, sent_ids = corpus.paragraph(0)
+    assert sents[0].startswith("The steam engine")
+    assert sent_ids == a.qg._encode_spans(sents)
+    assert corpus.document(2) == ("notes.txt", str(source))
+    assert len(pickle.loads(pickle.dumps(corpus))) == len(corpus)
+    assert corpus.shards(2) == [(0, 1), (1, 3)]
+
+
+@needs_punkt
+def test_estimate_consume_corpus(tiny_model, tmp_path):
+    import token_corpus
+
+    source = tmp_path / "notes.txt"
+    source.write_text(SAMPLE_TEXT)
+    a = _autocards(tiny_model)
+    token_corpus.build([str(source)], tmp_path / "corpus", a)
+    a._calibration = {"engine": "qg", "seconds_per_token": 1e-4,
+                      "seconds_per_question": 1e-2, "answers_per_sentence": 1}
+    report = a.estimate("consume_corpus", str(tmp_path / "corpus"))
+    assert report["paragraphs"] == 3
+    assert report["sentences"] == 6
+    assert report["projected_seconds"] is not None
+    assert a.qa_dic_list == []
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import wiki_dump
+
+DUMP = str(Path(__file__).resolve().parent.parent / "examples_script"
+           / "wikipedia_dump" / "sample-pages-articles.xml.bz2")
+
+
+def test_articles_only():
+    # no redirect, no talk page
+    assert [title for title, _ in wiki_dump.iter_pages(DUMP)] == ["Napoleon", "Corsica"]
+
+
+def test_namespaces_and_titles():
+    titles = [title for title, _ in wiki_dump.iter_pages(DUMP, namespaces=None)]
+    assert titles == ["Napoleon", "Talk:Napoleon", "Corsica"]
+    assert [title for title, _ in wiki_dump.iter_pages(DUMP, namespaces=(1,))] \
+        == ["Talk:Napoleon"]
+    assert [title for title, _ in wiki_dump.iter_pages(DUMP, titles=["Corsica"])] \
+        == ["Corsica"]
+    assert [title for title, _ in wiki_dump.iter_pages(
+        DUMP, titles=lambda title: title.startswith("N"))] == ["Napoleon"]
+
+
+def test_page_sections():
+    wikitext = dict(wiki_dump.iter_pages(DUMP))["Napoleon"]
+    sections = wiki_dump.page_sections(wikitext)
+    assert [heading for heading, _ in sections] == ["", "", "Early life"]
+    assert sections[0][1].startswith(
+        "Napoleon Bonaparte (15 August 1769 – 5 May 1821) was a French military "
+        "and political leader who rose to prominence during the French Revolution "
+        "and led successful campaigns")
+    assert sections[2][1] == (
+        "Napoleon was born in Ajaccio, Corsica, in a family descended from minor "
+        "Italian nobility. He was sent to a religious school in Autun in January 1779.")
+    text = " ".join(paragraph for _, paragraph in sections)
+    # templates, references, files, tables, lists, comments and skipped
+    # sections with their subsections
+    for markup in ["{{", "[[", "<ref", "''", "thumb", "1769 || Birth",
+                   "list item", "comment", "List of French monarchs",
+                   "skipped section", "Category"]:
+        assert markup not in text
+
+
+def test_strip_markup():
+    assert wiki_dump.strip_markup(
+        "a [[Link|text]] [[Plain]] [https://x.org site] ''b'' &amp; "
+        "{{outer {{inner}} }}c<ref>source</ref>[1]") == "a text Plain site b & c"
@@ -0,0 +1,95 @@
+"""
+Cheap checks run on each text unit before it reaches the models, to skip
+text that would not give useful cards: navigation, references, tables of
+numbers, footers repeated on every page...
+"""
+
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+
+
+class TextFilter:
+    """
+    Decide which text units are worth a model call. A unit is dropped if:
+        - it is shorter than min_length characters
+        - less than min_alpha_ratio of its non space characters are letters
+        - the same paragraph (ignoring case, digits and spacing, so that
+          "Page 3 of 10" footers match) was already seen max_repeats times
+          by this filter, in any document, so that a footer repeated once
+          per file is found too. None disables this check.
+        - one of predicates, functions taking the text and returning False
+          for text to drop, rejects it
+    The number of units dropped for each reason is counted in self.dropped
+    and the number of units kept in self.kept.
+
+    Only the max_seen most recently seen paragraphs are remembered. They
+    are counted again when a document is consumed again, reset() forgets
+    them.
+    """
+
+    def __init__(self, min_length=20, min_alpha_ratio=0.5, max_repeats=2,
+                 predicates=None, max_seen=100_000):
+        self.min_length = min_length
+        self.min_alpha_ratio = min_alpha_ratio
+        self.max_repeats = max_repeats
+        self.predicates = list(predicates or [])
+        self.max_seen = max_seen
+        self.dropped = Counter()
+        self.kept = 0
+        # times each paragraph was seen, least recently seen first
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, text):
+        normalized = re.sub(r"[\d\s]+", " ", text.lower()).strip()
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+    def _count(self, fingerprint):
+        "Times the paragraph was seen, this one included"
+        count = self._seen.pop(fingerprint, 0) + 1
+        self._seen[fingerprint] = count
+        if len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        return count
+
+    def reason(self, text):
+        "Why text should be dropped, None if it is worth a model call"
+        stripped = text.strip()
+        if len(stripped) < self.min_length:
+            return "too short"
+        chars = [c for c in stripped if not c.isspace()]
+        alpha = sum(c.isalpha() for c in chars)
+        if chars and alpha / len(chars) < self.min_alpha_ratio:
+            return "not enough letters"
+        for predicate in self.predicates:
+            if not predicate(text):
+                return getattr(predicate, "__name__", "predicate")
+        if self.max_repeats is not None:
+            fingerprint = self._fingerprint(stripped)
+            with self._lock:
+                if self._count(fingerprint) > self.max_repeats:
+                    return "boilerplate"
+        return None
+
+    def filter(self, texts):
+        "Return the texts worth a model call, counting the dropped ones"
+        kept = []
+        for text in texts:
+            reason = self.reason(text)
+            with self._lock:
+                if reason is None:
+                    self.kept += 1
+                else:
+                    self.dropped[reason] += 1
+            if reason is None:
+                kept.append(text)
+        return kept
+
+    def reset(self):
+        "Forget the counts and the paragraphs seen"
+        with self._lock:
+            self.dropped.clear()
+            self.kept = 0
+            self._seen.clear()
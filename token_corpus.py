@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized corpus, to consume the same documents many times (other
+decoding settings, other models sharing the tokenizer) without reading,
+cleaning, segmenting and tokenizing them again.
+
+`python token_corpus.py corpus_dir notes/ book.pdf enwiki.xml.bz2` runs
+the documents through the ingest, clean, segment and filter stages of
+Autocards (see stages.py) and writes the paragraphs in corpus_dir:
+    - tokens.bin: token ids of every sentence, one after the other, with
+      the tokenization of QGPipeline (uint16, or uint32 for large vocabs)
+    - sentences.bin: offset of each sentence in tokens (int64), plus the
+      end of the last one
+    - paragraphs.bin: offset of the first sentence of each paragraph in
+      sentences (int64), plus the end of the last one
+    - text.bin and text_offsets.bin: utf-8 text of each sentence and their
+      byte offsets (int64), plus the end of the last one
+    - documents.bin: index of the document of each paragraph (int32)
+    - meta.json: counts, dtypes, tokenizer, and the title and source of
+      each document
+Files are written as a stream, so corpora larger than the memory can be
+built. .xml and .xml.bz2 inputs are read as Wikipedia dumps.
+
+TokenCorpus reads a corpus memory-mapped: paragraphs are only read when
+they are batched. A TokenCorpus can be sent to worker processes, it is
+opened again there instead of being copied, and shards() splits it in
+ranges for them. Autocards.consume_corpus creates cards from it, and
+consume() does it in several worker processes (the workers of the autotune
+profile by default).
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from stages import ModelStage, Unit
+
+FORMAT_VERSION = 1
+
+_FILES = {"tokens": None, "sentences": np.int64, "paragraphs": np.int64,
+          "text_offsets": np.int64, "documents": np.int32}
+
+
+def _tokenizer_info(qg):
+    "What a corpus records about the tokenizer of a question generation pipeline"
+    return {"tokenizer": qg.tokenizer.name_or_path,
+            "vocab_size": len(qg.tokenizer),
+            "model_type": qg.model_type}
+
+
+class CorpusWriter(ModelStage):
+    """
+    Last stage of the pipeline of build: tokenizes the sentences of each
+    text unit with the QGPipeline of autocards and appends them to the
+    corpus at path. finish() writes meta.json.
+    """
+    name = "write"
+    batch_size = 64
+
+    def __init__(self, autocards, path):
+        super().__init__(autocards)
+        from nltk import sent_tokenize
+
+        self.sent_tokenize = sent_tokenize
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        qg = autocards.qg
+        if not hasattr(qg, "_encode_spans"):
+            raise ValueError("Corpora are tokenized for the qg engine, not e2e")
+        self.meta = dict(_tokenizer_info(qg), format=FORMAT_VERSION,
+                         token_dtype="uint16" if len(qg.tokenizer) <= 65536 else "uint32",
+                         paragraphs=0, sentences=0, tokens=0, text_bytes=0,
+                         documents=[])
+        self._document_index = {}
+        self._files = {name: open(self.path / f"{name}.bin", "wb")
+                       for name in list(_FILES) + ["text"]}
+        # each offset table starts at 0
+        for name in ["sentences", "paragraphs", "text_offsets"]:
+            self._files[name].write(np.zeros(1, np.int64).tobytes())
+
+    def _document(self, unit):
+        key = (unit.title, unit.source)
+        if key not in self._document_index:
+            self._document_index[key] = len(self.meta["documents"])
+            self.meta["documents"].append({"title": unit.title,
+                                           "source": str(unit.source)})
+        return self._document_index[key]
+
+    def process(self, units):
+        qg = self.autocards.qg
+        dtype = np.dtype(self.meta["token_dtype"])
+        meta = self.meta
+        for unit in units:
+            sents = self.sent_tokenize(" ".join(unit.text.split()))
+            if not sents:
+                continue
+            sent_ids = qg._encode_spans(sents)
+            encoded = [sent.encode("utf-8") for sent in sents]
+            self._files["tokens"].write(
+                np.fromiter((t for ids in sent_ids for t in ids), dtype).tobytes())
+            self._files["sentences"].write(
+                (meta["tokens"] + np.cumsum([len(ids) for ids in sent_ids])).tobytes())
+            self._files["text"].write(b"".join(encoded))
+            self._files["text_offsets"].write(
+                (meta["text_bytes"] + np.cumsum([len(e) for e in encoded])).tobytes())
+            meta["tokens"] += sum(len(ids) for ids in sent_ids)
+            meta["text_bytes"] += sum(len(e) for e in encoded)
+            meta["sentences"] += len(sents)
+            self._files["paragraphs"].write(np.array([meta["sentences"]], np.int64).tobytes())
+            self._files["documents"].write(np.array([self._document(unit)], np.int32).tobytes())
+            meta["paragraphs"] += 1
+        return units
+
+    def abort(self):
+        "Close the files, without meta.json the corpus can't be read"
+        for f in self._files.values():
+            f.close()
+
+    def finish(self):
+        "Close the files and write meta.json, the corpus is then complete"
+        self.abort()
+        with open(self.path / "meta.json", "w") as f:
+            json.dump(self.meta, f)
+
+
+def _wiki_units(path):
+    "One unit per article of a Wikipedia dump, paragraphs separated by blank lines"
+    import wiki_dump
+
+    for title, wikitext in wiki_dump.iter_pages(path):
+        paragraphs = [p for _, p in wiki_dump.page_sections(wikitext)]
+        if paragraphs:
+            yield Unit(text="\n\n".join(paragraphs), title=title, source=path)
+
+
+def build(sources, path, autocards, per_paragraph=True, packed=False,
+          element="p"):
+    """
+    Write the corpus of the documents at sources (files, urls, Wikipedia
+    dumps) to the directory path, segmented and filtered by autocards like
+    its consume_* methods would. Returns the meta of the corpus.
+    """
+    def units():
+        for source in sources:
+            if str(source).endswith((".xml", ".xml.bz2")):
+                yield from _wiki_units(source)
+            else:
+                yield Unit(source=source)
+
+    writer = CorpusWriter(autocards, path)
+    pipeline = autocards.pipeline(kind="auto", per_paragraph=per_paragraph,
+                                  packed=packed, element=element)
+    for name in ["translate_in", "extract", "generate", "translate", "format"]:
+        pipeline.remove(name)
+    pipeline.insert_after("filter", writer)
+    try:
+        pipeline.run(units(), collect=False)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.finish()
+    print(f"Wrote {writer.meta['paragraphs']} paragraphs, "
+          f"{writer.meta['sentences']} sentences and {writer.meta['tokens']} "
+          f"tokens to {path}")
+    return writer.meta
+
+
+class TokenCorpus:
+    "Memory-mapped reader of a corpus written by build, see the module docstring"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"No corpus at {path}, or it was not \
+completely written")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus format {self.meta['format']}")
+        dtypes = dict(_FILES, tokens=np.dtype(self.meta["token_dtype"]), text=np.uint8)
+        self._arrays = {}
+        for name, dtype in dtypes.items():
+            file = self.path / f"{name}.bin"
+            # numpy can't map empty files
+            self._arrays[name] = np.memmap(file, dtype, mode="r") \
+                if file.stat().st_size else np.zeros(0, dtype)
+
+    def __getstate__(self):
+        # worker processes map the files again instead of receiving a copy
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return self.meta["paragraphs"]
+
+    def check(self, qg):
+        "Raise ValueError if qg does not tokenize like the corpus was"
+        expected = {key: self.meta[key] for key in ["vocab_size", "model_type"]}
+        found = {key: value for key, value in _tokenizer_info(qg).items()
+                 if key in expected}
+        if expected != found:
+            raise ValueError(f"The corpus was tokenized by \
+{self.meta['tokenizer']} ({expected}), which does not match the model's \
+tokenizer ({found})")
+
+    def paragraph(self, i):
+        "Sentences of paragraph i and the token ids of each sentence"
+        sentences = self._arrays["sentences"]
+        text_offsets = self._arrays["text_offsets"]
+        first, last = self._arrays["paragraphs"][i:i + 2]
+        sents, sent_ids = [], []
+        for j in range(first, last):
+            start, end = text_offsets[j:j + 2]
+            sents.append(self._arrays["text"][start:end].tobytes().decode("utf-8"))
+            start, end = sentences[j:j + 2]
+            sent_ids.append(self._arrays["tokens"][start:end].tolist())
+        return sents, sent_ids
+
+    def document(self, i):
+        "Title and source of the document of paragraph i"
+        document = self.meta["documents"][self._arrays["documents"][i]]
+        return document["title"], document["source"]
+
+    def units(self, start=0, stop=None):
+        "Units of the paragraphs from start to stop, for the stage pipeline"
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            sents, sent_ids = self.paragraph(i)
+            title, source = self.document(i)
+            yield Unit(text=" ".join(sents), title=title, source=source,
+                       meta={"segmented": (sents, sent_ids)})
+
+    def shards(self, n):
+        "n (start, stop) ranges of paragraphs of about the same size"
+        bounds = np.linspace(0, len(self), n + 1).astype(int)
+        return [(int(start), int(stop)) for start, stop in zip(bounds, bounds[1:])
+                if stop > start]
+
+
+def _consume_shard(path, start, stop, autocards_kwargs):
+    "qa pairs of the paragraphs start to stop of a corpus, in a worker process"
+    import torch
+    from autocards import Autocards
+
+    autocards = Autocards(**autocards_kwargs)
+    autocards.warmup()
+    if autocards.profile is not None:
+        # the cpus are shared with the other workers
+        torch.set_num_threads(autocards.profile.get("worker_threads",
+                                                    autocards.profile["threads"]))
+    autocards.consume_corpus(path, start, stop)
+    return autocards.qa_dic_list
+
+
+def consume(path, processes=None, **autocards_kwargs):
+    """
+    qa pairs of every paragraph of the corpus at path, created by processes
+    worker processes each consuming a shard with its own copy of the models,
+    Autocards(**autocards_kwargs). processes defaults to the workers of the
+    autotune profile, see autotune.py.
+    """
+    from autocards import Autocards
+
+    if processes is None:
+        # models are only loaded on first use
+        profile = Autocards(**autocards_kwargs).profile
+        processes = profile.get("workers", 1) if profile else 1
+    shards = TokenCorpus(path).shards(processes)
+    if len(shards) < 2:
+        autocards = Autocards(**autocards_kwargs)
+        autocards.consume_corpus(path)
+        return autocards.qa_dic_list
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(shards), mp_context=ctx) as pool:
+        futures = [pool.submit(_consume_shard, str(path), start, stop,
+                               autocards_kwargs) for start, stop in shards]
+        return [qa for future in futures for qa in future.result()]
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+parser.add_argument("corpus", help="directory to write the corpus to")
+parser.add_argument("inputs", nargs="+", help="files, directories, globs, \
+urls or Wikipedia dumps")
+parser.add_argument("--model", default="valhalla/distilt5-qa-qg-hl-12-6",
+                    help="model whose tokenizer is used")
+parser.add_argument("--model-dir", default=None,
+                    help="local model store, see model_store.py")
+parser.add_argument("--packed", action="store_true",
+                    help="pack paragraphs to make the most of each model call")
+parser.add_argument("--whole-text", action="store_true",
+                    help="do not split text files by paragraph")
+parser.add_argument("--element", "-e", type=str, default="p",
+                    help="html element containing the text of web pages")
+
+
+if __name__ == "__main__":
+    from autocards import Autocards
+    from cli import collect_inputs
+
+    args = parser.parse_args()
+    dumps = [p for p in args.inputs if p.endswith((".xml", ".xml.bz2"))]
+    sources = collect_inputs([p for p in args.inputs if p not in dumps]) + dumps
+    build(sources, args.corpus,
+          Autocards(model=args.model, ans_model=args.model,
+                    model_dir=args.model_dir),
+          per_paragraph=not args.whole_text,
+          packed=args.packed,
+          element=args.element)
@@ -0,0 +1,144 @@
+"""
+Streaming reader of local MediaWiki XML dumps, like the
+enwiki-latest-pages-articles.xml.bz2 files of https://dumps.wikimedia.org,
+for Autocards.consume_wiki_dump.
+
+The dump is decompressed and parsed as a stream, one page at a time, and
+each page is cleared once read, so memory does not grow with the size of
+the dump. Wiki markup is stripped with regular expressions: templates,
+tables, references, files and categories are removed, links replaced by
+their text. This is not a complete wikitext parser but gives clean enough
+prose to create cards from.
+"""
+
+import bz2
+import html
+import re
+import xml.etree.ElementTree as ET
+
+# sections that are lists of links or sources rather than prose
+SKIPPED_SECTIONS = ["see also", "references", "external links", "notes",
+                    "further reading", "bibliography", "sources", "citations",
+                    "footnotes", "notes and references", "works cited"]
+
+_HEADING = re.compile(r"^(={2,6})\s*(.*?)\s*\1\s*$", re.MULTILINE)
+_TAG = re.compile(r"<[^>]+>")
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_REF = re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE)
+_BLOCK_TAGS = re.compile(r"<(gallery|math|timeline|score|syntaxhighlight|"
+                         r"source|pre|code)[^>]*>.*?</\1>",
+                         re.DOTALL | re.IGNORECASE)
+_TEMPLATE = re.compile(r"{{[^{}]*}}")
+_TABLE = re.compile(r"{\|[^{}]*?\|}", re.DOTALL)
+_FILE_LINK = re.compile(r"\[\[(?:File|Image|Category|Media):[^\[\]]*\]\]",
+                        re.IGNORECASE)
+_INTERNAL_LINK = re.compile(r"\[\[(?:[^\[\]|]*\|)?([^\[\]|]*)\]\]")
+_EXTERNAL_LINK = re.compile(r"\[(?:https?:)?//[^\s\]]+\s*([^\]]*)\]")
+_EMPHASIS = re.compile(r"'{2,5}")
+
+
+def _open(path):
+    if str(path).endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _local(tag):
+    "Tag name without the xml namespace of the dump"
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_pages(path, namespaces=(0,), titles=None):
+    """
+    Yield the (title, wikitext) of each page of a dump, decompressing it on
+    the fly if it is a .bz2 file. Only pages of the given namespaces are
+    read (0 is articles, None for all of them). titles filters pages by
+    title: a collection of titles, or a function taking the title and
+    returning whether to read the page. Redirects are skipped.
+    """
+    if titles is not None and not callable(titles):
+        titles = set(titles).__contains__
+    with _open(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end" or _local(elem.tag) != "page":
+                continue
+            page = {_local(child.tag): child for child in elem}
+            title = page["title"].text or ""
+            ns = int(page["ns"].text) if "ns" in page else 0
+            revision = page.get("revision")
+            text = None
+            if revision is not None:
+                for child in revision:
+                    if _local(child.tag) == "text":
+                        text = child.text
+            wanted = ("redirect" not in page
+                      and text
+                      and (namespaces is None or ns in namespaces)
+                      and (titles is None or titles(title)))
+            # free the pages already read
+            root.clear()
+            if wanted:
+                yield title, text
+
+
+def _remove_nested(pattern, text):
+    "Remove innermost matches of pattern until there are none left"
+    while True:
+        text, n = pattern.subn("", text)
+        if n == 0:
+            return text
+
+
+def strip_markup(wikitext):
+    "Plain text of wikitext, keeping the == headings == and paragraphs"
+    text = _COMMENT.sub("", wikitext)
+    text = _REF.sub("", text)
+    text = _BLOCK_TAGS.sub("", text)
+    text = _remove_nested(_TEMPLATE, text)
+    text = _remove_nested(_TABLE, text)
+    text = _remove_nested(_FILE_LINK, text)
+    text = _INTERNAL_LINK.sub(r"\1", text)
+    text = _EXTERNAL_LINK.sub(r"\1", text)
+    text = _EMPHASIS.sub("", text)
+    text = _TAG.sub("", text)
+    text = html.unescape(text)
+    # leftovers of unbalanced markup
+    text = text.replace("{{", "").replace("}}", "").replace("[[", "").replace("]]", "")
+    text = re.sub(r"\[\d*\]", "", text)
+
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line.startswith(("*", "#", ":", ";", "|", "!", "{|", "|}")):
+            line = ""  # lists, indents and table rows
+        lines.append(re.sub(r"[ \t]+", " ", line))
+    return "\n".join(lines)
+
+
+def page_sections(wikitext, min_length=40):
+    """
+    Paragraphs of prose of a page, with the title of their section ("" for
+    the introduction), skipping sections like references or external links
+    """
+    text = strip_markup(wikitext)
+    parts = _HEADING.split(text)
+    # parts is [intro, level, heading, content, level, heading, content...]
+    sections = [("", parts[0])] + list(zip(parts[2::3], parts[3::3]))
+    paragraphs = []
+    skipping_level = None
+    levels = [""] + parts[1::3]
+    for level, (heading, content) in zip(levels, sections):
+        # subsections of a skipped section are skipped too
+        if skipping_level is not None and len(level) > skipping_level:
+            continue
+        skipping_level = None
+        if heading.lower() in SKIPPED_SECTIONS:
+            skipping_level = len(level)
+            continue
+        for paragraph in re.split(r"\n\s*\n", content):
+            paragraph = " ".join(paragraph.split())
+            if len(paragraph) > min_length:
+                paragraphs.append((heading, paragraph))
+    return paragraphs